@@ -0,0 +1,181 @@
+# -*- coding: utf-8-*-
+"""
+    Builds n-gram language models in the ARPA format in-process.
+
+    The phrase sets of plugins are tiny, so counting the n-grams and
+    estimating a backoff model in Python takes a few milliseconds, much
+    less than starting the CMUCLMTK tools on temporary files.
+
+    The model uses absolute discounting: every seen n-gram gives away a
+    fixed discount D, and the freed mass goes to the lower order model
+    through the backoff weight of its history.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+import collections
+import math
+
+SENTENCE_START = '<s>'
+SENTENCE_END = '</s>'
+
+# log10 probability ARPA uses for "impossible"
+LOG_ZERO = -99.0
+
+
+def split_sentences(text):
+    """
+    Splits a text in the format CMUCLMTK expects ("<s> words </s> ...")
+    or a list of phrases into lists of words with sentence markers.
+    """
+    if isinstance(text, basestring):
+        words = text.split()
+        sentences = []
+        sentence = []
+        for word in words:
+            if word == SENTENCE_START:
+                sentence = []
+            elif word == SENTENCE_END:
+                sentences.append(sentence)
+                sentence = []
+            else:
+                sentence.append(word)
+        if sentence:
+            sentences.append(sentence)
+    else:
+        sentences = [phrase.split() for phrase in text]
+    return [[SENTENCE_START] + tokens + [SENTENCE_END]
+            for tokens in sentences]
+
+
+class LanguageModel(object):
+    """
+    An n-gram backoff language model estimated from phrases.
+    """
+
+    def __init__(self, phrases, order=3):
+        """
+        Arguments:
+            phrases -- a list of phrases, or a text with sentence markers
+            order -- (optional) the highest n-gram order
+        """
+        self.order = order
+        self.counts = [collections.Counter() for i in range(order)]
+        for sentence in split_sentences(phrases):
+            for n in range(1, order + 1):
+                for i in range(len(sentence) - n + 1):
+                    self.counts[n - 1][tuple(sentence[i:i + n])] += 1
+        self.probs = [{} for i in range(order)]
+        self.backoffs = [{} for i in range(order)]
+        self._estimate()
+
+    @property
+    def words(self):
+        """
+        Returns:
+            The sorted list of words in the model, without the sentence
+            markers
+        """
+        return sorted(ngram[0] for ngram in self.counts[0]
+                      if ngram[0] not in (SENTENCE_START, SENTENCE_END))
+
+    def _discount(self, n):
+        # D = n1 / (n1 + 2 * n2), the usual estimate from count-of-counts,
+        # kept in a sane range for very small phrase sets
+        counts = collections.Counter(self.counts[n - 1].values())
+        if counts[1] + counts[2] == 0:
+            return 0.5
+        return min(max(counts[1] / (counts[1] + 2.0 * counts[2]), 0.1), 0.9)
+
+    def _estimate(self):
+        unigrams = self.counts[0]
+        total = sum(count for ngram, count in unigrams.items()
+                    if ngram[0] != SENTENCE_START)
+        for ngram, count in unigrams.items():
+            if ngram[0] != SENTENCE_START:
+                self.probs[0][ngram] = count / float(total)
+
+        for n in range(2, self.order + 1):
+            discount = self._discount(n)
+            history_totals = collections.Counter()
+            history_types = collections.Counter()
+            for ngram, count in self.counts[n - 1].items():
+                history_totals[ngram[:-1]] += count
+                history_types[ngram[:-1]] += 1
+            followers = collections.defaultdict(list)
+            for ngram, count in self.counts[n - 1].items():
+                history = ngram[:-1]
+                self.probs[n - 1][ngram] = \
+                    (count - discount) / history_totals[history]
+                followers[history].append(ngram[-1])
+
+            for history, words in followers.items():
+                left = discount * history_types[history] / \
+                    history_totals[history]
+                lower = sum(self.prob(word, history[1:]) for word in words)
+                if lower >= 1.0 - 1e-9:
+                    # the lower order has nothing left to back off to
+                    self.backoffs[n - 2][history] = 1.0
+                else:
+                    self.backoffs[n - 2][history] = left / (1.0 - lower)
+
+    def prob(self, word, history=()):
+        """
+        Returns:
+            The probability of word after history, backing off to shorter
+            histories as necessary
+        """
+        history = tuple(history)[-(self.order - 1):] if self.order > 1 else ()
+        ngram = history + (word,)
+        if ngram in self.probs[len(ngram) - 1]:
+            return self.probs[len(ngram) - 1][ngram]
+        if not history:
+            return 0.0
+        backoff = self.backoffs[len(history) - 1].get(history, 1.0)
+        return backoff * self.prob(word, history[1:])
+
+    def to_arpa(self):
+        """
+        Returns:
+            The model in the ARPA text format
+        """
+        def log10(value):
+            return math.log10(value) if value > 0 else LOG_ZERO
+
+        lines = ['\\data\\']
+        sizes = [len(self.counts[n]) for n in range(self.order)]
+        for n, size in enumerate(sizes, start=1):
+            lines.append('ngram %d=%d' % (n, size))
+        for n in range(1, self.order + 1):
+            lines.append('')
+            lines.append('\\%d-grams:' % n)
+            for ngram in sorted(self.counts[n - 1]):
+                prob = LOG_ZERO if ngram == (SENTENCE_START,) else \
+                    log10(self.probs[n - 1][ngram])
+                line = '%.4f %s' % (prob, ' '.join(ngram))
+                if n < self.order and ngram[-1] != SENTENCE_END:
+                    backoff = self.backoffs[n - 1].get(ngram, 1.0)
+                    line += ' %.4f' % log10(backoff)
+                lines.append(line)
+        lines.append('')
+        lines.append('\\end\\')
+        lines.append('')
+        return '\n'.join(lines)
+
+    def write(self, output_file):
+        arpa = self.to_arpa()
+        if isinstance(arpa, unicode):
+            arpa = arpa.encode('utf-8')
+        with open(output_file, 'w') as f:
+            f.write(arpa)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='ARPA language model ' +
+                                     'builder')
+    parser.add_argument('phrases', nargs='+', help='the phrases to model')
+    parser.add_argument('--order', type=int, default=3)
+    args = parser.parse_args()
+    sys.stdout.write(LanguageModel(args.phrases, args.order).to_arpa())
@@ -3,6 +3,10 @@ from __future__ import absolute_import
 import logging
 from . import plugin_loader
 from . import config
+from . import executor
+from . import trace
+from . import triggers
+from . import vocabcompiler
 
 
 class Brain(object):
@@ -19,24 +23,113 @@ class Brain(object):
         """
 
         self.mic = mic
-        self.plugins = plugin_loader.get_plugins()
         self._logger = logging.getLogger(__name__)
         self.handling = False
+        self.executor = executor.PluginExecutor(
+            config.get('plugin_workers', 2))
+        self._table = self._build_table(plugin_loader.get_plugins())
 
-    def query(self, texts, wxbot=None, thirdparty_call=False):
+    @staticmethod
+    def _build_table(plugins):
+        automaton = triggers.TriggerAutomaton()
+        for index, plugin in enumerate(plugins):
+            for word in getattr(plugin, 'TRIGGERS', []):
+                automaton.add(word, index)
+        automaton.build()
+        return (plugins, automaton)
+
+    @property
+    def plugins(self):
+        return self._table[0]
+
+    def reload_plugins(self, changed=None):
+        """
+        Swaps in the current plugins of the plugin loader. Queries that
+        are being dispatched finish with the plugins they started with.
+        If the phrases of the plugins changed, the vocabulary of the
+        active STT engine is recompiled in the background.
+
+        Arguments:
+            changed -- (optional) the names of the changed plugins
+        """
+        self._table = self._build_table(plugin_loader.get_plugins())
+        self._logger.info("Switched to %d plugins", len(self.plugins))
+        engine = getattr(self.mic, 'active_stt_engine', None)
+        if engine is not None:
+            engine.update_phrases(vocabcompiler.get_all_phrases())
+
+    def candidates(self, text):
+        """
+        Returns:
+            The plugins that accept the text, in priority order. Plugins
+            with TRIGGERS are matched all at once, the others are asked
+            through their isValid function.
+        """
+        plugins, automaton = self._table
+        matches = automaton.match(text)
+        return [plugin for index, plugin in enumerate(plugins)
+                if self._accepts(index, plugin, text, matches)]
+
+    def _accepts(self, index, plugin, text, matches):
+        if hasattr(plugin, 'TRIGGERS'):
+            return index in matches
+        return plugin.isValid(text)
+
+    @property
+    def busy(self):
         """
-        Passes user input to the appropriate plugin, testing it against
-        each candidate plugin's isValid function.
+        Returns:
+            True while a plugin is being run
+        """
+        return self.executor.busy
+
+    def cancel(self):
+        """
+        Cancels the running and queued queries. Running plugins stop the
+        next time they speak or listen.
+        """
+        self.executor.cancel_all()
+
+    def query(self, texts, wxbot=None, thirdparty_call=False, block=True):
+        """
+        Passes user input to the appropriate plugin, matching it against
+        the TRIGGERS of all plugins at once and testing it against the
+        isValid function of plugins without TRIGGERS.
+
+        The plugins run on the worker pool of the brain.
 
         Arguments:
         texts -- user input, typically speech, to be parsed by a plugin
         wxbot -- also send the respondsed result to wechat
         thirdparty_call -- call from wechat or email
+        block -- (optional) wait for the plugins to finish
+
+        Returns:
+        The executor.Task of the query
         """
+        if executor.current_task() is not None:
+            # queried from a plugin, don't wait for a worker of our own
+            task = executor.Task(self._dispatch,
+                                 (texts, wxbot, thirdparty_call), {})
+            task.result = self._dispatch(texts, wxbot, thirdparty_call)
+            task._finish()
+            return task
+        task = self.executor.submit(self._dispatch, texts, wxbot,
+                                    thirdparty_call)
+        if block:
+            task.wait()
+        return task
+
+    def _dispatch(self, texts, wxbot, thirdparty_call):
+        with trace.span('brain.query'):
+            self._dispatch_texts(texts, wxbot, thirdparty_call)
 
-        for plugin in self.plugins:
-            for text in texts:
-                if not plugin.isValid(text):
+    def _dispatch_texts(self, texts, wxbot, thirdparty_call):
+        plugins, automaton = self._table
+        matched = [automaton.match(text) for text in texts]
+        for index, plugin in enumerate(plugins):
+            for text, matches in zip(texts, matched):
+                if not self._accepts(index, plugin, text, matches):
                     continue
 
                 # check whether plugin is allow to be call by thirdparty
@@ -52,9 +145,12 @@ class Brain(object):
                 continueHandle = False
                 try:
                     self.handling = True
-                    continueHandle = plugin.handle(text, self.mic,
-                                                   config.get(), wxbot)
-                    self.handling = False
+                    continueHandle = self.executor.run_plugin(
+                        plugin, plugin.handle, text, self.mic, config.get(),
+                        wxbot)
+                except executor.PluginCancelled as e:
+                    self._logger.info("Plugin '%s' stopped: %s",
+                                      plugin.__name__, e)
                 except Exception:
                     self._logger.error('Failed to execute plugin',
                                        exc_info=True)
@@ -65,6 +161,7 @@ class Brain(object):
                                        "plugin '%s' completed", text,
                                        plugin.__name__)
                 finally:
+                    self.handling = False
                     self.mic.stop_passive = False
                     if not continueHandle:
                         return
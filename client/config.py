@@ -1,14 +1,44 @@
 # -*- coding: utf-8-*-
+"""
+    The profile, parsed once and kept up to date.
+
+    Path lookups such as get('/iflytek_yuyin/tts') are split once and
+    their results cached, sections with defaults are merged and cached,
+    and all of it is dropped only when the profile is reloaded. After
+    init(), a background thread checks the modification time of the
+    profile every CHECK_INTERVAL seconds, reloads it when it changed and
+    tells the subscribers which top-level sections changed.
+"""
 import yaml
 import logging
 import os
+import threading
+import time
 from . import dingdangpath
 
+# seconds between checks of the profile's modification time
+CHECK_INTERVAL = 2
+
 _logger = logging.getLogger(__name__)
 _config = {}
+_config_file = None
+_mtime = None
+_lock = threading.RLock()
+_watcher = None
+
+# compiled paths, resolved paths and merged sections of the current
+# profile
+_paths = {}
+_values = {}
+_sections = {}
+
+_subscribers = []
 
+_MISSING = object()
+_NOT_FOUND = object()
 
-def init(config_name='profile.yml'):
+
+def init(config_name='profile.yml', watch=True):
     # Create config dir if it does not exist yet
     if not os.path.exists(dingdangpath.CONFIG_PATH):
         try:
@@ -25,40 +55,129 @@ def init(config_name='profile.yml'):
                          dingdangpath.CONFIG_PATH)
 
     config_file = dingdangpath.config(config_name)
-    global _config
 
     # Read config
     _logger.debug("Trying to read config file: '%s'", config_file)
     try:
-        with open(config_file, "r") as f:
-            _config = yaml.safe_load(f)
+        load(config_file)
     except OSError:
         _logger.error("Can't open config file: '%s'", config_file)
         raise
 
+    global _watcher
+    if watch and _watcher is None:
+        _watcher = threading.Thread(target=_watch, name='config-watcher')
+        _watcher.daemon = True
+        _watcher.start()
+
+
+def load(config_file):
+    """
+    Reads a profile and drops everything cached from the previous one.
+
+    Returns:
+        The set of top-level sections that changed
+    """
+    global _config, _config_file, _mtime
+    mtime = os.path.getmtime(config_file)
+    with open(config_file, "r") as f:
+        config = yaml.safe_load(f) or {}
+    with _lock:
+        previous = _config
+        _config, _config_file, _mtime = config, config_file, mtime
+        _values.clear()
+        _sections.clear()
+    return set(key for key in set(previous) | set(config)
+               if previous.get(key, _MISSING) != config.get(key, _MISSING))
+
+
+def reload_if_changed():
+    """
+    Reloads the profile if its modification time changed and notifies
+    the subscribers.
+
+    Returns:
+        The set of top-level sections that changed
+    """
+    if _config_file is None:
+        return set()
+    try:
+        if os.path.getmtime(_config_file) == _mtime:
+            return set()
+        changed = load(_config_file)
+    except (IOError, OSError, yaml.YAMLError):
+        _logger.error("Can't reload config file: '%s'", _config_file,
+                      exc_info=True)
+        return set()
+    if changed:
+        _logger.info("Profile changed: %s", ', '.join(sorted(changed)))
+        for callback in list(_subscribers):
+            try:
+                callback(changed)
+            except Exception:
+                _logger.error('Config subscriber failed', exc_info=True)
+    return changed
+
+
+def _watch():
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        reload_if_changed()
+
+
+def subscribe(callback):
+    """
+    Calls callback with the set of changed top-level sections whenever
+    the profile has been reloaded.
+    """
+    _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    if callback in _subscribers:
+        _subscribers.remove(callback)
+
+
+def _compile(items):
+    try:
+        return _paths[items]
+    except (KeyError, TypeError):
+        pass
+    if isinstance(items, basestring) and items[0] == '/':
+        keys = tuple(items.split('/')[1:])
+    else:
+        keys = tuple(items)
+    try:
+        _paths[items] = keys
+    except TypeError:
+        # a list
+        pass
+    return keys
+
 
 def get_path(items, default=None):
-    global _config
-    curConfig = _config
-    if isinstance(items, str) and items[0] == '/':
-        items = items.split('/')[1:]
-    for key in items:
-        if key in curConfig:
-            curConfig = curConfig[key]
-        else:
-            _logger.warning("/%s not specified in profile, defaulting to "
-                            "'%s'", '/'.join(items), default)
-            return default
+    keys = _compile(items)
+    curConfig = _values.get(keys, _MISSING)
+    if curConfig is not _MISSING:
+        return default if curConfig is _NOT_FOUND else curConfig
+    with _lock:
+        curConfig = _config
+        for key in keys:
+            if isinstance(curConfig, dict) and key in curConfig:
+                curConfig = curConfig[key]
+            else:
+                _logger.warning("/%s not specified in profile, defaulting to "
+                                "'%s'", '/'.join(keys), default)
+                _values[keys] = _NOT_FOUND
+                return default
+        _values[keys] = curConfig
     return curConfig
 
 
 def has_path(items):
-    global _config
     curConfig = _config
-    if isinstance(items, str) and items[0] == '/':
-        items = items.split('/')[1:]
-    for key in items:
-        if key in curConfig:
+    for key in _compile(items):
+        if isinstance(curConfig, dict) and key in curConfig:
             curConfig = curConfig[key]
         else:
             return False
@@ -80,3 +199,32 @@ def get(item='', default=None):
         _logger.warning("%s not specified in profile, defaulting to '%s'",
                         item, default)
         return default
+
+
+def section(name, **defaults):
+    """
+    Returns:
+        A copy of a top-level section merged into its defaults, with
+        numbers converted to the type of their default
+    """
+    key = (name, tuple(sorted(defaults.items())))
+    merged = _sections.get(key)
+    if merged is None:
+        merged = dict(defaults)
+        values = _config.get(name)
+        if isinstance(values, dict):
+            for option, value in values.items():
+                default = defaults.get(option)
+                if isinstance(default, (int, float)) and \
+                        not isinstance(default, bool) and \
+                        not isinstance(value, type(default)):
+                    try:
+                        value = type(default)(value)
+                    except (TypeError, ValueError):
+                        _logger.warning("Invalid value for %s/%s: %r",
+                                        name, option, value)
+                        continue
+                merged[option] = value
+        with _lock:
+            _sections[key] = merged
+    return dict(merged)
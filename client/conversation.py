@@ -7,6 +7,7 @@ from .brain import Brain
 from . import config
 from .drivers.pixels import Pixels
 from . import statistic
+from . import trace
 
 
 class Conversation(object):
@@ -17,6 +18,7 @@ class Conversation(object):
         self.mic = mic
         self.brain = Brain(mic)
         self.notifier = Notifier(config.get(), self.brain)
+        config.subscribe(self.profileChanged)
         self.wxbot = None
 
         self.pixels = None
@@ -28,6 +30,10 @@ class Conversation(object):
                 self.pixels = Pixels(signal_led_profile['gpio_mode'],
                                      signal_led_profile['pin'])
 
+    def profileChanged(self, sections):
+        # the notifier keeps the profile it was created with
+        self.notifier.reload(config.get())
+
     @staticmethod
     def is_proper_time():
         """
@@ -57,6 +63,8 @@ class Conversation(object):
         """
         self._logger.info("Starting to handle conversation with keyword '%s'.",
                           self.persona)
+        # set when the keyword interrupted a plugin
+        woken = None
         while True:
             # Print notifications until empty
             if self.is_proper_time():
@@ -64,14 +72,20 @@ class Conversation(object):
                 for notif in notifications:
                     self._logger.info("Received notification: '%s'",
                                       str(notif))
-                    self.mic.say(str(notif))
+                    if isinstance(notif, tuple):
+                        self.mic.say(notif[0], args=notif[1])
+                    else:
+                        self.mic.say(str(notif))
 
             if self.mic.stop_passive:
                 self._logger.info("skip conversation for now.")
                 time.sleep(1)
                 continue
 
-            if not self.mic.skip_passive:
+            if woken:
+                threshold = woken
+                woken = None
+            elif not self.mic.skip_passive:
                 self._logger.debug("Started listening for keyword '%s'",
                                    self.persona)
                 threshold, transcribed = self.mic.passiveListen(self.persona)
@@ -88,26 +102,86 @@ class Conversation(object):
                     self.mic.skip_passive = False
                 continue
 
-            if self.pixels:
-                self.pixels.wakeup()
+            # one trace per turn, from the keyword to the end of the reply
+            with trace.span('conversation'):
+                self.mic.in_turn = True
+                try:
+                    woken = self.handleTurn(threshold)
+                finally:
+                    self.mic.in_turn = False
 
-            statistic.report(1)
+    def handleTurn(self, threshold):
+        """
+        Listens to the user after the keyword and answers.
 
-            self._logger.debug("Started to listen actively with threshold: %r",
-                               threshold)
+        Returns:
+            The threshold if the keyword interrupted the answer, else None
+        """
+        woken = None
+        if self.pixels:
+            self.pixels.wakeup()
 
-            input = self.mic.activeListenToAllOptions(threshold)
-            self._logger.debug("Stopped to listen actively with threshold: %r",
-                               threshold)
+        statistic.report(1)
 
-            if self.pixels:
-                self.pixels.think()
+        self._logger.debug("Started to listen actively with threshold: %r",
+                           threshold)
 
-            if input:
-                self.brain.query(input, self.wxbot)
-            elif config.get('shut_up_if_no_input', False):
-                self._logger.info("Active Listen return empty")
-            else:
-                self.mic.say(u"什么?")
-            if self.pixels:
-                self.pixels.off()
+        input = self.mic.activeListenToAllOptions(threshold)
+        self._logger.debug("Stopped to listen actively with threshold: %r",
+                           threshold)
+
+        if self.pixels:
+            self.pixels.think()
+
+        if input:
+            woken = self.handleQuery(input)
+        elif config.get('shut_up_if_no_input', False):
+            self._logger.info("Active Listen return empty")
+        else:
+            self.mic.say(u"什么?", cache=True)
+        if self.pixels:
+            self.pixels.off()
+        return woken
+
+    def handleQuery(self, texts):
+        """
+        Lets the brain handle the input in the background while listening
+        for the keyword, which interrupts the running plugin.
+
+        Returns:
+            The threshold if the keyword has been said, else None
+        """
+        if not getattr(self.mic, 'LISTEN_WHILE_HANDLING', False):
+            # the mic can't tell the keyword from plugin interaction
+            self.brain.query(texts, self.wxbot)
+            return None
+        task = self.brain.query(texts, self.wxbot, block=False)
+        waiting = [True]
+
+        def wake_up(task):
+            # end the passive listening below when the plugin is done
+            if waiting[0]:
+                self.mic.stopPassiveListen()
+
+        task.add_done_callback(wake_up)
+        woken = None
+        while not task.wait(0.1):
+            if task.overdue:
+                # it doesn't check for cancellation, stop waiting for it
+                self._logger.warning("Plugin ran past its deadline")
+                task.cancel()
+                break
+            if self.mic.stop_passive:
+                # the plugin is speaking or listening
+                continue
+            threshold, transcribed = self.mic.passiveListen(self.persona)
+            if threshold and transcribed and not task.done:
+                self._logger.info("Keyword '%s' has been said, cancelling " +
+                                  "the running plugin", self.persona)
+                self.brain.cancel()
+                task.wait(1)
+                woken = threshold
+                break
+        waiting[0] = False
+        self.mic.stop_passive = False
+        return woken
@@ -8,6 +8,7 @@ import subprocess
 import pkgutil
 import logging
 from . import dingdangpath
+from . import tts_cache
 if sys.version_info < (3, 3):
     from distutils.spawn import find_executable
 else:
@@ -146,6 +147,13 @@ def run():
         else:
             logger.debug("File '%s' found", fname)
 
+    stats = tts_cache.get_cache().stats()
+    logger.info("TTS cache: %d hits, %d misses (%.0f%% hit rate), " +
+                "%d evictions, %d entries, %.1f of %.1f MB",
+                stats['hits'], stats['misses'], stats['hit_rate'] * 100,
+                stats['evictions'], stats['entries'],
+                stats['bytes'] / 1048576.0, stats['max_bytes'] / 1048576.0)
+
     if not failed_checks:
         logger.info("All checks passed")
     else:
@@ -0,0 +1,301 @@
+# -*- coding: utf-8-*-
+"""
+    Energy scoring of 16 bit PCM chunks, shared by the listening loops
+    of the Mic class.
+
+    NumPy is optional. If it is installed, many chunks are scored at once
+    in a single vectorized pass, otherwise audioop is used chunk by chunk.
+    Both give exactly the same scores as Mic.getScore(). The levels of
+    chunks in dB relative to full scale (dBFS) are computed the same way.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+import audioop
+import collections
+import logging
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SAMPLE_WIDTH = 2
+
+# the RMS of a full scale square wave, 0 dBFS
+FULL_SCALE = 32768
+
+# the level of silence, about the dynamic range of 16 bit samples
+MIN_DB = -96.0
+
+_logger = logging.getLogger(__name__)
+
+
+def score(data):
+    """
+    Returns the energy score of a single chunk.
+    """
+    return audioop.rms(data, SAMPLE_WIDTH) / 3
+
+
+def scores(data, chunk_bytes):
+    """
+    Returns the energy scores of consecutive chunks.
+
+    Arguments:
+    data -- PCM data of one or more chunks
+    chunk_bytes -- the size of one chunk in bytes
+
+    Returns:
+        A list with one score per chunk. A trailing partial chunk is
+        scored on its own, just like audioop would.
+    """
+    count = len(data) // chunk_bytes
+    result = []
+    if count and np is not None:
+        result = (_rms_many(data, chunk_bytes, count) // 3).tolist()
+    else:
+        for i in range(count):
+            result.append(score(data[i * chunk_bytes:(i + 1) * chunk_bytes]))
+    if len(data) % chunk_bytes:
+        result.append(score(data[count * chunk_bytes:]))
+    return result
+
+
+def _rms_many(data, chunk_bytes, count):
+    # the RMS of the first count chunks, truncated like audioop does
+    samples = np.frombuffer(data, dtype='<i2',
+                            count=count * chunk_bytes // SAMPLE_WIDTH)
+    blocks = samples.reshape(count, -1).astype(np.float64)
+    # squares and their sums are integers well below 2 ** 53, so they are
+    # exact in doubles and we get the very same values as audioop
+    squares = np.einsum('ij,ij->i', blocks, blocks)
+    return np.sqrt(squares / blocks.shape[1]).astype(np.int64)
+
+
+def to_db(rms):
+    """
+    Returns the level in dBFS of an RMS value, MIN_DB for silence.
+    """
+    if rms <= 0:
+        return MIN_DB
+    return max(MIN_DB, 20 * math.log10(float(rms) / FULL_SCALE))
+
+
+def level(data):
+    """
+    Returns the level of a single chunk in dBFS.
+    """
+    return to_db(audioop.rms(data, SAMPLE_WIDTH))
+
+
+def levels(data, chunk_bytes):
+    """
+    Returns the levels of consecutive chunks in dBFS, see scores().
+    """
+    count = len(data) // chunk_bytes
+    result = []
+    if count and np is not None:
+        rms = _rms_many(data, chunk_bytes, count)
+        with np.errstate(divide='ignore'):
+            db = 20 * np.log10(rms / float(FULL_SCALE))
+        result = np.maximum(db, MIN_DB).tolist()
+    else:
+        for i in range(count):
+            result.append(level(data[i * chunk_bytes:(i + 1) * chunk_bytes]))
+    if len(data) % chunk_bytes:
+        result.append(level(data[count * chunk_bytes:]))
+    return result
+
+
+class EnergyWindow(object):
+    """
+    A running sum over the last N scores, kept in a preallocated circular
+    list so that pushing a score and reading the average is O(1).
+
+    The average uses the same arithmetic as sum(lastN) / len(lastN), so
+    windows of integer scores give exactly the same thresholds as the
+    list based loops did.
+    """
+
+    def __init__(self, initial):
+        """
+        Arguments:
+        initial -- the values the window is filled with; its length is
+                   the window size
+        """
+        self._values = list(initial)
+        self.size = len(self._values)
+        self.total = sum(self._values)
+        self._index = 0
+
+    def push(self, value):
+        """
+        Replaces the oldest score of the window with value.
+        """
+        self.total += value - self._values[self._index]
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self.size
+
+    def push_many(self, values):
+        """
+        Pushes several scores, oldest first.
+        """
+        values = list(values)
+        if len(values) < self.size:
+            for value in values:
+                self.push(value)
+            return
+        # the window ends up holding only the newest values
+        self._values = values[len(values) - self.size:]
+        self.total = sum(self._values)
+        self._index = 0
+
+    @property
+    def average(self):
+        return self.total / self.size
+
+
+class NoiseFloorTracker(object):
+    """
+    Keeps an up-to-date estimate of the ambient noise from the captured
+    audio, so that a threshold is available without recording a second
+    of silence first.
+
+    The average score of every second is kept for the last `history`
+    seconds, and the quietest of them is taken as the noise floor. This
+    makes the estimate robust against speech and playback, as long as
+    there has been one quiet second recently.
+    """
+
+    def __init__(self, chunks_per_second, history=15, multiplier=2.5,
+                 path=None):
+        """
+        Arguments:
+        chunks_per_second -- the number of chunks in one second of audio
+        history -- (optional) the seconds the estimate is based on
+        multiplier -- (optional) threshold = noise floor * multiplier
+        path -- (optional) a file the noise floor is persisted to
+        """
+        self.chunks_per_second = chunks_per_second
+        self.multiplier = multiplier
+        self.path = path
+        self.paused = False
+        self._averages = collections.deque(maxlen=history)
+        self._sum = 0
+        self._count = 0
+        self._seconds = 0
+        self._persisted = self._load()
+
+    def _load(self):
+        if not self.path:
+            return None
+        try:
+            with open(self.path, 'r') as f:
+                return float(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self):
+        """
+        Persists the current noise floor, if a path has been given.
+        """
+        floor = self.floor
+        if not self.path or floor is None:
+            return
+        try:
+            with open(self.path, 'w') as f:
+                f.write('%r\n' % floor)
+        except (IOError, OSError):
+            _logger.warning("Couldn't save the noise floor to '%s'",
+                            self.path, exc_info=True)
+
+    def update(self, data):
+        """
+        Feeds one captured chunk. Cheap enough to be called from the
+        capture thread.
+        """
+        if self.paused:
+            return
+        self._sum += score(data)
+        self._count += 1
+        if self._count >= self.chunks_per_second:
+            self._averages.append(self._sum / self._count)
+            self._sum = 0
+            self._count = 0
+            self._seconds += 1
+            if self._seconds % self._averages.maxlen == 0:
+                self.save()
+
+    @property
+    def floor(self):
+        """
+        Returns:
+            The current noise floor, or the persisted one if no full
+            second has been captured yet, or None
+        """
+        averages = list(self._averages)
+        if averages:
+            return min(averages)
+        return self._persisted
+
+    @property
+    def threshold(self):
+        """
+        Returns:
+            The current threshold, or None if there is no estimate yet
+        """
+        floor = self.floor
+        if floor is None:
+            return None
+        return floor * self.multiplier
+
+
+def _legacy_threshold(chunks, size):
+    lastN = list(range(size))
+    for data in chunks:
+        lastN.pop(0)
+        lastN.append(audioop.rms(data, SAMPLE_WIDTH) / 3)
+        average = sum(lastN) / len(lastN)
+    return average
+
+
+def _window_threshold(chunks, size):
+    window = EnergyWindow(range(size))
+    for data in chunks:
+        window.push(score(data))
+    return window.average
+
+
+def _vectorized_threshold(chunks, size):
+    window = EnergyWindow(range(size))
+    window.push_many(scores(b''.join(chunks), len(chunks[0])))
+    return window.average
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import timeit
+
+    parser = argparse.ArgumentParser(description='Energy scoring benchmark')
+    parser.add_argument('--seconds', type=int, default=60,
+                        help='seconds of random 16 kHz audio to score')
+    parser.add_argument('--window', type=int, default=40,
+                        help='the number of scores in the window')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    chunk_bytes = 1024 * SAMPLE_WIDTH
+    count = int(math.ceil(16000.0 * args.seconds / 1024))
+    chunks = [os.urandom(chunk_bytes) for i in range(count)]
+
+    print("NumPy available: %r" % (np is not None))
+    reference = _legacy_threshold(chunks, args.window)
+    for name, func in [('list pop(0)/sum', _legacy_threshold),
+                       ('running window', _window_threshold),
+                       ('vectorized', _vectorized_threshold)]:
+        assert func(chunks, args.window) == reference
+        best = min(timeit.repeat(lambda: func(chunks, args.window),
+                                 number=1, repeat=args.repeat))
+        print("%-16s %8.2f us/chunk" % (name, best * 1e6 / count))
@@ -0,0 +1,273 @@
+# -*- coding: utf-8-*-
+"""
+    Runs plugin handlers on a pool of worker threads, so that a slow
+    plugin doesn't block the conversation.
+
+    Python threads can't be killed, so cancellation is cooperative: a
+    cancelled task, or one that ran past its deadline, raises
+    PluginCancelled the next time it calls check_cancelled(). The Mic
+    does that whenever a plugin speaks or listens, and plugins doing
+    long work of their own can call it too.
+
+    Excerpt from sample profile.yml:
+
+        ...
+        plugin_workers: 2      # number of worker threads
+        plugin_timeout: 120    # default deadline of a plugin in seconds
+        email:
+            timeout: 30        # deadline of a single plugin
+        ...
+"""
+from __future__ import absolute_import
+import collections
+import logging
+import threading
+import time
+import Queue
+
+from . import config
+from . import trace
+
+_logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+class PluginCancelled(Exception):
+    """
+    Raised in a plugin whose task has been cancelled or timed out.
+    """
+    pass
+
+
+def current_task():
+    """
+    Returns:
+        The task running in the calling thread, or None
+    """
+    return getattr(_local, 'task', None)
+
+
+def check_cancelled():
+    """
+    Raises PluginCancelled if the calling thread runs a task that has been
+    cancelled or is past its deadline, does nothing otherwise.
+    """
+    task = current_task()
+    if task is None:
+        return
+    if task.cancelled:
+        raise PluginCancelled('cancelled')
+    if task.overdue:
+        task.timed_out = True
+        raise PluginCancelled('deadline exceeded')
+
+
+def get_timeout(plugin):
+    """
+    Returns:
+        The deadline of a plugin in seconds, from the 'timeout' of its
+        profile section, its TIMEOUT attribute or 'plugin_timeout'
+    """
+    slug = getattr(plugin, 'SLUG', None)
+    if slug and config.has(slug):
+        section = config.get(slug)
+        if isinstance(section, dict) and 'timeout' in section:
+            return section['timeout']
+    return getattr(plugin, 'TIMEOUT', config.get('plugin_timeout', 120))
+
+
+class Task(object):
+    """
+    A function submitted to a PluginExecutor.
+    """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted = time.time()
+        # the span the task was submitted from
+        self.span = trace.current()
+        self.started = None
+        self.deadline = None
+        self.cancelled = False
+        self.timed_out = False
+        self.result = None
+        self.exception = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def overdue(self):
+        return self.deadline is not None and time.time() > self.deadline
+
+    def cancel(self):
+        """
+        Asks the task to stop. A queued task won't run at all, a running
+        one stops at its next check_cancelled().
+        """
+        self.cancelled = True
+
+    def wait(self, timeout=None):
+        """
+        Returns:
+            True if the task is done
+        """
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback with the task once it is done, right away if it
+        already is.
+        """
+        with self._lock:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                _logger.error('Task callback failed', exc_info=True)
+
+
+class PluginExecutor(object):
+    """
+    A pool of worker threads that run tasks in submission order and keep
+    metrics on how long they waited and ran.
+    """
+
+    def __init__(self, workers=2):
+        self._queue = Queue.Queue()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._metrics = collections.defaultdict(lambda: {
+            'count': 0, 'cancelled': 0, 'timeouts': 0, 'errors': 0,
+            'run_total': 0.0, 'run_max': 0.0})
+        self._wait = {'count': 0, 'total': 0.0, 'max': 0.0}
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name='plugin-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues func(*args, **kwargs).
+
+        Returns:
+            A Task instance
+        """
+        task = Task(func, args, kwargs)
+        self._queue.put(task)
+        return task
+
+    def cancel_all(self):
+        """
+        Cancels every queued and running task.
+        """
+        with self._lock:
+            tasks = list(self._running)
+        for task in tasks:
+            task.cancel()
+        while True:
+            try:
+                self._queue.get_nowait().cancel()
+            except Queue.Empty:
+                break
+
+    @property
+    def busy(self):
+        with self._lock:
+            return bool(self._running)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task.cancelled:
+                task._finish()
+                continue
+            task.started = time.time()
+            waited = task.started - task.submitted
+            with self._lock:
+                self._running.add(task)
+                self._wait['count'] += 1
+                self._wait['total'] += waited
+                self._wait['max'] = max(self._wait['max'], waited)
+            _local.task = task
+            try:
+                with trace.attached(task.span):
+                    task.result = task.func(*task.args, **task.kwargs)
+            except Exception as e:
+                task.exception = e
+                _logger.error('Task failed', exc_info=True)
+            finally:
+                _local.task = None
+                with self._lock:
+                    self._running.discard(task)
+                task._finish()
+
+    def run_plugin(self, plugin, func, *args, **kwargs):
+        """
+        Runs a plugin handler within the current task, under the deadline
+        of the plugin, and records its metrics.
+
+        Returns:
+            The result of func
+
+        Raises:
+            PluginCancelled if the handler has been cancelled or timed out
+        """
+        task = current_task()
+        name = getattr(plugin, '__name__', repr(plugin))
+        previous = None
+        if task is not None:
+            previous = task.deadline
+            task.deadline = time.time() + get_timeout(plugin)
+        start = time.time()
+        outcome = None
+        try:
+            with trace.span('plugin', plugin=name):
+                return func(*args, **kwargs)
+        except PluginCancelled:
+            timed_out = task is not None and task.timed_out
+            outcome = 'timeouts' if timed_out else 'cancelled'
+            raise
+        except Exception:
+            outcome = 'errors'
+            raise
+        finally:
+            if task is not None:
+                task.deadline = previous
+            elapsed = time.time() - start
+            with self._lock:
+                metrics = self._metrics[name]
+                metrics['count'] += 1
+                metrics['run_total'] += elapsed
+                metrics['run_max'] = max(metrics['run_max'], elapsed)
+                if outcome:
+                    metrics[outcome] += 1
+            _logger.debug("Plugin '%s' ran for %.2fs", name, elapsed)
+
+    def metrics(self):
+        """
+        Returns:
+            A dict with the queue wait of all tasks under 'queue' and the
+            run time of every plugin under its name
+        """
+        with self._lock:
+            result = dict((name, dict(metrics))
+                          for name, metrics in self._metrics.items())
+            result['queue'] = dict(self._wait)
+        return result
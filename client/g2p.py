@@ -1,17 +1,73 @@
 # -*- coding: utf-8-*-
 from __future__ import absolute_import
+import hashlib
 import os
 import re
 import subprocess
 import tempfile
 import logging
 
-import yaml
+try:
+    import anydbm as dbm  # Python 2
+except ImportError:
+    import dbm
 
+from . import config
 from . import diagnose
 from . import dingdangpath
 
 
+class PhonemeCache(object):
+    """
+    A persistent dbm cache of the pronunciations of single words, keyed by
+    the FST model, nbest and the word itself, so that a vocabulary compile
+    only has to convert the words it hasn't seen before.
+    """
+
+    def __init__(self, path, fst_model, nbest=None):
+        self._logger = logging.getLogger(__name__)
+        self._db = dbm.open(path, 'c')
+        self._prefix = '%s:%s:' % (self._model_hash(fst_model), nbest)
+
+    def _model_hash(self, fst_model):
+        # hashing the model takes a while, so the hash is cached as well
+        # and only recomputed when the file changes
+        stat = os.stat(fst_model)
+        key = 'model:%s' % fst_model
+        version = '%d:%r:' % (stat.st_size, stat.st_mtime)
+        cached = self._db.get(key, '')
+        if cached.startswith(version):
+            return cached[len(version):]
+        sha1 = hashlib.sha1()
+        with open(fst_model, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        self._db[key] = version + sha1.hexdigest()
+        return sha1.hexdigest()
+
+    def _key(self, word):
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+        return self._prefix + word
+
+    def get(self, word):
+        """
+        Returns:
+            A list of pronunciations (empty if phonetisaurus had none), or
+            None if the word isn't cached
+        """
+        value = self._db.get(self._key(word))
+        if value is None:
+            return None
+        return value.split('\n') if value else []
+
+    def set(self, word, pronounciations):
+        self._db[self._key(word)] = '\n'.join(pronounciations)
+
+    def close(self):
+        self._db.close()
+
+
 class PhonetisaurusG2P(object):
     PATTERN = re.compile(r'^(?P<word>.+)\t(?P<precision>\d+\.\d+)\t<s> ' +
                          r'(?P<pronounciation>.*) </s>', re.MULTILINE)
@@ -66,19 +122,16 @@ class PhonetisaurusG2P(object):
 
     @classmethod
     def get_config(cls):
-        conf = {'fst_model': os.path.join(dingdangpath.APP_PATH, os.pardir,
-                                          'phonetisaurus', 'g014b2b.fst')}
         # Try to get fst_model from config
-        profile_path = dingdangpath.config('profile.yml')
-        if os.path.exists(profile_path):
-            with open(profile_path, 'r') as f:
-                profile = yaml.safe_load(f)
-                if 'pocketsphinx' in profile:
-                    if 'fst_model' in profile['pocketsphinx']:
-                        conf['fst_model'] = \
-                            profile['pocketsphinx']['fst_model']
-                    if 'nbest' in profile['pocketsphinx']:
-                        conf['nbest'] = int(profile['pocketsphinx']['nbest'])
+        profile = config.section(
+            'pocketsphinx',
+            fst_model=os.path.join(dingdangpath.APP_PATH, os.pardir,
+                                   'phonetisaurus', 'g014b2b.fst'),
+            nbest=0, g2p_cache=dingdangpath.config('g2p-cache'))
+        conf = {'fst_model': profile['fst_model'],
+                'cache': profile['g2p_cache']}
+        if profile['nbest']:
+            conf['nbest'] = profile['nbest']
         return conf
 
     def __new__(cls, fst_model=None, *args, **kwargs):
@@ -92,7 +145,15 @@ class PhonetisaurusG2P(object):
         inst = object.__new__(cls, fst_model, *args, **kwargs)
         return inst
 
-    def __init__(self, fst_model=None, nbest=None):
+    def __init__(self, fst_model=None, nbest=None,
+                 cache=dingdangpath.config('g2p-cache')):
+        """
+        Arguments:
+            fst_model -- the path of the FST model
+            nbest -- (optional) the number of pronunciations per word
+            cache -- (optional) the path of the phoneme cache, or None to
+                     disable it
+        """
         self._logger = logging.getLogger(__name__)
 
         self.fst_model = os.path.abspath(fst_model)
@@ -102,6 +163,8 @@ class PhonetisaurusG2P(object):
         if self.nbest is not None:
             self._logger.debug("Will use the %d best results.", self.nbest)
 
+        self.cache_path = cache
+
     def _translate_word(self, word):
         return self.execute(self.fst_model, word, nbest=self.nbest)
 
@@ -118,7 +181,49 @@ class PhonetisaurusG2P(object):
         os.remove(tmp_fname)
         return output
 
+    def _open_cache(self):
+        if not self.cache_path:
+            return None
+        try:
+            return PhonemeCache(self.cache_path, self.fst_model, self.nbest)
+        except Exception:
+            self._logger.warning("Can't open phoneme cache '%s'",
+                                 self.cache_path, exc_info=True)
+            return None
+
     def translate(self, words):
+        """
+        Returns:
+            A dict that maps each word phonetisaurus knows to a list of
+            its pronunciations. Only words that are not in the phoneme
+            cache yet are sent to phonetisaurus, in one batch.
+        """
+        if type(words) is str:
+            words = [words]
+        cache = self._open_cache()
+        if cache is None:
+            return self._translate(words)
+        try:
+            output = {}
+            missing = []
+            for word in words:
+                pronounciations = cache.get(word)
+                if pronounciations is None:
+                    missing.append(word)
+                elif pronounciations:
+                    output[word] = pronounciations
+            self._logger.debug('Found %d of %d words in the phoneme cache',
+                               len(words) - len(missing), len(words))
+            if missing:
+                translated = self._translate(sorted(set(missing)))
+                for word in missing:
+                    cache.set(word, translated.get(word, []))
+                output.update(translated)
+            return output
+        finally:
+            cache.close()
+
+    def _translate(self, words):
         if type(words) is str or len(words) == 1:
             self._logger.debug('Converting single word to phonemes')
             output = self._translate_word(words if type(words) is str
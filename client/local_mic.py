@@ -37,5 +37,7 @@ class Mic:
         self.prev = input
         return input
 
-    def say(self, phrase, OPTIONS=None, cache=False):
+    def say(self, phrase, OPTIONS=None, cache=False, args=None):
+        if args is not None:
+            phrase = phrase % args
         print("DINGDANG: %s" % phrase)
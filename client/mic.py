@@ -5,22 +5,36 @@
 from __future__ import absolute_import
 import ctypes
 import logging
-import tempfile
-import wave
-import audioop
+import threading
 import time
 import pyaudio
 from . import dingdangpath
 from . import mute_alsa
 from .app_utils import wechatUser
 from . import config
+from . import executor
 from . import player
 from . import plugin_loader
+from . import recorder
+from . import trace
+from . import energy
+from . import vad
+
+RATE = 16000
+CHUNK = 1024
+
+# seconds to wait for the capture thread before giving up on a chunk
+READ_TIMEOUT = 1
+
+# seconds of audio kept around the speech detected by the endpointer
+SPEECH_PADDING = 0.3
 
 
 class Mic:
     speechRec = None
     speechRec_persona = None
+    # the conversation keeps listening for the keyword while plugins run
+    LISTEN_WHILE_HANDLING = True
 
     def __init__(self, speaker, passive_stt_engine, active_stt_engine):
         """
@@ -51,65 +65,75 @@ class Mic:
         self._audio = pyaudio.PyAudio()
         self._logger.info("Initialization of PyAudio completed.")
         self.sound = player.get_sound_manager(self._audio)
+        self._recorder = recorder.Recorder(self._audio, rate=RATE,
+                                           chunk=CHUNK)
+        noise_floor_file = None
+        if config.get('persist_noise_floor', True):
+            noise_floor_file = dingdangpath.config('noise_floor')
+        self.noise_floor = energy.NoiseFloorTracker(RATE / CHUNK,
+                                                    path=noise_floor_file)
+        self._recorder.add_listener(self.noise_floor.update)
+        self._recorder.start()
+        self._passive_reader = self._recorder.reader()
+        self.endpointer = vad.get_instance(rate=RATE)
+        # (start, end) of the speech in the last active listening, in
+        # seconds from its first chunk
+        self.speech_span = None
         self.stop_passive = False
         self.skip_passive = False
+        # set by the conversation from the keyword to the end of the reply
+        self.in_turn = False
+        # the passive engine whose keyword stream is open, and the position
+        # of the passive cursor where it was left
+        self._keyword_stream = None
+        self._keyword_position = None
         self.chatting_mode = False
+        # plugins run in worker threads, only one thread listens at a time
+        self._listen_lock = threading.RLock()
 
     def __del__(self):
+        self.noise_floor.save()
+        self._recorder.stop()
+        self._recorder.join(READ_TIMEOUT)
         self._audio.terminate()
 
+    def _check_recorder(self):
+        if not self._recorder.is_alive():
+            raise IOError("The capture thread is not running, please " +
+                          "check your microphone.")
+
     def getScore(self, data):
-        rms = audioop.rms(data, 2)
-        score = rms / 3
-        return score
+        return energy.score(data)
 
     def fetchThreshold(self):
+        # the noise floor tracker usually has an estimate already
+        THRESHOLD = self.noise_floor.threshold
+        if THRESHOLD is not None:
+            return THRESHOLD
 
-        # TODO: Consolidate variables from the next three functions
         THRESHOLD_MULTIPLIER = 2.5
-        RATE = 16000
-        CHUNK = 1024
 
         # number of seconds to allow to establish threshold
         THRESHOLD_TIME = 1
 
-        # prepare recording stream
-        stream = self._audio.open(format=pyaudio.paInt16,
-                                  channels=1,
-                                  rate=RATE,
-                                  input=True,
-                                  frames_per_buffer=CHUNK)
+        reader = self._recorder.reader()
 
         # stores the audio data
         frames = []
 
         # stores the lastN score values
-        lastN = [i for i in range(20)]
+        lastN = energy.EnergyWindow(range(20))
 
-        # calculate the long run average, and thereby the proper threshold
         for i in range(0, RATE / CHUNK * THRESHOLD_TIME):
-            try:
-                data = stream.read(CHUNK)
+            data = reader.read(READ_TIMEOUT)
+            if data is not None:
                 frames.append(data)
 
-                # save this data point as a score
-                lastN.pop(0)
-                lastN.append(self.getScore(data))
-                average = sum(lastN) / len(lastN)
-
-            except Exception as e:
-                self._logger.debug(e)
-                continue
-
-        try:
-            stream.stop_stream()
-            stream.close()
-        except Exception as e:
-            self._logger.debug(e)
-            pass
+        # calculate the long run average, and thereby the proper threshold
+        lastN.push_many(energy.scores(''.join(frames), CHUNK * 2))
 
         # this will be the benchmark to cause a disturbance over!
-        THRESHOLD = average * THRESHOLD_MULTIPLIER
+        THRESHOLD = lastN.average * THRESHOLD_MULTIPLIER
 
         return THRESHOLD
 
@@ -122,12 +146,17 @@ class Mic:
     def passiveListen(self, PERSONA):
         """
         Listens for PERSONA in everyday sound. Times out after LISTEN_TIME, so
-        needs to be restarted.
+        needs to be restarted. The passive cursor carries on where the
+        previous call stopped, so no audio is lost between restarts.
         """
+        with self._listen_lock, trace.span('mic.passive_listen') as span:
+            threshold, transcribed = self._passiveListen(PERSONA)
+            span.set(detected=bool(threshold and transcribed))
+            return threshold, transcribed
+
+    def _passiveListen(self, PERSONA):
 
         THRESHOLD_MULTIPLIER = 2.5
-        RATE = 16000
-        CHUNK = 1024
 
         # number of seconds to allow to establish threshold
         THRESHOLD_TIME = 1
@@ -135,44 +164,43 @@ class Mic:
         # number of seconds to listen before forcing restart
         LISTEN_TIME = 10
 
-        # prepare recording stream
-        stream = self._audio.open(format=pyaudio.paInt16,
-                                  channels=1,
-                                  rate=RATE,
-                                  input=True,
-                                  frames_per_buffer=CHUNK)
+        self._check_recorder()
+
+        # skip what has been captured while we were not listening passively
+        reader = self._passive_reader
+        reader.catch_up(RATE / CHUNK * THRESHOLD_TIME)
+
+        # this will be the benchmark to cause a disturbance over!
+        THRESHOLD = self.noise_floor.threshold
+
+        if self.passive_stt_engine.KEYWORD_STREAMING:
+            return self.streamingPassiveListen(
+                reader, PERSONA, THRESHOLD, THRESHOLD_MULTIPLIER,
+                THRESHOLD_TIME + LISTEN_TIME)
 
         # stores the audio data
         frames = []
 
-        # stores the lastN score values
-        lastN = list(range(30))
-
+        # flag raised when sound disturbance detected
         didDetect = False
 
-        # calculate the long run average, and thereby the proper threshold
-        for i in range(0, RATE / CHUNK * THRESHOLD_TIME):
-
-            try:
+        # no estimate of the noise yet, establish the threshold first
+        if THRESHOLD is None:
+            for i in range(0, RATE / CHUNK * THRESHOLD_TIME):
                 if self.stop_passive:
                     self._logger.debug('stop passive')
                     break
 
-                data = stream.read(CHUNK)
-
-                # save this data point as a score
-                lastN.pop(0)
-                lastN.append(self.getScore(data))
-                average = sum(lastN) / len(lastN)
+                data = reader.read(READ_TIMEOUT)
+                if data is not None:
+                    frames.append(data)
 
-                # this will be the benchmark to cause a disturbance over!
-                THRESHOLD = average * THRESHOLD_MULTIPLIER
-
-                # flag raised when sound disturbance detected
-                didDetect = False
-            except Exception as e:
-                self._logger.debug(e)
-                pass
+            # calculate the long run average, and thereby the proper
+            # threshold
+            lastN = energy.EnergyWindow(range(30))
+            lastN.push_many(energy.scores(''.join(frames), CHUNK * 2))
+            frames = []
+            THRESHOLD = lastN.average * THRESHOLD_MULTIPLIER
 
         # start passively listening for disturbance above threshold
         for i in range(0, RATE / CHUNK * LISTEN_TIME):
@@ -182,7 +210,9 @@ class Mic:
                     self._logger.debug('stop passive')
                     break
 
-                data = stream.read(CHUNK)
+                data = reader.read(READ_TIMEOUT)
+                if data is None:
+                    continue
                 frames.append(data)
                 score = self.getScore(data)
 
@@ -196,13 +226,6 @@ class Mic:
         # no use continuing if no flag raised
         if not didDetect:
             self._logger.debug(u"没接收到唤醒指令")
-            try:
-                # self.stop_passive = False
-                stream.stop_stream()
-                stream.close()
-            except Exception as e:
-                self._logger.debug(e)
-                pass
             return None, None
 
         # cutoff any recording before this disturbance was detected
@@ -215,23 +238,17 @@ class Mic:
             try:
                 if self.stop_passive:
                     break
-                data = stream.read(CHUNK)
-                frames.append(data)
+                data = reader.read(READ_TIMEOUT)
+                if data is not None:
+                    frames.append(data)
             except Exception as e:
                 self._logger.debug(e)
                 continue
 
-        # save the audio data
-        try:
-            # self.stop_passive = False
-            stream.stop_stream()
-            stream.close()
-        except Exception as e:
-            self._logger.debug(e)
-            pass
-
-        transcribed = self.passive_stt_engine.transcribe_keyword(
-            ''.join(frames))
+        slug = getattr(self.passive_stt_engine, 'SLUG', None)
+        with trace.span('stt.keyword', engine=slug):
+            transcribed = self.passive_stt_engine.transcribe_keyword(
+                ''.join(frames))
 
         if transcribed is not None and \
            any(PERSONA in phrase for phrase in transcribed):
@@ -239,6 +256,66 @@ class Mic:
 
         return False, transcribed
 
+    def streamingPassiveListen(self, reader, PERSONA, THRESHOLD,
+                               THRESHOLD_MULTIPLIER, LISTEN_TIME):
+        """
+        Feeds every captured chunk to the keyword spotter of the passive
+        STT engine and returns as soon as PERSONA has been spotted, instead
+        of waiting for an energy spike and recording one more second.
+        Chunks above THRESHOLD are passed as voiced, so expensive spotters
+        can skip the others.
+        The keyword stream is kept open when the window times out, so a
+        keyword said across a restart is still spotted, as long as the
+        passive cursor carries on where it stopped.
+        Without a THRESHOLD, the threshold for active listening is taken
+        from the first second of the window.
+        """
+        THRESHOLD_CHUNKS = RATE / CHUNK if THRESHOLD is None else 0
+
+        lastN = energy.EnergyWindow(range(30))
+
+        engine = self.passive_stt_engine
+        if self._keyword_stream is not engine or \
+                reader.position != self._keyword_position:
+            # some audio has been skipped, or the engine has changed
+            self._end_keyword_stream()
+            engine.start_keyword_stream()
+            self._keyword_stream = engine
+        try:
+            for i in range(0, RATE / CHUNK * LISTEN_TIME):
+                if self.stop_passive:
+                    self._logger.debug('stop passive')
+                    self._end_keyword_stream()
+                    break
+
+                data = reader.read(READ_TIMEOUT)
+                if data is None:
+                    continue
+                score = energy.score(data)
+                if i < THRESHOLD_CHUNKS:
+                    lastN.push(score)
+                # until there is a threshold, every chunk counts as voiced
+                voiced = THRESHOLD is None or score > THRESHOLD
+
+                transcribed = engine.process_keyword_chunk(data, voiced)
+                if any(PERSONA in phrase for phrase in transcribed):
+                    self._end_keyword_stream()
+                    if THRESHOLD is None:
+                        THRESHOLD = lastN.average * THRESHOLD_MULTIPLIER
+                    return THRESHOLD, PERSONA
+        except Exception:
+            self._end_keyword_stream()
+            raise
+        self._keyword_position = reader.position
+
+        self._logger.debug(u"没接收到唤醒指令")
+        return None, None
+
+    def _end_keyword_stream(self):
+        engine, self._keyword_stream = self._keyword_stream, None
+        if engine is not None:
+            engine.end_keyword_stream()
+
     def activeListen(self, THRESHOLD=None, LISTEN=True, MUSIC=False):
         """
             Records until a second of silence or times out after 12 seconds
@@ -253,45 +330,55 @@ class Mic:
     def activeListenToAllOptions(self, THRESHOLD=None, LISTEN=True,
                                  MUSIC=False):
         """
-            Records until a second of silence or times out after 12 seconds
+            Records until the endpointer detects the end of speech or
+            times out after its maximum utterance length
 
             Returns a list of the matching options or None
         """
+        executor.check_cancelled()
+        # make a passive listening in another thread give way
+        self.stop_passive = True
+        with self._listen_lock, trace.span('mic.active_listen'):
+            self.stop_passive = False
+            return self._activeListenToAllOptions(THRESHOLD, LISTEN, MUSIC)
+
+    def _activeListenToAllOptions(self, THRESHOLD, LISTEN, MUSIC):
+        # a keyword stream left open by a timed out passive window may
+        # hold an utterance on the decoder the active engine shares
+        self._end_keyword_stream()
         self.beforeListenEvent()
 
-        RATE = 16000
-        CHUNK = 1024
-        LISTEN_TIME = 12
-
         # check if no threshold provided
         if THRESHOLD is None:
             THRESHOLD = self.fetchThreshold()
 
-        # prepare recording stream
-        stream = self._audio.open(format=pyaudio.paInt16,
-                                  channels=1,
-                                  rate=RATE,
-                                  input=True,
-                                  frames_per_buffer=CHUNK)
-
-        frames = []
-        # increasing the range # results in longer pause after command
-        # generation
-        lastN = [THRESHOLD * 1.2] * 40
-
-        for i in range(0, int(RATE / CHUNK * LISTEN_TIME)):
+        self._check_recorder()
+        reader = self._recorder.reader()
+        endpointer = self.endpointer
+        endpointer.reset(THRESHOLD)
+
+        width = pyaudio.get_sample_size(pyaudio.paInt16)
+        padding = int(SPEECH_PADDING * RATE) * width
+        # engines that stream get the audio as soon as speech starts
+        streaming = self.active_stt_engine.PCM_STREAMING
+        slug = getattr(self.active_stt_engine, 'SLUG', None)
+        stream = None
+        audio = bytearray()
+        for i in range(0, int(RATE / CHUNK * endpointer.max_utterance) + 1):
             try:
-                data = stream.read(CHUNK, exception_on_overflow=False)
-                frames.append(data)
-                score = self.getScore(data)
-
-                lastN.pop(0)
-                lastN.append(score)
-
-                average = sum(lastN) / float(len(lastN))
-
-                # TODO: 0.8 should not be a MAGIC NUMBER!
-                if average < THRESHOLD * 0.8:
+                data = reader.read(READ_TIMEOUT)
+                if data is None:
+                    continue
+                audio.extend(data)
+                done = endpointer.process(data)
+                if stream is not None:
+                    stream.push(data)
+                elif streaming and endpointer.speech_start is not None:
+                    stream = self.active_stt_engine.begin_stream(RATE, width,
+                                                                 1)
+                    start = int(endpointer.speech_start * RATE) * width
+                    stream.push(memoryview(audio)[max(0, start - padding):])
+                if done:
                     break
             except Exception as e:
                 self._logger.error(e)
@@ -299,23 +386,31 @@ class Mic:
 
         self.endListenEvent()
 
-        # save the audio data
-        try:
-            stream.stop_stream()
-            stream.close()
-        except Exception as e:
-            self._logger.debug(e)
-            pass
-
-        with tempfile.SpooledTemporaryFile(mode='w+b') as f:
-            wav_fp = wave.open(f, 'wb')
-            wav_fp.setnchannels(1)
-            wav_fp.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
-            wav_fp.setframerate(RATE)
-            wav_fp.writeframes(''.join(frames))
-            wav_fp.close()
-            f.seek(0)
-            return self.active_stt_engine.transcribe(f)
+        if endpointer.speech_start is None:
+            self._logger.info("No speech detected")
+            self.speech_span = None
+            if stream is not None:
+                stream.cancel()
+            return []
+        self.speech_span = (endpointer.speech_start, endpointer.speech_end)
+        self._logger.debug("Speech detected from %.2fs to %.2fs",
+                           *self.speech_span)
+
+        if stream is not None:
+            # the trailing silence has been sent already
+            with trace.span('stt', engine=slug, streaming=True):
+                return stream.finish()
+
+        # drop the silence around the speech before transcribing it, the
+        # slice is a view on the recorded audio, nothing gets copied
+        start = max(0, int(endpointer.speech_start * RATE) * width - padding)
+        end = len(audio)
+        if endpointer.speech_end is not None:
+            end = min(end, int(endpointer.speech_end * RATE) * width +
+                      padding)
+        with trace.span('stt', engine=slug, streaming=False):
+            return self.active_stt_engine.transcribe_pcm(
+                memoryview(audio)[start:end], RATE, width, 1)
 
     def beforeListenEvent(self):
         # run plugins before listen
@@ -347,25 +442,46 @@ class Mic:
 
     def say(self, phrase,
             OPTIONS=" -vdefault+m3 -p 40 -s 160 --stdout > say.wav",
-            cache=False):
-        self._logger.info(u"机器人说：%s" % phrase)
+            cache=False, args=None):
+        """
+        Says a phrase. With args, the phrase is a template for them, e.g.
+        say(u"现在时间是 %s", args=now): only the arguments are
+        synthesized, the rest of the template is cached.
+        """
+        executor.check_cancelled()
+        text = phrase % args if args is not None else phrase
+        self._logger.info(u"机器人说：%s" % text)
         self.stop_passive = True
-        if self.wxbot is not None:
-            wechatUser(config.get(), self.wxbot, "%s: %s" %
-                       (self.robot_name, phrase), "")
-        # incase calling say() method which
-        # have not implement cache feature yet.
-        # the count of args should be 3.
-        if self.speaker.say.__code__.co_argcount > 2:
-            self.speaker.say(phrase, cache)
-        else:
-            self.speaker.say(phrase)
-        time.sleep(1)  # 避免叮当说话时误唤醒
-        self.stop_passive = False
+        # don't take our own voice for ambient noise
+        self.noise_floor.paused = True
+        try:
+            if self.wxbot is not None:
+                wechatUser(config.get(), self.wxbot, "%s: %s" %
+                           (self.robot_name, text), "")
+            if args is not None and hasattr(self.speaker, 'say_template'):
+                self.speaker.say_template(phrase, args)
+            # incase calling say() method which
+            # have not implement cache feature yet.
+            # the count of args should be 3.
+            elif self.speaker.say.__code__.co_argcount > 2:
+                self.speaker.say(text, cache)
+            else:
+                self.speaker.say(text)
+            time.sleep(1)  # 避免叮当说话时误唤醒
+        except executor.PluginCancelled:
+            # a pipelined reply stops between two sentences
+            self._logger.info(u"Stopped saying '%s', the plugin has been "
+                              u"cancelled", text)
+            raise
+        finally:
+            self.noise_floor.paused = False
+            self.stop_passive = False
 
     def play(self, src):
         # play a voice
-        self.sound.play_block(src)
+        executor.check_cancelled()
+        with trace.span('playback'):
+            self.sound.play_block(src)
 
     def play_no_block(self, src):
         self.sound.play(src)
@@ -27,26 +27,39 @@ class Notifier(object):
     def __init__(self, profile, brain):
         self._logger = logging.getLogger(__name__)
         self.q = queue.Queue()
-        self.profile = profile
         self.notifiers = []
         self.brain = brain
+        self.reload(profile)
+
+        sched = BackgroundScheduler(daemon=True)
+        sched.start()
+        sched.add_job(self.gather, 'interval', seconds=120)
+        atexit.register(lambda: sched.shutdown(wait=False))
+
+    def reload(self, profile):
+        """
+        Switches to a new profile, keeping the timestamps of the
+        notification clients that stay enabled.
+        """
+        self.profile = profile
+        timestamps = dict((client.gather, client.timestamp)
+                          for client in self.notifiers)
+        notifiers = []
 
         if 'email' in profile and \
            ('enable' not in profile['email'] or profile['email']['enable']):
-            self.notifiers.append(self.NotificationClient(
-                self.handleEmailNotifications, None))
+            notifiers.append(self.NotificationClient(
+                self.handleEmailNotifications,
+                timestamps.get(self.handleEmailNotifications)))
         else:
             self._logger.debug('email account not set ' +
                                'in profile, email notifier will not be used')
 
         if 'robot' in profile and profile['robot'] == 'emotibot':
-            self.notifiers.append(self.NotificationClient(
-                self.handleRemenderNotifications, None))
-
-        sched = BackgroundScheduler(daemon=True)
-        sched.start()
-        sched.add_job(self.gather, 'interval', seconds=120)
-        atexit.register(lambda: sched.shutdown(wait=False))
+            notifiers.append(self.NotificationClient(
+                self.handleRemenderNotifications,
+                timestamps.get(self.handleRemenderNotifications)))
+        self.notifiers = notifiers
 
     def gather(self):
         [client.run() for client in self.notifiers]
@@ -71,7 +84,8 @@ class Notifier(object):
                                   .strip()], None, True)
                 return ""
             sender = Email.getSender(e)
-            return "您有来自 %s 的新邮件 %s" % (sender, subject)
+            # said as a template, see Mic.say
+            return ("您有来自 %s 的新邮件 %s", (sender, subject))
         for e in emails:
             self.q.put(styleEmail(e))
 
@@ -1,4 +1,5 @@
 # -*- coding: utf-8-*-
+import contextlib
 import subprocess
 import time
 
@@ -20,6 +21,100 @@ _music_instance = None
 # must use only one instance
 _vlc_media_player = None
 
+# pyaudio output streams by format, kept open between sounds
+_streams = {}
+_streams_lock = threading.Lock()
+
+# seconds an output stream may stay idle before it is closed, so the
+# device is released for other programs
+STREAM_IDLE_TIMEOUT = 10
+
+# the timer that closes the idle streams
+_reaper = None
+
+# the PyAudio of the sounds played without one
+_audio = None
+
+
+class _OutputStream(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.used = time.time()
+        self.closed = False
+
+
+def _schedule_reaper():
+    global _reaper
+    if _reaper is None:
+        _reaper = threading.Timer(STREAM_IDLE_TIMEOUT, close_idle_streams)
+        _reaper.daemon = True
+        _reaper.start()
+
+
+def close_idle_streams(timeout=None):
+    """
+    Closes the output streams that have not been used for timeout
+    seconds, STREAM_IDLE_TIMEOUT by default.
+    """
+    global _reaper
+    if timeout is None:
+        timeout = STREAM_IDLE_TIMEOUT
+    now = time.time()
+    with _streams_lock:
+        _reaper = None
+        for key, entry in _streams.items():
+            if now - entry.used < timeout or not entry.lock.acquire(False):
+                continue
+            try:
+                entry.stream.close()
+            except Exception as e:
+                _logger.debug(e)
+            finally:
+                entry.closed = True
+                entry.lock.release()
+            del _streams[key]
+        if _streams:
+            _schedule_reaper()
+
+
+@contextlib.contextmanager
+def output_stream(audio, format, channels, rate):
+    """
+    Holds the open output stream of the format, shared by all sounds of
+    that format, while a sound is written to it. The stream is drained
+    before it is given back, and closed once it has been idle for
+    STREAM_IDLE_TIMEOUT seconds.
+    """
+    key = (id(audio), format, channels, rate)
+    while True:
+        with _streams_lock:
+            entry = _streams.get(key)
+            if entry is None:
+                entry = _OutputStream(audio.open(
+                    format=format, channels=channels, rate=rate,
+                    output=True))
+                _streams[key] = entry
+        entry.lock.acquire()
+        if not entry.closed:
+            break
+        # closed while we were waiting for it
+        entry.lock.release()
+    try:
+        if entry.stream.is_stopped():
+            entry.stream.start_stream()
+        yield entry.stream
+    finally:
+        try:
+            # blocks until the buffered audio has been played
+            entry.stream.stop_stream()
+        finally:
+            entry.used = time.time()
+            entry.lock.release()
+    with _streams_lock:
+        _schedule_reaper()
+
 
 class AbstractSoundPlayer(threading.Thread):
 
@@ -44,9 +139,14 @@ class AudioSoundPlayer(AbstractSoundPlayer):
 
     def __init__(self, src, audio=None, **kwargs):
         import pyaudio
+        global _audio
         super(AudioSoundPlayer, self).__init__(**kwargs)
         if not audio:
-            self.audio = pyaudio.PyAudio()
+            # its streams are kept open, share it
+            with _streams_lock:
+                if _audio is None:
+                    _audio = pyaudio.PyAudio()
+            self.audio = _audio
         else:
             self.audio = audio
         self.src = src
@@ -59,21 +159,17 @@ class AudioSoundPlayer(AbstractSoundPlayer):
 
         _logger.debug("playing wave %s", self.src)
         f = wave.open(self.src, "rb")
-        stream = self.audio.open(
-            format=self.audio.get_format_from_width(f.getsampwidth()),
-            channels=f.getnchannels(),
-            rate=f.getframerate(),
-            output=True)
-
-        self.playing = True
-        data = f.readframes(CHUNK)
-        while data and not self.stop:
-            stream.write(data)
+        with output_stream(
+                self.audio,
+                self.audio.get_format_from_width(f.getsampwidth()),
+                f.getnchannels(), f.getframerate()) as stream:
+            self.playing = True
             data = f.readframes(CHUNK)
-
+            while data and not self.stop:
+                stream.write(data)
+                data = f.readframes(CHUNK)
         self.playing = False
-        stream.stop_stream()
-        stream.close()
+        f.close()
 
     def play(self):
         self.start()
@@ -1,7 +1,39 @@
 # -*- coding: utf-8-*-
+"""
+    Finds the plugins and sorts them by priority.
+
+    Importing every plugin at startup pulls in all of their dependencies
+    before the first wake word, although most plugins are never used in
+    a session. After the first load, the attributes the loader and the
+    brain need (SLUG, PRIORITY, WORDS, TRIGGERS, the hooks, ...) are kept
+    in a manifest, with the modification time of every plugin file. Later
+    startups build LazyPlugin stand-ins from the manifest and only import
+    a plugin the first time one of its functions is needed. A plugin
+    whose file changed is imported right away and its entry refreshed.
+
+    With plugin_reload enabled, a PluginWatcher polls the plugin files
+    and reloads the plugins that changed, were added or were removed
+    while Dingdang is running. A changed plugin is imported into a new
+    module, so a plugin that is running keeps its module as it was, and
+    the previous module is kept if the changed file fails to import.
+
+    Excerpt from sample profile.yml:
+
+        ...
+        plugin_reload: true          # reload changed plugins
+        plugin_reload_interval: 2    # polling interval in seconds
+        ...
+"""
 from __future__ import absolute_import
+import collections
+import imp
+import json
 import logging
+import os
 import pkgutil
+import sys
+import threading
+import time
 from . import dingdangpath
 from . import config
 
@@ -20,40 +52,208 @@ _plugins_after_listen = []
 
 _thirdparty_exclude_plugins = ['netease_music']
 
+# what init_plugins() found, for reload_plugins()
+_locations = []
+_manifest = None
+_modules = {}
+_entries = {}
+_reload_lock = threading.Lock()
+
+MANIFEST_VERSION = 1
+
+# attributes kept in the manifest, so reading them doesn't import
+MANIFEST_ATTRIBUTES = ['SLUG', 'PRIORITY', 'WORDS', 'TRIGGERS', 'TIMEOUT']
 
-def init_plugins():
+
+class LazyPlugin(object):
     """
-    Dynamically loads all the plugins in the plugins folder and sorts
-    them by the PRIORITY key. If no PRIORITY is defined for a given
-    plugin, a priority of 0 is assumed.
+    Stands in for a plugin module until it's needed. The attributes in the
+    manifest are answered from it, any other attribute of the module
+    imports it.
     """
 
-    global _has_init
-    locations = [
-        dingdangpath.PLUGIN_PATH,
-        dingdangpath.CONTRIB_PATH,
-        dingdangpath.CUSTOM_PATH
-    ]
-    _logger.debug("Looking for plugins in: %s",
-                  ', '.join(["'%s'" % location for location in locations]))
+    def __init__(self, name, location, entry):
+        self.__name__ = name
+        self._location = location
+        self._names = frozenset(entry['names'])
+        self._module = None
+        self._lock = threading.Lock()
+        for key, value in entry['values'].items():
+            setattr(self, key, value)
+
+    def provides(self, name):
+        """
+        Returns:
+            True if the plugin has the attribute, without importing it
+        """
+        return name in self.__dict__ or name in self._names
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """
+        Returns:
+            The plugin module, imported on the first call
+        """
+        with self._lock:
+            if self._module is None:
+                start = time.time()
+                self._module = _load_module(self._location, self.__name__)
+                _logger.debug("Imported plugin '%s' in %.3fs",
+                              self.__name__, time.time() - start)
+        return self._module
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._names:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return '<LazyPlugin %r%s>' % (self.__name__,
+                                      '' if self.loaded else ' (not loaded)')
 
-    global _plugins_query, _plugins_before_listen, _plugins_after_listen
-    nameSet = set()
 
-    # plugins that are not allow to be call via Wechat or Email
-    for finder, name, ispkg in pkgutil.walk_packages(locations):
+def _provides(mod, name):
+    if isinstance(mod, LazyPlugin):
+        return mod.provides(name)
+    return hasattr(mod, name)
+
+
+def _load_module(location, name):
+    loader = pkgutil.get_importer(location).find_module(name)
+    if loader is None:
+        raise ImportError("No plugin '%s' in '%s'" % (name, location))
+    return _import_module(loader, name)
+
+
+def _import_module(loader, name):
+    """
+    Imports a plugin into a new module object, unlike loader.load_module()
+    which runs it again in the module already in sys.modules. The new
+    module replaces it in sys.modules only if the import succeeds.
+    """
+    filename = loader.get_filename()
+    code = loader.get_code(name)
+    mod = imp.new_module(name)
+    mod.__file__ = filename
+    mod.__loader__ = loader
+    if loader.is_package(name):
+        mod.__path__ = [os.path.dirname(filename)]
+        mod.__package__ = name
+    previous = sys.modules.get(name)
+    # the plugin may import itself while it runs
+    sys.modules[name] = mod
+    try:
+        exec(code, mod.__dict__)
+    except BaseException:
+        if previous is not None:
+            sys.modules[name] = previous
+        else:
+            sys.modules.pop(name, None)
+        raise
+    return mod
+
+
+def _describe(mod):
+    # the manifest entry of a freshly imported plugin
+    values = {}
+    for key in MANIFEST_ATTRIBUTES:
+        if hasattr(mod, key):
+            try:
+                json.dumps(getattr(mod, key))
+            except (TypeError, ValueError):
+                continue
+            values[key] = getattr(mod, key)
+    names = sorted(name for name in dir(mod) if not name.startswith('_'))
+    return {'names': names, 'values': values}
+
+
+def _read_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('plugins', {})
+
+
+def _write_manifest(path, plugins):
+    tmp = path + '.new'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'plugins': plugins}, f,
+                      indent=1, sort_keys=True)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        _logger.debug("Can't write plugin manifest '%s': %s", path, e)
+
+
+def _scan(locations, cached, current):
+    """
+    Finds the plugins in locations. Plugins whose entry in cached is up to
+    date are taken from current, or else become LazyPlugins, the others
+    are imported.
+
+    Returns:
+        A tuple (modules, entries), both dicts by plugin name, modules in
+        the order they were found
+    """
+    modules = collections.OrderedDict()
+    entries = {}
+    for finder, name, ispkg in pkgutil.iter_modules(locations):
         try:
             loader = finder.find_module(name)
-            mod = loader.load_module(name)
+            filename = loader.get_filename()
+            mtime = os.path.getmtime(filename)
+            entry = cached.get(name)
+            if entry and entry['file'] == filename and \
+                    entry['mtime'] == mtime:
+                mod = current.get(name) or \
+                    LazyPlugin(name, finder.path, entry)
+            elif entry and entry.get('failed') == mtime and name in current:
+                # this version failed to import already
+                mod = current[name]
+            else:
+                try:
+                    mod = _import_module(loader, name)
+                except Exception:
+                    if not entry or name not in current:
+                        raise
+                    _logger.warning("Failed to reload plugin '%s', keeping " +
+                                    "the previous version", name,
+                                    exc_info=True)
+                    mod = current[name]
+                    entry = dict(entry, failed=mtime)
+                else:
+                    entry = _describe(mod)
+                    entry.update(file=filename, mtime=mtime)
+            if not _provides(mod, 'SLUG'):
+                mod.SLUG = name
         except Exception:
             _logger.warning("Skipped plugin '%s' due to an error.", name,
                             exc_info=True)
             continue
+        modules[name] = mod
+        entries[name] = entry
+    return modules, entries
 
-        # check slug
-        if not hasattr(mod, 'SLUG'):
-            mod.SLUG = name
 
+def _register(modules):
+    """
+    Builds the lists of query, before-listen and after-listen plugins and
+    swaps them in.
+    """
+    global _plugins_query, _plugins_before_listen, _plugins_after_listen
+    plugins_query = []
+    plugins_before_listen = []
+    plugins_after_listen = []
+    nameSet = set()
+
+    for name, mod in modules.items():
         # check conflict
         if mod.SLUG in nameSet:
             _logger.warning("plugin '%s' SLUG(%s) has repetition", name,
@@ -68,35 +268,154 @@ def init_plugins():
                 continue
 
         # plugins run at query
-        if hasattr(mod, 'WORDS'):
-            if not hasattr(mod, 'handle') or not hasattr(mod, 'isValid'):
-                _logger.debug("Query plugin '%s' missing handle or isValid",
-                              name)
+        if _provides(mod, 'WORDS'):
+            if not _provides(mod, 'handle') or \
+               not (_provides(mod, 'isValid') or
+                    _provides(mod, 'TRIGGERS')):
+                _logger.debug("Query plugin '%s' missing handle or " +
+                              "isValid/TRIGGERS", name)
             else:
                 _logger.debug("Found query plugin '%s' with words: %r",
                               name, mod.WORDS)
-                _plugins_query.append(mod)
+                plugins_query.append(mod)
 
         # plugins run before listen
-        if hasattr(mod, 'beforeListen'):
+        if _provides(mod, 'beforeListen'):
             _logger.debug("Found before-listen plugin '%s'", name)
-            _plugins_before_listen.append(mod)
+            plugins_before_listen.append(mod)
 
         # plugins run after listen
-        if hasattr(mod, 'afterListen'):
+        if _provides(mod, 'afterListen'):
             _logger.debug("Found after-listen plugin '%s'", name)
-            _plugins_after_listen.append(mod)
+            plugins_after_listen.append(mod)
 
     def sort_priority(m):
         if hasattr(m, 'PRIORITY'):
             return m.PRIORITY
         return 0
-    _plugins_query.sort(key=sort_priority, reverse=True)
-    _plugins_before_listen.sort(key=sort_priority, reverse=True)
-    _plugins_after_listen.sort(key=sort_priority, reverse=True)
+    plugins_query.sort(key=sort_priority, reverse=True)
+    plugins_before_listen.sort(key=sort_priority, reverse=True)
+    plugins_after_listen.sort(key=sort_priority, reverse=True)
+
+    # readers hold on to the list they got, so replacing them is atomic
+    _plugins_query = plugins_query
+    _plugins_before_listen = plugins_before_listen
+    _plugins_after_listen = plugins_after_listen
+
+
+def _default_locations():
+    return [
+        dingdangpath.PLUGIN_PATH,
+        dingdangpath.CONTRIB_PATH,
+        dingdangpath.CUSTOM_PATH
+    ]
+
+
+def init_plugins(locations=None, manifest=dingdangpath.config(
+        'plugin-manifest.json')):
+    """
+    Dynamically loads all the plugins in the plugins folder and sorts
+    them by the PRIORITY key. If no PRIORITY is defined for a given
+    plugin, a priority of 0 is assumed.
+
+    Plugins that are up to date in the manifest aren't imported, see
+    LazyPlugin.
+
+    Arguments:
+        locations -- (optional) the directories to look for plugins in
+        manifest -- (optional) the path of the manifest, None to import
+                    every plugin
+    """
+    global _has_init, _locations, _manifest, _modules, _entries
+    if locations is None:
+        locations = _default_locations()
+    _logger.debug("Looking for plugins in: %s",
+                  ', '.join(["'%s'" % location for location in locations]))
+
+    start = time.time()
+    cached = _read_manifest(manifest) if manifest else {}
+    with _reload_lock:
+        modules, entries = _scan(locations, cached, {})
+        _register(modules)
+        _locations, _manifest = locations, manifest
+        _modules, _entries = modules, entries
+    if manifest and entries != cached:
+        _write_manifest(manifest, entries)
+    _logger.info("Found %d plugins in %.3fs, imported %d", len(entries),
+                 time.time() - start,
+                 len([m for m in modules.values()
+                      if not isinstance(m, LazyPlugin)]))
     _has_init = True
 
 
+def reload_plugins():
+    """
+    Imports the plugins whose files changed or were added since they were
+    last loaded, drops the removed ones and swaps in the new plugin lists.
+    The other plugins are kept as they are.
+
+    Returns:
+        The set of names of the changed, added and removed plugins
+    """
+    global _modules, _entries
+    if not _has_init:
+        init_plugins()
+        return set()
+    with _reload_lock:
+        modules, entries = _scan(_locations, _entries, _modules)
+        changed = set(name for name in set(entries) | set(_entries)
+                      if entries.get(name) != _entries.get(name))
+        if not changed:
+            return changed
+        _register(modules)
+        _modules, _entries = modules, entries
+    if _manifest:
+        _write_manifest(_manifest, entries)
+    _logger.info("Reloaded plugins: %s", ', '.join(sorted(changed)))
+    return changed
+
+
+class PluginWatcher(threading.Thread):
+    """
+    Polls the plugin files for changes and reloads the changed plugins.
+    """
+
+    def __init__(self, callback=None, interval=2):
+        """
+        Arguments:
+            callback -- (optional) called with the set of names of the
+                        changed plugins after they have been swapped in
+            interval -- (optional) the polling interval in seconds
+        """
+        super(PluginWatcher, self).__init__(name='plugin-watcher')
+        self.daemon = True
+        self.callback = callback
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                changed = reload_plugins()
+                if changed and self.callback is not None:
+                    self.callback(changed)
+            except Exception:
+                _logger.error('Failed to reload plugins', exc_info=True)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def get_plugin_files():
+    """
+    Returns:
+        The source files of the plugins found, without importing them
+    """
+    if not _has_init:
+        init_plugins()
+    return [entry['file'] for entry in _entries.values()]
+
+
 def get_plugins():
     if not _has_init:
         init_plugins()
@@ -118,3 +437,32 @@ def get_plugins_after_listen():
 def check_thirdparty_exclude(mod):
     return mod.SLUG in _thirdparty_exclude_plugins
 
+
+if __name__ == '__main__':
+    import argparse
+    import subprocess
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Compares the startup ' +
+                                     'time with and without the manifest')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    # every run starts a fresh interpreter, so nothing is imported yet
+    code = ('import time; from client import plugin_loader; ' +
+            'start = time.time(); ' +
+            'plugin_loader.init_plugins(manifest=%r); ' +
+            'print(time.time() - start)')
+    manifest = os.path.join(tempfile.mkdtemp(), 'plugin-manifest.json')
+
+    def run(path):
+        output = subprocess.check_output(
+            [sys.executable, '-c', code % path], cwd=dingdangpath.APP_PATH)
+        return float(output.split()[-1])
+
+    eager = [run(None) for i in range(args.runs)]
+    run(manifest)
+    lazy = [run(manifest) for i in range(args.runs)]
+    os.remove(manifest)
+    print('import all plugins: %.3fs' % min(eager))
+    print('from the manifest:  %.3fs' % min(lazy))
@@ -7,6 +7,7 @@ import time
 import sys
 
 WORDS = [u"PAIZHAO", u"ZHAOPIAN"]
+TRIGGERS = [u"拍照", u"拍张照"]
 SLUG = "camera"
 
 
@@ -122,4 +123,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return any(word in text for word in ["拍照", "拍张照"])
+    return any(word in text for word in TRIGGERS)
@@ -12,6 +12,7 @@ sys.setdefaultencoding('utf8')
 
 # Standard module stuff
 WORDS = ["XIANLIAO"]
+TRIGGERS = [u"闲聊", u"聊天", u"不聊了"]
 SLUG = "chatting"
 
 
@@ -43,4 +44,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return any(word in text for word in [u"闲聊", u"聊天", u"不聊了"])
+    return any(word in text for word in TRIGGERS)
@@ -2,8 +2,10 @@
 
 import os
 import shutil
+from client import tts_cache
 
 WORDS = [u"HUANCUN"]
+TRIGGERS = [u"清除缓存", u"清空缓存", u"清缓存"]
 SLUG = "cleancache"
 PRIORITY = 0
 
@@ -19,6 +21,7 @@ def handle(text, mic, profile, wxbot=None):
                    number)
         wxBot -- wechat robot
     """
+    tts_cache.get_cache().clear()
     temp = mic.dingdangpath.TEMP_PATH
     shutil.rmtree(temp)
     os.mkdir(temp)
@@ -32,4 +35,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return any(word in text.lower() for word in ["清除缓存", u"清空缓存", u"清缓存"])
+    return any(word in text.lower() for word in TRIGGERS)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8-*-
 
 WORDS = [u"ECHO", u"CHUANHUA"]
+TRIGGERS = [u"echo", u"传话"]
 SLUG = "echo"
 PRIORITY = 0
 
@@ -27,4 +28,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return any(word in text.lower() for word in ["echo", u"传话"])
+    return any(word in text.lower() for word in TRIGGERS)
@@ -8,6 +8,7 @@ import logging
 from dateutil import parser
 
 WORDS = ["EMAIL", "INBOX"]
+TRIGGERS = [u'邮箱', u'邮件']
 SLUG = "email"
 
 
@@ -225,4 +226,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return any(word in text for word in [u'邮箱', u'邮件'])
+    return any(word in text for word in TRIGGERS)
@@ -14,6 +14,8 @@ reload(sys)
 sys.setdefaultencoding('utf8')
 
 WORDS = ["JIATINGZHUSHOU", "ZHUSHOU"]
+TRIGGERS = [u"开启家庭助手", u"开启助手", u"打开家庭助手", u"打开助手",
+            u"家庭助手", u"帮我"]
 SLUG = "homeassistant"
 
 
@@ -67,11 +69,10 @@ def hass(text, mic, profile):
                     except Exception as e:
                         pass
                     if 'measurement' in locals().keys():
-                        text = text + "状态是" + state + measurement
-                        mic.say(text, cache=True)
+                        mic.say(u"%s状态是%s%s",
+                                args=(text, state, measurement))
                     else:
-                        text = text + "状态是" + state
-                        mic.say(text, cache=True)
+                        mic.say(u"%s状态是%s", args=(text, state))
                     break
             elif isinstance(dingdang, dict):
                 if text in dingdang.keys():
@@ -97,6 +98,4 @@ def hass(text, mic, profile):
 
 
 def isValid(text):
-    return any(word in text for word in [u"开启家庭助手",
-                                         u"开启助手", u"打开家庭助手", u"打开助手",
-                                         u"家庭助手", u"帮我"])
+    return any(word in text for word in TRIGGERS)
@@ -4,6 +4,7 @@ from client.app_utils import getTimezone
 from semantic.dates import DateService
 
 WORDS = [u"TIME", u"SHIJIAN", u"JIDIAN"]
+TRIGGERS = [u"时间", u"几点"]
 SLUG = "time"
 
 
@@ -27,7 +28,7 @@ def handle(text, mic, profile, wxbot=None):
         response = u"上午" + response.replace("AM", "")
     elif "PM" in response:
         response = u"下午" + response.replace("PM", "")
-    mic.say(u"现在时间是 %s " % response)
+    mic.say(u"现在时间是 %s ", args=response)
 
 
 def isValid(text):
@@ -37,4 +38,4 @@ def isValid(text):
         Arguments:
         text -- user-input, typically transcribed speech
     """
-    return any(word in text for word in [u"时间", u"几点"])
+    return any(word in text for word in TRIGGERS)
@@ -6,6 +6,9 @@ from client import dingdangpath
 
 WORDS = []
 PRIORITY = -(maxint + 1)
+TTS_PHRASES = [u"抱歉，您能再说一遍吗？",
+               u"听不清楚呢，可以再为我说一次吗？",
+               u"再说一遍好吗？"]
 
 
 def need_robot(profile):
@@ -30,10 +33,7 @@ def handle(text, mic, profile, wxbot=None):
         robot = get_robot_by_slug(slug)
         robot.get_instance(mic, profile, wxbot).chat(text)
     else:
-        messages = [u"抱歉，您能再说一遍吗？",
-                    u"听不清楚呢，可以再为我说一次吗？",
-                    u"再说一遍好吗？"]
-        message = random.choice(messages)
+        message = random.choice(TTS_PHRASES)
         mic.say(message, cache=True)
 
 
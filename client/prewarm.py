@@ -0,0 +1,189 @@
+# -*- coding: utf-8-*-
+"""
+    Synthesizes the fixed replies into the TTS cache ahead of time.
+
+    Many replies are constants said with cache=True. After the cache has
+    been wiped, the first time each of them is said waits for a cloud
+    round trip. The phrases are gathered from the source of the core
+    modules and the plugins, without importing them:
+
+     - literals said with cache=True, e.g. mic.say(u"请重新说", cache=True)
+     - the constant parts of templates said with args, e.g. u"现在时间是 "
+       of mic.say(u"现在时间是 %s", args=now)
+     - the TTS_PHRASES list a plugin declares for the cached replies it
+       builds at run time, e.g. TTS_PHRASES = [u"再说一遍好吗？"]
+
+    After startup, a Prewarmer thread synthesizes the missing ones one by
+    one, pausing between them, waiting while Dingdang is talking or a
+    conversation turn is in progress and stopping once the cache is half
+    full, so it never evicts speech that was actually said.
+
+    Excerpt from sample profile.yml:
+
+        ...
+        tts_prewarm: true        # synthesize fixed replies after startup
+        tts_prewarm_delay: 10    # seconds to wait after startup
+        ...
+"""
+from __future__ import absolute_import
+import ast
+import logging
+import os
+import threading
+
+from . import dingdangpath
+from . import plugin_loader
+from . import tts
+from . import tts_cache
+
+# core modules whose replies are gathered, besides the plugins
+CORE_MODULES = ['conversation.py', 'brain.py', 'robot.py']
+
+# seconds to wait after startup
+DELAY = 10
+
+# seconds between two phrases
+PAUSE = 1
+
+# fill ratio of the cache at which prewarming stops
+MAX_FILL = 0.5
+
+_logger = logging.getLogger(__name__)
+
+
+def _literal(node):
+    if isinstance(node, ast.Str):
+        return node.s.decode('utf-8') if isinstance(node.s, str) else node.s
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _literal(node.left), _literal(node.right)
+        if left is not None and right is not None:
+            return left + right
+    return None
+
+
+def _keyword(node, name):
+    for keyword in node.keywords:
+        if keyword.arg == name:
+            return keyword.value
+    return None
+
+
+def _is_true(node):
+    return getattr(node, 'id', None) == 'True' or \
+        getattr(node, 'value', None) is True
+
+
+def scan_source(source):
+    """
+    Returns:
+        The literal phrases said with cache=True, the constant parts of
+        the literal templates said with args and the phrases declared in
+        TTS_PHRASES by the source of a module
+    """
+    phrases = []
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Call) and \
+                getattr(node.func, 'attr', None) == 'say' and node.args:
+            phrase = _literal(node.args[0])
+            if phrase is None:
+                continue
+            if _keyword(node, 'args') is not None:
+                phrases.extend(part
+                               for part in tts.template_constants(phrase)
+                               if not tts.SILENT.match(part))
+            elif _is_true(_keyword(node, 'cache')):
+                phrases.append(phrase)
+        elif isinstance(node, ast.Assign) and \
+                any(getattr(target, 'id', None) == 'TTS_PHRASES'
+                    for target in node.targets):
+            try:
+                declared = ast.literal_eval(node.value)
+            except ValueError:
+                continue
+            phrases.extend(phrase.decode('utf-8')
+                           if isinstance(phrase, str) else phrase
+                           for phrase in declared)
+    return phrases
+
+
+def get_phrases(files=None):
+    """
+    Arguments:
+        files -- (optional) the source files to scan, the core modules and
+                 the plugins by default
+
+    Returns:
+        The phrases gathered from the files, without duplicates
+    """
+    if files is None:
+        files = [os.path.join(dingdangpath.LIB_PATH, name)
+                 for name in CORE_MODULES] + plugin_loader.get_plugin_files()
+    phrases = []
+    for fname in files:
+        try:
+            with open(fname, 'r') as f:
+                found = scan_source(f.read())
+        except (IOError, SyntaxError, ValueError, UnicodeDecodeError):
+            _logger.debug("Can't scan '%s' for phrases", fname,
+                          exc_info=True)
+            continue
+        phrases.extend(phrase for phrase in found if phrase not in phrases)
+    return phrases
+
+
+class Prewarmer(threading.Thread):
+    """
+    Synthesizes phrases into the cache of the speaker of a mic in the
+    background.
+    """
+
+    def __init__(self, mic, phrases, delay=DELAY, pause=PAUSE):
+        super(Prewarmer, self).__init__(name='tts-prewarm')
+        self.daemon = True
+        self.mic = mic
+        self.phrases = phrases
+        self.delay = delay
+        self.pause = pause
+        self.synthesized = 0
+        self._stopped = threading.Event()
+
+    def _full(self):
+        stats = tts_cache.get_cache().stats()
+        return stats['bytes'] >= stats['max_bytes'] * MAX_FILL
+
+    def _busy(self):
+        # passive listening holds the listen lock all the time, so the
+        # turn is told by its own flag
+        return getattr(self.mic, 'stop_passive', False) or \
+            getattr(self.mic, 'in_turn', False)
+
+    def run(self):
+        if self._stopped.wait(self.delay):
+            return
+        for phrase in self.phrases:
+            # the speaker may be swapped when the profile changes
+            speaker = getattr(self.mic, 'speaker', None)
+            if not hasattr(speaker, 'prewarm'):
+                _logger.debug("The TTS engine has no cache")
+                return
+            if self._full():
+                _logger.info("TTS cache is half full, stopped prewarming")
+                break
+            while self._busy():
+                if self._stopped.wait(self.pause):
+                    return
+            try:
+                if not speaker.prewarm(phrase):
+                    continue
+            except Exception:
+                _logger.warning(u"Failed to prewarm '%s'", phrase,
+                                exc_info=True)
+            else:
+                self.synthesized += 1
+            if self._stopped.wait(self.pause):
+                return
+        _logger.info("Prewarmed %d of %d fixed phrases", self.synthesized,
+                     len(self.phrases))
+
+    def stop(self):
+        self._stopped.set()
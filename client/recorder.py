@@ -0,0 +1,268 @@
+# -*- coding: utf-8-*-
+"""
+    A long-lived capture thread that keeps the microphone open for the
+    whole life of the process and writes PCM chunks into a ring buffer.
+
+    Passive and active listening read from the buffer through their own
+    cursors, so opening the input device only happens once.
+"""
+from __future__ import absolute_import
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class RingBuffer(object):
+    """
+    A fixed-size ring buffer of equally sized PCM chunks. One writer
+    appends chunks, any number of readers follow it through cursors.
+    """
+
+    def __init__(self, chunk_bytes, capacity):
+        """
+        Arguments:
+        chunk_bytes -- the size of one chunk in bytes
+        capacity -- the number of chunks the buffer holds
+        """
+        self.chunk_bytes = chunk_bytes
+        self.capacity = capacity
+        self._data = bytearray(chunk_bytes * capacity)
+        self._lengths = [0] * capacity
+        self._written = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def written(self):
+        """
+        Returns:
+            The number of chunks written since the buffer was created
+        """
+        return self._written
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, data):
+        """
+        Appends a chunk, overwriting the oldest one if the buffer is full.
+        """
+        with self._cond:
+            slot = self._written % self.capacity
+            start = slot * self.chunk_bytes
+            length = min(len(data), self.chunk_bytes)
+            self._data[start:start + length] = data[:length]
+            self._lengths[slot] = length
+            self._written += 1
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Wakes up all waiting readers, no more chunks will be written.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, position, timeout=None):
+        """
+        Reads the chunk at the given position, waiting for it to be
+        written if necessary.
+
+        Arguments:
+        position -- the sequence number of the chunk to read
+        timeout -- (optional) seconds to wait for the chunk
+
+        Returns:
+            A tuple (data, next_position). data is None if the chunk was
+            not available before the timeout or the buffer was closed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while position >= self._written and not self._closed:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if position >= self._written:
+                return None, position
+            oldest = self._written - self.capacity
+            if position < oldest:
+                _logger.debug("reader overrun, skipped %d chunks",
+                              oldest - position)
+                position = oldest
+            slot = position % self.capacity
+            start = slot * self.chunk_bytes
+            data = bytes(self._data[start:start + self._lengths[slot]])
+            return data, position + 1
+
+    def reader(self, lookback=0):
+        """
+        Creates a cursor on this buffer.
+
+        Arguments:
+        lookback -- (optional) the number of already written chunks the
+                    cursor starts before the current write position
+
+        Returns:
+            A RingBufferReader instance
+        """
+        with self._cond:
+            lookback = min(lookback, self.capacity, self._written)
+            return RingBufferReader(self, self._written - lookback)
+
+
+class RingBufferReader(object):
+    """
+    A cursor on a RingBuffer.
+    """
+
+    def __init__(self, ring, position):
+        self._ring = ring
+        self.position = position
+
+    @property
+    def lag(self):
+        """
+        Returns:
+            The number of chunks written but not read by this cursor yet
+        """
+        return self._ring.written - self.position
+
+    def read(self, timeout=None):
+        """
+        Returns the next chunk, or None on timeout or if the buffer has
+        been closed.
+        """
+        data, self.position = self._ring.read(self.position, timeout)
+        return data
+
+    def catch_up(self, max_lag=0):
+        """
+        Moves the cursor forward so that it lags at most max_lag chunks
+        behind the writer.
+        """
+        self.position = max(self.position, self._ring.written - max_lag)
+
+
+class Recorder(threading.Thread):
+    """
+    Reads 16 bit mono PCM from the input device in its own thread and
+    writes it into a RingBuffer.
+    """
+
+    # consecutive read errors after which the input device is reopened,
+    # the thread exits if it keeps failing after that
+    MAX_READ_ERRORS = 10
+
+    # seconds to wait after a read error, doubled on every consecutive one
+    BACKOFF = 0.05
+    MAX_BACKOFF = 1
+
+    def __init__(self, audio, rate=16000, chunk=1024, buffer_time=30):
+        """
+        Arguments:
+        audio -- a pyaudio.PyAudio instance
+        rate -- (optional) the sample rate
+        chunk -- (optional) the number of frames per chunk
+        buffer_time -- (optional) the seconds of audio kept in the buffer
+        """
+        super(Recorder, self).__init__()
+        self.daemon = True
+        self.audio = audio
+        self.rate = rate
+        self.chunk = chunk
+        self.buffer = RingBuffer(chunk * 2,
+                                 int(rate * buffer_time / chunk) + 1)
+        self._listeners = []
+        self._stop_event = threading.Event()
+
+    def add_listener(self, listener):
+        """
+        Registers a callable that gets every captured chunk. It is called
+        from the capture thread, so it must return quickly.
+        """
+        self._listeners.append(listener)
+
+    def _open(self):
+        import pyaudio
+        return self.audio.open(format=pyaudio.paInt16,
+                               channels=1,
+                               rate=self.rate,
+                               input=True,
+                               frames_per_buffer=self.chunk)
+
+    def _close(self, stream):
+        try:
+            stream.stop_stream()
+            stream.close()
+        except Exception as e:
+            _logger.debug(e)
+
+    def run(self):
+        try:
+            stream = self._open()
+        except Exception:
+            _logger.error("Failed to open the input device", exc_info=True)
+            self.buffer.close()
+            return
+
+        _logger.debug("Capture thread started")
+        errors = 0
+        reopened = False
+        while not self._stop_event.is_set():
+            try:
+                data = stream.read(self.chunk, exception_on_overflow=False)
+            except Exception as e:
+                errors += 1
+                _logger.debug("Failed to read the input device: %s", e)
+                if errors < self.MAX_READ_ERRORS:
+                    self._stop_event.wait(min(self.BACKOFF * 2 ** (errors - 1),
+                                              self.MAX_BACKOFF))
+                    continue
+                if reopened:
+                    # the thread exits, so the mic notices it is gone
+                    _logger.error("The input device keeps failing, " +
+                                  "stopping the capture thread")
+                    break
+                _logger.warning("Reopening the input device after %d " +
+                                "read errors", errors)
+                self._close(stream)
+                try:
+                    stream = self._open()
+                except Exception:
+                    _logger.error("Failed to reopen the input device",
+                                  exc_info=True)
+                    stream = None
+                    break
+                errors = 0
+                reopened = True
+                continue
+            errors = 0
+            reopened = False
+            self.buffer.write(data)
+            for listener in self._listeners:
+                try:
+                    listener(data)
+                except Exception:
+                    _logger.error("Capture listener failed", exc_info=True)
+
+        if stream is not None:
+            self._close(stream)
+        self.buffer.close()
+        _logger.debug("Capture thread stopped")
+
+    def reader(self, lookback=0):
+        """
+        Returns a cursor on the captured audio, see RingBuffer.reader().
+        """
+        return self.buffer.reader(lookback)
+
+    def stop(self):
+        self._stop_event.set()
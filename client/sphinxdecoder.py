@@ -0,0 +1,252 @@
+# -*- coding: utf-8-*-
+"""
+    PocketSphinx decoders shared between the keyword, default and music
+    instances of PocketSphinxSTT.
+
+    Loading the acoustic model is by far the most expensive part of
+    creating a decoder, both in startup time and in memory. With a
+    pocketsphinx that supports named searches, there is one decoder per
+    acoustic model, every vocabulary is registered on it as a search, and
+    the search is switched when an utterance starts. Older versions get
+    one decoder per vocabulary, like before.
+
+    The instances share the decoder, which runs one utterance at a time.
+    The decoder keeps track of the search whose utterance is open: when
+    another search starts one, the open utterance is ended with a
+    warning, and the search it belonged to fails loudly if it feeds more
+    audio to it.
+"""
+from __future__ import absolute_import
+import atexit
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_logger = logging.getLogger(__name__)
+
+_decoders = {}
+_lock = threading.Lock()
+
+
+def _max_rss():
+    # kilobytes on Linux
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _read_dictionary(path):
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) > 1:
+                yield parts[0], ' '.join(parts[1:])
+
+
+class SharedDecoder(object):
+    """
+    A pocketsphinx decoder with one named search per vocabulary.
+    """
+
+    def __init__(self, ps, hmm_dir, vocabulary):
+        """
+        Arguments:
+            ps -- the pocketsphinx module
+            hmm_dir -- the path of the acoustic model
+            vocabulary -- the PocketsphinxVocabulary of the first search
+        """
+        with tempfile.NamedTemporaryFile(prefix='psdecoder_',
+                                         suffix='.log', delete=False) as f:
+            self.logfile = f.name
+        atexit.register(os.remove, self.logfile)
+        self.hmm_dir = hmm_dir
+        self.named_searches = hasattr(ps.Decoder, 'default_config')
+        self._ps = ps
+        self._searches = set()
+        self._current = None
+        # the search whose utterance is open, if any
+        self._utt = None
+        self._utt_lock = threading.RLock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        start, rss = time.time(), _max_rss()
+        self._decoder = self._create(vocabulary)
+        _logger.info("Loaded acoustic model '%s' in %.2fs, max RSS grew " +
+                     "by %d KB", hmm_dir, time.time() - start,
+                     _max_rss() - rss)
+
+    def _create(self, vocabulary):
+        ps = self._ps
+        if self.named_searches:
+            decoder_config = ps.Decoder.default_config()
+            decoder_config.set_string('-hmm', self.hmm_dir)
+            decoder_config.set_string('-logfn', self.logfile)
+            decoder_config.set_string('-lm', vocabulary.languagemodel_file)
+            decoder_config.set_string('-dict', vocabulary.dictionary_file)
+            return ps.Decoder(decoder_config)
+        return ps.Decoder(hmm=self.hmm_dir, logfn=self.logfile,
+                          **vocabulary.decoder_kwargs)
+
+    def add_search(self, vocabulary):
+        """
+        Registers the language model of a vocabulary as a search named
+        after it and adds its words to the dictionary.
+        """
+        if vocabulary.name in self._searches:
+            return
+        self._load_search(vocabulary)
+        self._searches.add(vocabulary.name)
+
+    def _load_search(self, vocabulary):
+        start = time.time()
+        if self.named_searches:
+            missing = [(word, phones) for word, phones
+                       in _read_dictionary(vocabulary.dictionary_file)
+                       if self._decoder.lookup_word(word) is None]
+            for i, (word, phones) in enumerate(missing):
+                # rebuilding the search structures once is enough
+                self._decoder.add_word(word, phones, i == len(missing) - 1)
+            self._decoder.set_lm_file(vocabulary.name,
+                                      vocabulary.languagemodel_file)
+        _logger.debug("Registered search '%s' in %.2fs", vocabulary.name,
+                      time.time() - start)
+
+    def reload(self, vocabulary):
+        """
+        Schedules the search of a recompiled vocabulary to be replaced.
+        Safe to call from any thread, the swap happens in select(), when
+        no utterance is running.
+        """
+        with self._pending_lock:
+            self._pending[vocabulary.name] = vocabulary
+
+    def _swap_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for name, vocabulary in pending.items():
+            if self.named_searches:
+                self._load_search(vocabulary)
+                if name == self._current:
+                    self._current = None
+            else:
+                self._decoder = self._create(vocabulary)
+            _logger.info("Switched search '%s' to revision '%s'", name,
+                         vocabulary.compiled_revision)
+
+    def select(self, name):
+        if self._pending:
+            self._swap_pending()
+        if self.named_searches and name != self._current:
+            self._decoder.set_search(name)
+        self._current = name
+
+    def start_utt(self, name):
+        """
+        Starts an utterance of the named search, ending the utterance
+        that is still open, if any.
+        """
+        with self._utt_lock:
+            if self._utt is not None:
+                _logger.warning("Ending the open utterance of search " +
+                                "'%s' to start one of '%s'", self._utt,
+                                name)
+                self._decoder.end_utt()
+                self._utt = None
+            self.select(name)
+            self._decoder.start_utt()
+            self._utt = name
+
+    def process_raw(self, name, data, no_search, full_utt):
+        with self._utt_lock:
+            if self._utt != name:
+                raise RuntimeError("Search '%s' has no open utterance, "
+                                   "the decoder is used by '%s'" %
+                                   (name, self._utt))
+            return self._decoder.process_raw(data, no_search, full_utt)
+
+    def end_utt(self, name):
+        """
+        Ends the utterance of the named search, unless another search
+        has ended it already.
+        """
+        with self._utt_lock:
+            if self._utt != name:
+                return
+            self._decoder.end_utt()
+            self._utt = None
+
+    def get_hyp(self):
+        """
+        Returns:
+            A tuple (hypothesis, utterance id, score), with either API
+        """
+        if not self.named_searches:
+            return self._decoder.get_hyp()
+        hyp = self._decoder.hyp()
+        if hyp is None:
+            return (None, None, 0)
+        return (hyp.hypstr, None, hyp.best_score)
+
+    def __getattr__(self, name):
+        return getattr(self._decoder, name)
+
+
+class DecoderSearch(object):
+    """
+    The view of a SharedDecoder that PocketSphinxSTT works with. It
+    switches to its own search whenever an utterance starts.
+    """
+
+    def __init__(self, decoder, name):
+        self.decoder = decoder
+        self.name = name
+
+    @property
+    def logfile(self):
+        return self.decoder.logfile
+
+    def start_utt(self):
+        self.decoder.start_utt(self.name)
+
+    def process_raw(self, data, no_search, full_utt):
+        return self.decoder.process_raw(self.name, data, no_search, full_utt)
+
+    def end_utt(self):
+        self.decoder.end_utt(self.name)
+
+    def get_hyp(self):
+        return self.decoder.get_hyp()
+
+    def reload(self, vocabulary):
+        self.decoder.reload(vocabulary)
+
+    def __getattr__(self, name):
+        return getattr(self.decoder, name)
+
+
+def get_decoder(ps, hmm_dir, vocabulary):
+    """
+    Returns:
+        A DecoderSearch for the vocabulary on the decoder of the acoustic
+        model, which is loaded if necessary
+    """
+    with _lock:
+        key = hmm_dir
+        if not hasattr(ps.Decoder, 'default_config'):
+            key = (hmm_dir, vocabulary.path)
+        decoder = _decoders.get(key)
+        if decoder is None:
+            decoder = _decoders[key] = SharedDecoder(ps, hmm_dir, vocabulary)
+        else:
+            _logger.info("Sharing acoustic model '%s' with search '%s'",
+                         hmm_dir, vocabulary.name)
+        decoder.add_search(vocabulary)
+        return DecoderSearch(decoder, vocabulary.name)
@@ -1,24 +1,131 @@
 # -*- coding: utf-8-*-
+"""
+    Usage statistics, reported without holding up the conversation.
+
+    report() only counts the event. A background thread sends the counted
+    events every FLUSH_INTERVAL seconds, one request per event like
+    before, over a single keep-alive connection and with a timeout.
+    Events that couldn't be sent are kept for the next flush, but no more
+    than MAX_PENDING of every type, so an unreachable server costs neither
+    memory nor time.
+"""
 
 from __future__ import absolute_import
 from . import config
+import collections
+import logging
+import threading
+import time
 import uuid
 import requests
 
+URL = 'http://bbs.hahack.com:8022/statistic'
+
+# seconds between flushes
+FLUSH_INTERVAL = 10
+
+# events of a type kept until they are sent
+MAX_PENDING = 100
+
+# seconds to wait for the server
+TIMEOUT = 5
+
+_logger = logging.getLogger(__name__)
+_reporter = None
+_lock = threading.Lock()
+
 
 def getUUID():
     mac = uuid.UUID(int=uuid.getnode()).hex[-12:]
     return ":".join([mac[e:e+2] for e in range(0, 11, 2)])
 
 
-def report(t):
-    config.init()
-    to_report = config.get('statistic', True)
-    if to_report:
+class Reporter(object):
+    """
+    Counts events and sends them in batches from a background thread.
+    """
+
+    def __init__(self, url=URL, interval=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING, timeout=TIMEOUT):
+        self.url = url
+        self.interval = interval
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.dropped = 0
+        self._pending = collections.Counter()
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        # getnode() may run ifconfig, leave it to the background thread
+        self._uuid = None
+        self._thread = None
+
+    def add(self, t):
+        """
+        Counts an event of type t. Never blocks on the network.
+        """
+        with self._lock:
+            if self._pending[t] >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending[t] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='statistic')
+                self._thread.daemon = True
+                self._thread.start()
+
+    @property
+    def pending(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def _run(self):
+        # the first batch goes right away, it's mostly the startup event
+        while True:
+            self.flush()
+            time.sleep(self.interval)
+
+    def flush(self):
+        """
+        Sends the counted events. Stops at the first failure and keeps
+        the events that haven't been sent.
+
+        Returns:
+            The number of events sent
+        """
+        with self._lock:
+            batch, self._pending = self._pending, collections.Counter()
+        sent = 0
+        if self._uuid is None:
+            self._uuid = getUUID()
+        persona = config.get("robot_name", 'DINGDANG')
         try:
-            persona = config.get("robot_name", 'DINGDANG')
-            url = 'http://bbs.hahack.com:8022/statistic'
-            payload = {'type': str(t), 'uuid': getUUID(), 'name': persona}
-            requests.post(url, data=payload)
-        except Exception:
-            return
+            for t in sorted(batch):
+                while batch[t]:
+                    payload = {'type': str(t), 'uuid': self._uuid,
+                               'name': persona}
+                    self._session.post(self.url, data=payload,
+                                       timeout=self.timeout)
+                    batch[t] -= 1
+                    sent += 1
+        except Exception as e:
+            _logger.debug("Failed to report statistics: %s", e)
+        finally:
+            with self._lock:
+                for t, count in batch.items():
+                    if not count:
+                        continue
+                    total = self._pending[t] + count
+                    self.dropped += max(0, total - self.max_pending)
+                    self._pending[t] = min(total, self.max_pending)
+        return sent
+
+
+def report(t):
+    if not config.get('statistic', True):
+        return
+    global _reporter
+    with _lock:
+        if _reporter is None:
+            _reporter = Reporter()
+    _reporter.add(t)
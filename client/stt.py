@@ -3,6 +3,8 @@
 from __future__ import print_function
 from __future__ import absolute_import
 import os
+import audioop
+import collections
 import base64
 import wave
 import json
@@ -10,11 +12,14 @@ import urlparse
 import tempfile
 import logging
 import urllib
+import threading
+import Queue
 from abc import ABCMeta, abstractmethod
 import requests
 from . import dingdangpath
 from . import diagnose
 from . import vocabcompiler
+from . import sphinxdecoder
 from . import config
 from uuid import getnode as get_mac
 import hashlib
@@ -42,6 +47,12 @@ class AbstractSTTEngine(object):
 
     __metaclass__ = ABCMeta
     VOCABULARY_TYPE = None
+    # whether the engine can spot the keyword chunk by chunk
+    KEYWORD_STREAMING = False
+    # whether begin_stream() works on the audio while it is being recorded
+    PCM_STREAMING = False
+    # the vocabulary the instance was created with, if any
+    vocabulary = None
 
     @classmethod
     def get_config(cls):
@@ -49,15 +60,26 @@ class AbstractSTTEngine(object):
 
     @classmethod
     def get_instance(cls, vocabulary_name, phrases):
-        profile = cls.get_config()
+        # a copy, the section may be shared with the config module
+        profile = dict(cls.get_config())
         if cls.VOCABULARY_TYPE:
             vocabulary = cls.VOCABULARY_TYPE(vocabulary_name,
                                              path=dingdangpath.config(
                                                  'vocabularies'))
+            profile['vocabulary'] = vocabulary
             if not vocabulary.matches_phrases(phrases):
+                if vocabulary.is_compiled and \
+                   config.get('background_compile', True):
+                    # start with the last compiled revision and swap in the
+                    # new one once it is ready
+                    instance = cls(**profile)
+                    instance.vocabulary = vocabulary
+                    vocabulary.compile_in_background(
+                        phrases, instance.reload_vocabulary)
+                    return instance
                 vocabulary.compile(phrases)
-            profile['vocabulary'] = vocabulary
         instance = cls(**profile)
+        instance.vocabulary = profile.get('vocabulary')
         return instance
 
     @classmethod
@@ -80,14 +102,121 @@ class AbstractSTTEngine(object):
     def is_available(cls):
         return True
 
+    def update_phrases(self, phrases):
+        """
+        Recompiles the vocabulary of the engine in the background if its
+        phrases changed, e.g. after plugins have been reloaded.
+
+        Returns:
+            The compiling thread, or None if there is nothing to do
+        """
+        if self.vocabulary is None or \
+                self.vocabulary.matches_phrases(phrases):
+            return None
+        return self.vocabulary.compile_in_background(phrases,
+                                                     self.reload_vocabulary)
+
+    def reload_vocabulary(self, vocabulary):
+        """
+        Called from a background thread when a new revision of the
+        vocabulary has been compiled. Engines that can switch to it
+        without being recreated should override this.
+        """
+        logging.getLogger(__name__).info(
+            "Vocabulary '%s' has been recompiled, restart to use it",
+            vocabulary.name)
+
     @abstractmethod
     def transcribe(self, fp):
         pass
 
+    def transcribe_pcm(self, buffer, rate=16000, width=2, channels=1):
+        """
+        Performs STT on raw PCM data. Engines should override this to use
+        the data as it is, the default implementation wraps it into a WAV
+        file for transcribe().
+
+        Arguments:
+            buffer -- a bytes, bytearray or memoryview object holding the
+                      PCM data
+            rate -- (optional) the sample rate
+            width -- (optional) the sample width in bytes
+            channels -- (optional) the number of channels
+        """
+        with tempfile.SpooledTemporaryFile(mode='w+b') as f:
+            wav_fp = wave.open(f, 'wb')
+            wav_fp.setnchannels(channels)
+            wav_fp.setsampwidth(width)
+            wav_fp.setframerate(rate)
+            wav_fp.writeframes(_as_bytes(buffer))
+            wav_fp.close()
+            f.seek(0)
+            return self.transcribe(f)
+
+    def begin_stream(self, rate=16000, width=2, channels=1):
+        """
+        Starts a streaming transcription session. Push PCM chunks into the
+        returned stream while they are being recorded and call its finish()
+        method to get the transcription.
+
+        Engines that can upload audio while the user is still speaking
+        override this, the default implementation buffers the audio and
+        calls transcribe_pcm() on finish().
+
+        Returns:
+            A PCMStream instance
+        """
+        return PCMStream(self, rate, width, channels)
+
+    def transcribe_wav(self, fp):
+        """
+        Reads the PCM data of a WAV file and passes it to transcribe_pcm().
+        Engines that implement transcribe_pcm() use this as transcribe().
+
+        Arguments:
+            fp -- a file object containing a WAV file
+        """
+        try:
+            wav_file = wave.open(fp, 'rb')
+        except (IOError, wave.Error):
+            self._logger.critical('wav file not found: %s',
+                                  fp,
+                                  exc_info=True)
+            return []
+        audio = wav_file.readframes(wav_file.getnframes())
+        return self.transcribe_pcm(audio, wav_file.getframerate(),
+                                   wav_file.getsampwidth(),
+                                   wav_file.getnchannels())
+
     @classmethod
     def transcribe_keyword(self, fp):
         pass
 
+    def start_keyword_stream(self):
+        """
+        Prepares the engine for process_keyword_chunk(). Only called if
+        KEYWORD_STREAMING is True.
+        """
+        pass
+
+    def process_keyword_chunk(self, data, voiced=True):
+        """
+        Feeds one chunk of raw audio to the keyword spotter.
+
+        Arguments:
+            data -- 16 bit mono PCM data
+            voiced -- (optional) False if the energy of the chunk is below
+                      the threshold, spotters that are expensive to run
+                      may skip such chunks
+
+        Returns:
+            A list of the phrases spotted so far, empty if none
+        """
+        return []
+
+    def end_keyword_stream(self):
+        pass
+
 
 class PocketSphinxSTT(AbstractSTTEngine):
     """
@@ -96,6 +225,17 @@ class PocketSphinxSTT(AbstractSTTEngine):
 
     SLUG = 'sphinx'
     VOCABULARY_TYPE = vocabcompiler.PocketsphinxVocabulary
+    KEYWORD_STREAMING = True
+    PCM_STREAMING = True
+
+    # the keyword utterance is restarted after this many chunks, replaying
+    # the last KEYWORD_OVERLAP chunks so that no keyword is cut in half.
+    # The overlap is also replayed when a voiced chunk starts an utterance.
+    KEYWORD_UTT_CHUNKS = 48
+    KEYWORD_OVERLAP = 16
+
+    # unvoiced chunks after which the keyword utterance is ended
+    KEYWORD_HANGOVER = 16
 
     def __init__(self, vocabulary, hmm_dir="/usr/local/share/" +
                  "pocketsphinx/model/hmm/en_US/hub4wsj_sc_8k", **kwargs):
@@ -115,10 +255,6 @@ class PocketSphinxSTT(AbstractSTTEngine):
         except Exception:
             import pocketsphinx as ps
 
-        with tempfile.NamedTemporaryFile(prefix='psdecoder_',
-                                         suffix='.log', delete=False) as f:
-            self._logfile = f.name
-
         self._logger.debug("Initializing PocketSphinx Decoder with hmm_dir " +
                            "'%s'", hmm_dir)
 
@@ -148,11 +284,15 @@ class PocketSphinxSTT(AbstractSTTEngine):
                                  "hmm_dir in your profile.",
                                  hmm_dir, ', '.join(missing_hmm_files))
 
-        self._decoder = ps.Decoder(hmm=hmm_dir, logfn=self._logfile,
-                                   **vocabulary.decoder_kwargs)
+        self._decoder = sphinxdecoder.get_decoder(ps, hmm_dir, vocabulary)
+        self._logfile = self._decoder.logfile
 
-    def __del__(self):
-        os.remove(self._logfile)
+    def reload_vocabulary(self, vocabulary):
+        """
+        Switches to the new revision of the vocabulary when the next
+        utterance starts.
+        """
+        self._decoder.reload(vocabulary)
 
     @classmethod
     def get_config(cls):
@@ -166,14 +306,30 @@ class PocketSphinxSTT(AbstractSTTEngine):
         Arguments:
             fp -- a file object containing audio data
         """
+        return self.transcribe_wav(fp)
 
-        fp.seek(44)
+    def transcribe_pcm(self, buffer, rate=16000, width=2, channels=1):
+        """
+        Performs STT on raw 16 bit mono PCM data and returns the result.
 
+        Arguments:
+            buffer -- a bytes, bytearray or memoryview object
+        """
         # FIXME: Can't use the Decoder.decode_raw() here, because
         # pocketsphinx segfaults with tempfile.SpooledTemporaryFile()
-        data = fp.read()
         self._decoder.start_utt()
-        self._decoder.process_raw(data, False, True)
+        self._decoder.process_raw(_as_bytes(buffer), False, True)
+        return self._end_utterance()
+
+    def begin_stream(self, rate=16000, width=2, channels=1):
+        """
+        Starts an utterance that is decoded chunk by chunk while it is
+        being recorded, so that the hypothesis is ready as soon as the
+        user stops speaking.
+        """
+        return PocketSphinxStream(self)
+
+    def _end_utterance(self):
         self._decoder.end_utt()
 
         result = self._decoder.get_hyp()
@@ -207,6 +363,56 @@ class PocketSphinxSTT(AbstractSTTEngine):
         self._logger.info('PocketSphinx 识别到了：%r', transcribed)
         return transcribed
 
+    def start_keyword_stream(self):
+        self._keyword_chunks = collections.deque(maxlen=self.KEYWORD_OVERLAP)
+        # None while no utterance is being decoded
+        self._keyword_utt_chunks = None
+        self._keyword_unvoiced = 0
+
+    def _start_keyword_utt(self):
+        self._decoder.start_utt()
+        for chunk in self._keyword_chunks:
+            self._decoder.process_raw(chunk, False, False)
+        self._keyword_utt_chunks = len(self._keyword_chunks)
+
+    def process_keyword_chunk(self, data, voiced=True):
+        """
+        Decodes one more chunk of the keyword utterance and returns its
+        partial hypothesis. Unvoiced chunks are only kept for the overlap
+        until a voiced one starts an utterance, which ends again after
+        KEYWORD_HANGOVER unvoiced chunks.
+
+        Arguments:
+            data -- 16 bit mono PCM data
+            voiced -- (optional) whether the chunk is above the threshold
+        """
+        if self._keyword_utt_chunks is None:
+            if not voiced:
+                self._keyword_chunks.append(data)
+                return []
+            self._start_keyword_utt()
+        elif self._keyword_utt_chunks >= self.KEYWORD_UTT_CHUNKS:
+            self._decoder.end_utt()
+            self._start_keyword_utt()
+        self._decoder.process_raw(data, False, False)
+        self._keyword_chunks.append(data)
+        self._keyword_utt_chunks += 1
+        self._keyword_unvoiced = 0 if voiced else self._keyword_unvoiced + 1
+
+        result = self._decoder.get_hyp()
+        if self._keyword_unvoiced >= self.KEYWORD_HANGOVER:
+            self._decoder.end_utt()
+            self._keyword_utt_chunks = None
+        if not result or not result[0]:
+            return []
+        self._logger.debug('PocketSphinx 部分识别结果：%r', result[0])
+        return [result[0]]
+
+    def end_keyword_stream(self):
+        if self._keyword_utt_chunks is not None:
+            self._decoder.end_utt()
+            self._keyword_utt_chunks = None
+
     @classmethod
     def is_available(cls):
         return diagnose.check_python_import('pocketsphinx')
@@ -269,23 +475,18 @@ class BaiduSTT(AbstractSTTEngine):
             return ''
 
     def transcribe(self, fp):
-        try:
-            wav_file = wave.open(fp, 'rb')
-        except IOError:
-            self._logger.critical('wav file not found: %s',
-                                  fp,
-                                  exc_info=True)
-            return []
-        n_frames = wav_file.getnframes()
-        frame_rate = wav_file.getframerate()
-        audio = wav_file.readframes(n_frames)
+        return self.transcribe_wav(fp)
+
+    def transcribe_pcm(self, buffer, rate=16000, width=2, channels=1):
+        audio, rate = _as_mono16(buffer, rate, width, channels,
+                                 (16000, 8000))
         base_data = base64.b64encode(audio)
         if self.token == '':
             self.token = self.get_token()
         data = {"format": "wav",
                 "token": self.token,
                 "len": len(audio),
-                "rate": frame_rate,
+                "rate": rate,
                 "speech": base_data,
                 "cuid": str(get_mac())[:32],
                 "channel": 1}
@@ -348,29 +549,24 @@ class IFlyTekSTT(AbstractSTTEngine):
         return config.get('iflytek_yuyin', {})
 
     def transcribe(self, fp):
-        try:
-            wav_file = wave.open(fp, 'rb')
-        except IOError:
-            self._logger.critical('wav file not found: %s',
-                                  fp,
-                                  exc_info=True)
-            return []
-        n_frames = wav_file.getnframes()
-        frame_rate = wav_file.getframerate()
+        return self.transcribe_wav(fp)
+
+    def transcribe_pcm(self, buffer, rate=16000, width=2, channels=1):
+        audio, rate = _as_mono16(buffer, rate, width, channels,
+                                 (16000, 8000))
         Param = str({
-            "auf": "16k",
+            "auf": "%dk" % (rate // 1000),
             "aue": "raw",
             "scene": "main",
-            "sample_rate": "%s" % str(frame_rate)
+            "sample_rate": "%s" % str(rate)
         })
         XParam = base64.b64encode(Param)
-        audio = wav_file.readframes(n_frames)
         base_data = base64.b64encode(audio)
         data = {
             'voice_data': base_data,
             'api_id': self.api_id,
             'api_key': self.api_key,
-            'sample_rate': frame_rate,
+            'sample_rate': rate,
             'XParam': XParam
         }
         r = requests.post(self.url, data=data)
@@ -441,16 +637,12 @@ class ALiBaBaSTT(AbstractSTTEngine):
         return base64.b64encode(hmacsha1.digest())
 
     def transcribe(self, fp):
-        try:
-            wav_file = wave.open(fp, 'rb')
-        except IOError:
-            self._logger.critical('wav file not found: %s',
-                                  fp,
-                                  exc_info=True)
-            return []
-        n_frames = wav_file.getnframes()
-        frame_rate = wav_file.getframerate()
-        audio = wav_file.readframes(n_frames)
+        return self.transcribe_wav(fp)
+
+    def transcribe_pcm(self, buffer, rate=16000, width=2, channels=1):
+        # the body is signed and sent as a whole, so it has to be a string
+        audio, rate = _as_mono16(buffer, rate, width, channels,
+                                 (16000, 8000))
         date = datetime.datetime.strftime(datetime.datetime.utcnow(),
                                           "%a, %d %b %Y %H:%M:%S GMT")
         options = {
@@ -460,7 +652,7 @@ class ALiBaBaSTT(AbstractSTTEngine):
         }
         headers = {
             'authorization': '',
-            'content-type': 'audio/wav; samplerate=%s' % str(frame_rate),
+            'content-type': 'audio/wav; samplerate=%s' % str(rate),
             'accept': 'application/json',
             'date': date,
             'Content-Length': str(len(audio))
@@ -526,6 +718,7 @@ class SnowboySTT(AbstractSTTEngine):
     """
 
     SLUG = "snowboy-stt"
+    KEYWORD_STREAMING = True
 
     def __init__(self, sensitivity, model, hotword, **kwargs):
         self._logger = logging.getLogger(__name__)
@@ -563,9 +756,10 @@ class SnowboySTT(AbstractSTTEngine):
         return profile
 
     def transcribe(self, fp):
-        fp.seek(44)
-        data = fp.read()
-        ans = self.detector.RunDetection(data)
+        return self.transcribe_wav(fp)
+
+    def transcribe_pcm(self, buffer, rate=16000, width=2, channels=1):
+        ans = self.detector.RunDetection(_as_bytes(buffer))
         if ans > 0:
             self._logger.info('snowboy 识别到了: %r', self.hotword)
             return [self.hotword]
@@ -588,6 +782,22 @@ class SnowboySTT(AbstractSTTEngine):
         else:
             return []
 
+    def start_keyword_stream(self):
+        self.detector.Reset()
+
+    def process_keyword_chunk(self, data, voiced=True):
+        """
+        Runs the detector on one chunk. Snowboy keeps its own state
+        between calls, so it fires as soon as the hotword ends. It is
+        cheap and has its own voice detection, so unvoiced chunks are
+        run too.
+
+        Arguments:
+            data -- 16 bit mono PCM data
+            voiced -- (optional) ignored
+        """
+        return self.transcribe_keyword(data)
+
     @classmethod
     def is_available(cls):
         return diagnose.check_python_import('snowboy.snowboydetect')
@@ -620,6 +830,10 @@ class GoogleSTT(AbstractSTTEngine):
     """
 
     SLUG = 'google-stt'
+    PCM_STREAMING = True
+
+    # seconds to wait for the server to accept the request or to answer
+    TIMEOUT = 10
 
     def __init__(self, api_key=None, language='en-us', **kwargs):
         # FIXME: get init args from config
@@ -682,25 +896,60 @@ class GoogleSTT(AbstractSTTEngine):
         returning an English string.
 
         Arguments:
-        audio_file_path -- the path to the .wav file to be transcribed
+        fp -- a file object containing a WAV file
+        """
+        return self.transcribe_wav(fp)
+
+    def transcribe_pcm(self, buffer, rate=16000, width=2, channels=1):
+        """
+        Performs STT via the Google Speech API on raw PCM data, converted
+        to 16 bit mono.
+
+        Arguments:
+        buffer -- a bytes, bytearray or memoryview object
+        rate -- (optional) the sample rate
+        width -- (optional) the sample width in bytes
+        channels -- (optional) the number of channels
         """
 
+        if not self._check_request():
+            return []
+        return self._post(*_as_mono16(buffer, rate, width, channels))
+
+    def begin_stream(self, rate=16000, width=2, channels=1):
+        """
+        Starts a chunked upload to the Google Speech API, the audio is sent
+        while it is being pushed.
+        """
+        if not self._check_request():
+            return super(GoogleSTT, self).begin_stream(rate, width, channels)
+        return ChunkedUploadStream(lambda chunks: self._post(chunks, rate))
+
+    def _check_request(self):
         if not self.api_key:
             self._logger.critical('API key missing, transcription request ' +
                                   'aborted.')
-            return []
+            return False
         elif not self.language:
             self._logger.critical('Language info missing, transcription ' +
                                   'request aborted.')
-            return []
-
-        wav = wave.open(fp, 'rb')
-        frame_rate = wav.getframerate()
-        wav.close()
-        data = fp.read()
+            return False
+        return True
 
+    def _post(self, data, frame_rate):
+        """
+        Arguments:
+        data -- a string, or an iterator of strings for a chunked upload
+        frame_rate -- the sample rate
+        """
         headers = {'content-type': 'audio/l16; rate=%s' % frame_rate}
-        r = self._http.post(self.request_url, data=data, headers=headers)
+        try:
+            r = self._http.post(self.request_url, data=data,
+                                headers=headers, timeout=self.TIMEOUT)
+        except requests.exceptions.Timeout:
+            self._logger.critical('Request timed out after %ds',
+                                  self.TIMEOUT)
+            return []
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError:
@@ -738,6 +987,180 @@ class GoogleSTT(AbstractSTTEngine):
         return diagnose.check_network_connection()
 
 
+def _as_bytes(buffer):
+    """
+    Returns the content of a bytes, bytearray or memoryview object as a
+    string, copying it only if it isn't one already.
+    """
+    if isinstance(buffer, memoryview):
+        return buffer.tobytes()
+    return bytes(buffer)
+
+
+def _as_mono16(buffer, rate, width, channels, rates=None):
+    """
+    Converts PCM data to the 16 bit mono samples the cloud APIs take.
+
+    Arguments:
+        buffer -- a bytes, bytearray or memoryview object
+        rate, width, channels -- the format of the data
+        rates -- (optional) the sample rates the API takes, the data is
+                 resampled to the first one if its rate isn't one of them
+
+    Returns:
+        A tuple (data, rate) of a string and its sample rate
+
+    Raises:
+        ValueError if the data has more than two channels
+    """
+    data = _as_bytes(buffer)
+    if channels not in (1, 2):
+        raise ValueError("Can't downmix %d channels" % channels)
+    if width != 2:
+        data = audioop.lin2lin(data, width, 2)
+    if channels == 2:
+        data = audioop.tomono(data, 2, 0.5, 0.5)
+    if rates and rate not in rates:
+        data, state = audioop.ratecv(data, 2, 1, rate, rates[0], None)
+        rate = rates[0]
+    return data, rate
+
+
+class PCMStream(object):
+    """
+    A streaming transcription session that buffers the pushed audio and
+    transcribes it as a whole on finish(), for engines that need the
+    complete utterance before they can send anything.
+    """
+
+    def __init__(self, engine, rate=16000, width=2, channels=1):
+        self.engine = engine
+        self.rate = rate
+        self.width = width
+        self.channels = channels
+        self._audio = bytearray()
+
+    def push(self, data):
+        """
+        Appends a chunk of PCM data to the utterance.
+        """
+        self._audio.extend(data)
+
+    def partial(self):
+        """
+        Returns:
+            A list with the hypothesis for the audio pushed so far, or an
+            empty list if the engine only transcribes on finish()
+        """
+        return []
+
+    def finish(self):
+        """
+        Ends the utterance.
+
+        Returns:
+            A list of transcriptions, like transcribe() does
+        """
+        return self.engine.transcribe_pcm(memoryview(self._audio), self.rate,
+                                          self.width, self.channels)
+
+    def cancel(self):
+        """
+        Drops the utterance without transcribing it.
+        """
+        self._audio = bytearray()
+
+
+class PocketSphinxStream(PCMStream):
+    """
+    Feeds every pushed chunk to the PocketSphinx decoder right away.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._decoder = engine._decoder
+        self._decoder.start_utt()
+
+    def push(self, data):
+        self._decoder.process_raw(_as_bytes(data), False, False)
+
+    def partial(self):
+        result = self._decoder.get_hyp()
+        if not result or not result[0]:
+            return []
+        return [result[0]]
+
+    def finish(self):
+        return self.engine._end_utterance()
+
+    def cancel(self):
+        self._decoder.end_utt()
+
+
+class ChunkedUploadStream(PCMStream):
+    """
+    A streaming transcription session that uploads every pushed chunk
+    right away. The request runs in a background thread and reads the
+    request body from a queue, so push() never blocks on the network.
+    """
+
+    _END = object()
+    _CANCEL = object()
+
+    # seconds finish() waits for the transcription after the last chunk
+    TIMEOUT = 15
+
+    def __init__(self, upload):
+        """
+        Arguments:
+        upload -- a callable that sends the iterator of chunks it is given
+                  as the request body and returns the transcriptions
+        """
+        self._logger = logging.getLogger(__name__)
+        self._chunks = Queue.Queue()
+        self._upload = upload
+        self._result = []
+        self._cancelled = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _body(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is self._END:
+                return
+            if chunk is self._CANCEL:
+                # aborts the request while the body is being sent
+                raise IOError('Upload cancelled')
+            yield chunk
+
+    def _run(self):
+        try:
+            self._result = self._upload(self._body())
+        except Exception:
+            if not self._cancelled:
+                self._logger.critical('Streaming upload failed',
+                                      exc_info=True)
+
+    def push(self, data):
+        self._chunks.put(_as_bytes(data))
+
+    def finish(self):
+        self._chunks.put(self._END)
+        self._thread.join(self.TIMEOUT)
+        if self._thread.is_alive():
+            self._logger.warning('No transcription after %ds, giving up',
+                                 self.TIMEOUT)
+            self._cancelled = True
+            return []
+        return self._result
+
+    def cancel(self):
+        self._cancelled = True
+        self._chunks.put(self._CANCEL)
+
+
 def get_engine_by_slug(slug=None):
     """
     Returns:
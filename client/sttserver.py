@@ -0,0 +1,136 @@
+# -*- coding: utf-8-*-
+"""
+    A local stand-in for the Google Speech API, used to measure how much
+    streaming the upload saves on a slow link.
+
+    The server accepts plain and chunked uploads, reads them no faster
+    than the configured bandwidth and answers with a fixed transcription.
+
+    Usage:
+
+        python -m client.sttserver --seconds 4 --bandwidth 24000
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+import BaseHTTPServer
+import SocketServer
+import json
+import logging
+import threading
+import time
+
+RESPONSE = '\n'.join([json.dumps({'result': []}),
+                      json.dumps({'result': [{'alternative': [
+                          {'transcript': 'hello world'}], 'final': True}],
+                          'result_index': 0})])
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _read(self, size):
+        data = self.rfile.read(size)
+        bandwidth = self.server.bandwidth
+        if bandwidth:
+            time.sleep(len(data) / float(bandwidth))
+        return data
+
+    def _read_body(self):
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return ''.join(body)
+                body.append(self._read(size))
+                self.rfile.readline()
+        return self._read(int(self.headers.get('content-length', 0)))
+
+    def do_POST(self):
+        body = self._read_body()
+        self.server.received.append(len(body))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves StandInHandler on localhost from a daemon thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, bandwidth=None, port=0):
+        """
+        Arguments:
+        bandwidth -- (optional) the upload speed in bytes per second
+        port -- (optional) the port, a free one is picked by default
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                           StandInHandler)
+        self.bandwidth = bandwidth
+        self.received = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/speech-api/v2/recognize' % \
+            self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def _record(chunks, push=None):
+    # feeds the chunks in real time, like the microphone would
+    for chunk in chunks:
+        time.sleep(len(chunk) / 32000.0)
+        if push:
+            push(chunk)
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    from . import stt
+
+    parser = argparse.ArgumentParser(description='Streaming upload benchmark')
+    parser.add_argument('--seconds', type=float, default=4,
+                        help='seconds of 16 kHz audio per utterance')
+    parser.add_argument('--bandwidth', type=int, default=24000,
+                        help='simulated upload speed in bytes per second')
+    args = parser.parse_args()
+
+    server = StandInServer(args.bandwidth).start()
+    engine = stt.GoogleSTT(api_key='stand-in')
+    engine._request_url = server.url
+    chunks = [os.urandom(2048)
+              for i in range(int(args.seconds * 16000 / 1024))]
+
+    _record(chunks)
+    start = time.time()
+    assert engine.transcribe_pcm(b''.join(chunks))
+    buffered = time.time() - start
+
+    stream = engine.begin_stream()
+    _record(chunks, stream.push)
+    start = time.time()
+    assert stream.finish()
+    streamed = time.time() - start
+
+    print("%.1fs utterance over %d bytes/s" % (args.seconds, args.bandwidth))
+    print("time to transcript, buffered: %8.3fs" % buffered)
+    print("time to transcript, streamed: %8.3fs" % streamed)
+    engine._http.close()
+    server.shutdown()
+    server.server_close()
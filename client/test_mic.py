@@ -29,5 +29,7 @@ class Mic:
         self.idx += 1
         return input
 
-    def say(self, phrase, OPTIONS=None, cache=False):
+    def say(self, phrase, OPTIONS=None, cache=False, args=None):
+        if args is not None:
+            phrase = phrase % args
         self.outputs.append(phrase)
@@ -0,0 +1,335 @@
+# -*- coding: utf-8-*-
+"""
+    Timing spans for the stages of the conversation pipeline, from the
+    keyword to the reply.
+
+    A span times one stage, e.g. active listening, speech recognition or
+    a plugin:
+
+        with trace.span('stt', engine=self.SLUG):
+            ...
+
+    Spans nest per thread. A span opened while another one is open is
+    its child and shares its trace id, so the spans of one conversation
+    turn can be told apart from the others. Tasks of the plugin executor
+    carry the span they were submitted from to their worker thread.
+
+    Tracing is on by default. The last durations of every stage are
+    kept in memory for p50/p95/p99 summaries, and with a trace file
+    configured, finished spans are also appended to it as JSON lines,
+    rotating it when it grows too big. Spans with a plugin attribute are
+    also summarized per plugin, under the key (stage, plugin). Disabled
+    tracing costs a function call per span.
+
+    Excerpt from sample profile.yml:
+
+        ...
+        trace:
+            enable: true                            # the default
+            file: '/home/pi/.dingdang/trace.jsonl'  # none by default
+            max_bytes: 1048576
+            backup_count: 3
+        ...
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+import collections
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+from . import config
+from . import dingdangpath
+
+# durations kept per stage, and per plugin, for the summaries
+SAMPLES = 1000
+
+PERCENTILES = (50, 95, 99)
+
+_logger = logging.getLogger(__name__)
+_local = threading.local()
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_prefix = '%x' % int(time.time())
+_durations = collections.defaultdict(
+    lambda: collections.deque(maxlen=SAMPLES))
+_writer = None
+_enabled = None
+
+
+def configure(enable=True, path=None, max_bytes=1024 * 1024,
+              backup_count=3):
+    """
+    Turns tracing on or off. Without a call, the 'trace' section of the
+    profile is read when the first span is opened.
+
+    Arguments:
+        enable -- whether spans are recorded
+        path -- (optional) the trace file, None to only keep summaries
+        max_bytes -- (optional) the size at which the trace file rotates
+        backup_count -- (optional) the number of rotated files to keep
+    """
+    global _writer, _enabled
+    writer = None
+    if enable and path:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        writer = logging.Logger('dingdang.trace')
+        writer.propagate = False
+        writer.addHandler(handler)
+    with _lock:
+        previous, _writer = _writer, writer
+        _enabled = enable
+    if previous is not None:
+        for handler in previous.handlers:
+            handler.close()
+
+
+def _configure_from_profile():
+    profile = config.get('trace', {}) if config.has('trace') else {}
+    try:
+        # without a file, only the summaries are kept
+        configure(profile.get('enable', True),
+                  profile.get('file'),
+                  profile.get('max_bytes', 1024 * 1024),
+                  profile.get('backup_count', 3))
+    except (IOError, OSError):
+        _logger.error("Can't open the trace file, tracing disabled",
+                      exc_info=True)
+        configure(False)
+
+
+def enabled():
+    if _enabled is None:
+        _configure_from_profile()
+    return _enabled
+
+
+class Span(object):
+    """
+    The timing of one stage. Use it as a context manager.
+    """
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+        self.span_id = '%s-%d' % (_prefix, next(_ids))
+        self.trace_id = None
+        self.parent = None
+        self.start = None
+        self.duration = None
+
+    def set(self, **attrs):
+        """
+        Adds attributes to the record of the span, e.g. its outcome.
+        """
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = current()
+        self.trace_id = self.parent.trace_id if self.parent is not None \
+            else self.span_id
+        _local.span = self
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = time.time() - self.start
+        _local.span = self.parent
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        _record(self)
+        return False
+
+
+class _NullSpan(object):
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(stage, **attrs):
+    """
+    Returns:
+        A context manager that times the stage, see Span
+    """
+    if not enabled():
+        return _NULL_SPAN
+    return Span(stage, attrs)
+
+
+def current():
+    """
+    Returns:
+        The innermost open span of the calling thread, or None
+    """
+    return getattr(_local, 'span', None)
+
+
+class attached(object):
+    """
+    Makes a span of another thread the parent of the spans opened in the
+    calling thread, for as long as the context lasts.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = current()
+        _local.span = self.parent
+        return self.parent
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.span = self.previous
+        return False
+
+
+def _keys(stage, attrs):
+    # the stage, and the stage of the plugin if there is one
+    plugin = attrs.get('plugin')
+    return (stage,) if plugin is None else (stage, (stage, plugin))
+
+
+def _record(span):
+    record = {
+        'ts': round(span.start, 3),
+        'stage': span.stage,
+        'duration': round(span.duration, 4),
+        'trace': span.trace_id,
+        'span': span.span_id,
+        'parent': span.parent.span_id if span.parent is not None else None,
+        'thread': threading.current_thread().name
+    }
+    record.update(span.attrs)
+    with _lock:
+        for key in _keys(span.stage, span.attrs):
+            _durations[key].append(span.duration)
+        writer = _writer
+    if writer is not None:
+        try:
+            writer.info(json.dumps(record, default=repr))
+        except Exception:
+            _logger.debug('Failed to write span', exc_info=True)
+
+
+def percentiles(durations, percents=PERCENTILES):
+    """
+    Returns:
+        A dict with the nearest-rank percentiles of the durations, their
+        count and maximum
+    """
+    durations = sorted(durations)
+    result = {'count': len(durations)}
+    if not durations:
+        return result
+    for percent in percents:
+        rank = max(0, int(round(percent / 100.0 * len(durations))) - 1)
+        result['p%d' % percent] = durations[rank]
+    result['max'] = durations[-1]
+    return result
+
+
+def summary():
+    """
+    Returns:
+        The percentiles of the last SAMPLES durations of every stage,
+        and of every (stage, plugin)
+    """
+    with _lock:
+        samples = dict((stage, list(durations))
+                       for stage, durations in _durations.items())
+    return dict((stage, percentiles(durations))
+                for stage, durations in samples.items())
+
+
+def summarize_file(path):
+    """
+    Returns:
+        The percentiles of every stage, and of every (stage, plugin), in
+        a trace file and its rotated backups
+    """
+    durations = collections.defaultdict(list)
+    paths = [path] + ['%s.%d' % (path, i) for i in range(1, 100)]
+    for fname in paths:
+        if not os.path.exists(fname):
+            continue
+        with open(fname, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                for key in _keys(record['stage'], record):
+                    durations[key].append(record['duration'])
+    return dict((stage, percentiles(values))
+                for stage, values in durations.items())
+
+
+def format_summary(stats):
+    lines = ['%-24s %6s %8s %8s %8s %8s' % ('stage', 'count', 'p50', 'p95',
+                                            'p99', 'max')]
+    for key in sorted(stats, key=lambda key: key if isinstance(key, tuple)
+                      else (key,)):
+        row = stats[key]
+        if not row['count']:
+            continue
+        # the plugins of a stage are listed under it
+        label = '  %s' % key[1] if isinstance(key, tuple) else key
+        if isinstance(label, unicode):
+            label = label.encode('utf-8')
+        lines.append('%-24s %6d %7.0fms %7.0fms %7.0fms %7.0fms' % (
+            label, row['count'], row['p50'] * 1000, row['p95'] * 1000,
+            row['p99'] * 1000, row['max'] * 1000))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    import timeit
+
+    parser = argparse.ArgumentParser(description='Trace file summary')
+    parser.add_argument('file', nargs='?',
+                        default=os.path.join(dingdangpath.TEMP_PATH,
+                                             'trace.jsonl'))
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure the cost of a span')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        def nested():
+            with span('outer'):
+                with span('inner', plugin='Echo'):
+                    pass
+
+        number = 10000
+        configure(False)
+        disabled = timeit.timeit(nested, number=number) / number / 2
+        configure(True)
+        in_memory = timeit.timeit(nested, number=number) / number / 2
+        fname = os.path.join(tempfile.mkdtemp(), 'trace.jsonl')
+        configure(True, fname)
+        to_file = timeit.timeit(nested, number=number) / number / 2
+        configure(False)
+        print('disabled:  %5.1fus per span' % (disabled * 1e6))
+        print('in memory: %5.1fus per span' % (in_memory * 1e6))
+        print('to file:   %5.1fus per span' % (to_file * 1e6))
+        print(format_summary(summarize_file(fname)))
+    else:
+        print(format_summary(summarize_file(args.file)))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8-*-
+"""
+    Matches the TRIGGERS keywords of all plugins against a text at once.
+
+    A plugin can declare the keywords that make it handle a text instead
+    of testing them one by one in its isValid() function:
+
+        TRIGGERS = [u"时间", u"几点"]
+
+    The brain compiles the triggers of all plugins into one Aho-Corasick
+    automaton, so finding every plugin a text is meant for is a single
+    pass over the text, no matter how many triggers there are. Matching
+    is case-insensitive.
+"""
+from __future__ import absolute_import
+import collections
+
+
+def normalize(text):
+    """
+    Returns the text as lower case unicode, the form triggers are matched
+    in.
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return text.lower()
+
+
+class TriggerAutomaton(object):
+    """
+    An Aho-Corasick automaton that maps keywords to values.
+    """
+
+    def __init__(self):
+        # node 0 is the root; every node has its transitions, the node to
+        # fall back to on a mismatch and the values of the keywords that
+        # end there (or in any of its fallbacks)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        self._built = True
+
+    def add(self, keyword, value):
+        """
+        Adds a keyword. build() must be called before the next match().
+        """
+        node = 0
+        for char in normalize(keyword):
+            if char not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[node][char] = len(self._goto) - 1
+            node = self._goto[node][char]
+        self._output[node].add(value)
+        self._built = False
+
+    def build(self):
+        """
+        Computes the fallback links, breadth first from the root.
+        """
+        queue = collections.deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fallback = self._goto[fail].get(char, 0)
+                self._fail[child] = fallback if fallback != child else 0
+                self._output[child] |= self._output[self._fail[child]]
+                queue.append(child)
+        self._built = True
+
+    def match(self, text):
+        """
+        Returns:
+            The set of values of all keywords that occur in text
+        """
+        if not self._built:
+            self.build()
+        found = set()
+        node = 0
+        for char in normalize(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._output[node]:
+                found |= self._output[node]
+        return found
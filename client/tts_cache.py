@@ -0,0 +1,246 @@
+# -*- coding: utf-8-*-
+"""
+    A bounded cache of synthesized speech.
+
+    Entries are keyed by the engine, the parameters that change its voice
+    (speaker, speed, language, ...) and the phrase. An index keeps the
+    size and last access of every entry, so lookups don't touch the disk
+    and the least recently used entries are evicted once the cache grows
+    beyond its byte budget. Hit, miss and eviction counters are kept in
+    the index too, for the diagnostics. The index is written by a timer
+    and at exit, never while a phrase is being said.
+
+    Lookups trust the index. A cached file removed behind the cache's
+    back is found out by the code that opens it, which discards the
+    entry. The CleanCache plugin goes through clear().
+
+    Excerpt from sample profile.yml:
+
+        ...
+        tts_cache:
+            path: '/home/pi/.dingdang/tts-cache'   # default temp/tts-cache
+            max_bytes: 52428800                    # 50 MB
+        ...
+"""
+from __future__ import absolute_import
+import atexit
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from . import config
+from . import dingdangpath
+
+# seconds a changed index may wait before it is written
+SAVE_INTERVAL = 30
+
+_logger = logging.getLogger(__name__)
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class TTSCache(object):
+    """
+    Speech files in a directory, with an LRU index.
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._dirty = False
+        self._timer = None
+        self._load()
+
+    @property
+    def index_file(self):
+        return os.path.join(self.path, self.INDEX)
+
+    @staticmethod
+    def key(slug, params, phrase):
+        """
+        Returns:
+            The cache key of a phrase said by an engine with params
+        """
+        if isinstance(phrase, unicode):
+            phrase = phrase.encode('utf-8')
+        h = hashlib.sha1()
+        h.update(json.dumps([slug, sorted(params.items())]))
+        h.update('\n')
+        h.update(phrase)
+        return '%s-%s' % (slug, h.hexdigest())
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            self._entries = index['entries']
+            self._stats.update(index['stats'])
+        except (IOError, ValueError, KeyError):
+            self._entries = {}
+
+    def save(self):
+        with self._lock:
+            timer, self._timer = self._timer, None
+            if timer is not None and timer is not threading.current_thread():
+                timer.cancel()
+            if not self._dirty:
+                return
+            index = {'entries': dict(self._entries),
+                     'stats': dict(self._stats)}
+            self._dirty = False
+        tmp = self.index_file + '.new'
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.rename(tmp, self.index_file)
+        except (IOError, OSError):
+            _logger.warning("Can't write TTS cache index '%s'",
+                            self.index_file, exc_info=True)
+
+    def _changed(self):
+        # called with the lock held, the index is written later
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(SAVE_INTERVAL, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def get(self, key):
+        """
+        Returns:
+            The path of the cached speech, or None. The file is not
+            checked, see discard().
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                fname = None
+            else:
+                self._stats['hits'] += 1
+                entry['atime'] = time.time()
+                fname = os.path.join(self.path, entry['file'])
+            self._changed()
+        return fname
+
+    def contains(self, key):
+        """
+        Returns:
+            True if the key is cached. Unlike get(), it is neither counted
+            nor an access.
+        """
+        with self._lock:
+            return key in self._entries
+
+    def discard(self, key):
+        """
+        Drops an entry whose file turned out to be missing when it was
+        opened, counting the lookup as a miss.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self._stats['hits'] -= 1
+            self._stats['misses'] += 1
+            self._changed()
+        _logger.warning("Cached speech '%s' is gone, dropped it",
+                        entry['file'])
+
+    def put(self, key, tmpfile):
+        """
+        Moves a speech file into the cache and evicts the least recently
+        used entries beyond the byte budget.
+
+        Returns:
+            The path of the cached speech
+        """
+        ext = os.path.splitext(tmpfile)[1]
+        name = key + ext
+        fname = os.path.join(self.path, name)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        shutil.move(tmpfile, fname)
+        with self._lock:
+            self._entries[key] = {'file': name,
+                                  'size': os.path.getsize(fname),
+                                  'atime': time.time()}
+            evicted = self._evict()
+            self._changed()
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+        return fname
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._entries.values())
+        evicted = []
+        for key, entry in sorted(self._entries.items(),
+                                 key=lambda item: item[1]['atime']):
+            if total <= self.max_bytes or len(self._entries) == 1:
+                break
+            del self._entries[key]
+            total -= entry['size']
+            evicted.append(entry['file'])
+            self._stats['evictions'] += 1
+        return evicted
+
+    def clear(self):
+        """
+        Removes all entries, keeping the counters.
+        """
+        with self._lock:
+            entries, self._entries = self._entries, {}
+            self._dirty = True
+        for entry in entries.values():
+            try:
+                os.remove(os.path.join(self.path, entry['file']))
+            except OSError:
+                pass
+        self.save()
+
+    def stats(self):
+        """
+        Returns:
+            A dict with the hit, miss and eviction counters, the hit rate,
+            the number of entries and their size in bytes
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = sum(entry['size']
+                                 for entry in self._entries.values())
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+def get_cache():
+    """
+    Returns:
+        The TTS cache configured in the profile
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            profile = config.section(
+                'tts_cache',
+                path=os.path.join(dingdangpath.TEMP_PATH, 'tts-cache'),
+                max_bytes=50 * 1024 * 1024)
+            _cache = TTSCache(profile['path'], profile['max_bytes'])
+            atexit.register(_cache.save)
+        return _cache
@@ -0,0 +1,209 @@
+# -*- coding: utf-8-*-
+"""
+    Endpointers decide when the user has finished speaking during active
+    listening.
+
+    Excerpt from sample profile.yml:
+
+        ...
+        vad:
+            engine: 'energy'         # 'energy' or 'legacy'
+            hangover: 0.6            # seconds of silence that end speech
+            min_speech: 0.15         # shorter bursts are treated as noise
+            max_utterance: 12        # seconds
+            no_speech_timeout: 3     # give up if nobody speaks
+        ...
+"""
+from __future__ import absolute_import
+import audioop
+import logging
+from abc import ABCMeta, abstractmethod
+
+from . import config
+from . import energy
+
+
+class AbstractEndpointer(object):
+    """
+    Generic parent class for all endpointers. An endpointer is fed with
+    consecutive chunks of 16 bit mono PCM and tells when the utterance
+    is over. After that, speech_start and speech_end hold the detected
+    speech boundaries in seconds from the first chunk (None if nobody
+    spoke).
+    """
+
+    __metaclass__ = ABCMeta
+
+    @classmethod
+    def get_config(cls):
+        return config.get('vad', {}) or {}
+
+    @classmethod
+    def get_instance(cls, rate=16000):
+        return cls(rate=rate, **cls.get_config())
+
+    def __init__(self, rate=16000, max_utterance=12, **kwargs):
+        self._logger = logging.getLogger(__name__)
+        self.rate = rate
+        self.max_utterance = float(max_utterance)
+        self.reset(0)
+
+    def reset(self, threshold):
+        """
+        Starts a new utterance.
+
+        Arguments:
+            threshold -- the energy score that separates speech from noise
+        """
+        self.threshold = threshold
+        self.elapsed = 0.0
+        self.speech_start = None
+        self.speech_end = None
+
+    def process(self, data):
+        """
+        Feeds one chunk.
+
+        Returns:
+            True if the end of the utterance has been reached
+        """
+        self.elapsed += len(data) / (energy.SAMPLE_WIDTH * float(self.rate))
+        if self._process(data):
+            return True
+        if self.elapsed >= self.max_utterance:
+            self._logger.debug('Maximum utterance length reached')
+            if self.speech_start is not None and self.speech_end is None:
+                self.speech_end = self.elapsed
+            return True
+        return False
+
+    @abstractmethod
+    def _process(self, data):
+        pass
+
+
+class LegacyEndpointer(AbstractEndpointer):
+    """
+    Ends the utterance once the average score of the last 40 chunks drops
+    below 0.8 times the threshold, like Dingdang always did.
+    """
+
+    SLUG = 'legacy'
+
+    def reset(self, threshold):
+        super(LegacyEndpointer, self).reset(threshold)
+        self._window = energy.EnergyWindow([threshold * 1.2] * 40)
+        # this one can't tell speech from silence, keep everything
+        self.speech_start = 0.0
+
+    def _process(self, data):
+        self._window.push(energy.score(data))
+        average = self._window.total / float(self._window.size)
+        if average < self.threshold * 0.8:
+            self.speech_end = self.elapsed
+            return True
+        return False
+
+
+class EnergyEndpointer(AbstractEndpointer):
+    """
+    Frame level voice activity detection on energy and zero-crossing rate.
+
+    A frame is speech if its energy score is above the threshold, or if
+    it is at least half as loud and crosses zero as often as fricatives
+    do. Speech starts after min_speech seconds of speech frames and ends
+    after hangover seconds without one.
+    """
+
+    SLUG = 'energy'
+
+    # frames crossing zero more often than this (per sample) are unvoiced
+    # speech rather than silence
+    ZCR_THRESHOLD = 0.25
+
+    def __init__(self, rate=16000, frame=0.032, hangover=0.6,
+                 min_speech=0.15, no_speech_timeout=3, **kwargs):
+        self.frame_bytes = int(rate * frame) * energy.SAMPLE_WIDTH
+        self.hangover = float(hangover)
+        self.min_speech = float(min_speech)
+        self.no_speech_timeout = float(no_speech_timeout)
+        super(EnergyEndpointer, self).__init__(rate=rate, **kwargs)
+
+    def reset(self, threshold):
+        super(EnergyEndpointer, self).reset(threshold)
+        self._position = 0.0
+        self._run_start = None
+        self._last_speech = None
+        self._pending = b''
+
+    def is_speech(self, frame):
+        score = energy.score(frame)
+        if score > self.threshold:
+            return True
+        if score > self.threshold / 2:
+            samples = len(frame) / energy.SAMPLE_WIDTH
+            crossings = audioop.cross(frame, energy.SAMPLE_WIDTH)
+            return crossings / float(samples) > self.ZCR_THRESHOLD
+        return False
+
+    def _process(self, data):
+        frame_time = self.frame_bytes / (energy.SAMPLE_WIDTH *
+                                         float(self.rate))
+        data = self._pending + data
+        offset = 0
+        while offset + self.frame_bytes <= len(data):
+            frame = data[offset:offset + self.frame_bytes]
+            offset += self.frame_bytes
+            start = self._position
+            self._position += frame_time
+            if self.is_speech(frame):
+                if self._run_start is None:
+                    self._run_start = start
+                self._last_speech = self._position
+                if self.speech_start is None and \
+                   self._position - self._run_start >= self.min_speech:
+                    self.speech_start = self._run_start
+                    self._logger.debug('Speech started at %.2fs',
+                                       self.speech_start)
+            elif self.speech_start is None:
+                self._run_start = None
+            elif self._position - self._last_speech >= self.hangover:
+                self.speech_end = self._last_speech
+                self._logger.debug('Speech ended at %.2fs', self.speech_end)
+                return True
+        self._pending = data[offset:]
+
+        if self.speech_start is None and \
+           self._position >= self.no_speech_timeout:
+            self._logger.debug('No speech within %.1fs',
+                               self.no_speech_timeout)
+            return True
+        return False
+
+
+def get_endpointer_by_slug(slug):
+    """
+    Returns:
+        The endpointer class with the given slug
+
+    Raises:
+        ValueError if there is no such endpointer
+    """
+    for endpointer in get_endpointers():
+        if endpointer.SLUG == slug:
+            return endpointer
+    raise ValueError("No endpointer found for slug '%s'" % slug)
+
+
+def get_endpointers():
+    return [endpointer for endpointer in AbstractEndpointer.__subclasses__()
+            if hasattr(endpointer, 'SLUG')]
+
+
+def get_instance(rate=16000):
+    """
+    Returns:
+        An instance of the endpointer configured in the profile
+    """
+    slug = AbstractEndpointer.get_config().get('engine', 'energy')
+    return get_endpointer_by_slug(slug).get_instance(rate=rate)
@@ -14,20 +14,24 @@ import subprocess
 import tarfile
 import re
 import contextlib
+import copy
+import mmap
 import shutil
+import struct
+import threading
 from abc import ABCMeta, abstractmethod, abstractproperty
-import yaml
 
+from . import config
 from . import dingdangpath
 from . import plugin_loader
 
+from . import arpa
 from .g2p import PhonetisaurusG2P
 try:
     import cmuclmtk
 except ImportError:
-    logging.getLogger(__name__).error("Error importing CMUCLMTK plugin. " +
-                                      "PocketsphinxVocabulary will not work " +
-                                      "correctly.", exc_info=True)
+    # only needed to compare against the in-process language model builder
+    cmuclmtk = None
 
 
 class AbstractVocabulary(object):
@@ -39,6 +43,10 @@ class AbstractVocabulary(object):
     """
     __metaclass__ = ABCMeta
 
+    # background compilations run one at a time
+    _background_lock = threading.Lock()
+    _background_phrases = None
+
     @classmethod
     def phrases_to_revision(cls, phrases):
         """
@@ -143,38 +151,97 @@ class AbstractVocabulary(object):
                                'version matches phrases.')
             return revision
 
-        if not os.path.exists(self.path):
+        # compile into a directory of its own and swap it in as a whole
+        # by repointing the symlink at self.path, so that the last compiled
+        # revision stays usable until the new one is complete
+        parent = os.path.dirname(self.path)
+        if not os.path.exists(parent):
             self._logger.debug("Vocabulary dir '%s' does not exist, " +
-                               "creating...", self.path)
+                               "creating...", parent)
             try:
-                os.makedirs(self.path)
+                os.makedirs(parent)
             except OSError:
                 self._logger.error("Couldn't create vocabulary dir '%s'",
-                                   self.path, exc_info=True)
+                                   parent, exc_info=True)
                 raise
+        staging = copy.copy(self)
+        staging.path = tempfile.mkdtemp(prefix=self.name + '.', dir=parent)
+        self._logger.info('Starting compilation...')
         try:
-            with open(self.revision_file, 'w') as f:
+            staging._compile_vocabulary(phrases)
+            with open(staging.revision_file, 'w') as f:
                 f.write(revision)
-        except (OSError, IOError):
-            self._logger.error("Couldn't write revision file in '%s'",
-                               self.revision_file, exc_info=True)
+            self._swap(staging.path)
+        except Exception:
+            self._logger.error("Fatal compilation Error occured, " +
+                               "cleaning up...", exc_info=True)
+            shutil.rmtree(staging.path, ignore_errors=True)
             raise
-        else:
-            self._logger.info('Starting compilation...')
-            try:
-                self._compile_vocabulary(phrases)
-            except Exception as e:
-                self._logger.error("Fatal compilation Error occured, " +
-                                   "cleaning up...", exc_info=True)
-                try:
-                    os.remove(self.revision_file)
-                except OSError:
-                    pass
-                raise e
-            else:
-                self._logger.info('Compilation done.')
+        self._logger.info('Compilation done.')
         return revision
 
+    def _swap(self, revision_path):
+        """
+        Atomically points self.path to a compiled revision directory and
+        removes the revisions before the one it pointed to. The previous
+        revision is kept, files may still be opened through the old link.
+        """
+        previous = os.path.realpath(self.path) \
+            if os.path.islink(self.path) else None
+        link = revision_path + '.link'
+        os.symlink(os.path.basename(revision_path), link)
+        if os.path.isdir(self.path) and not os.path.islink(self.path):
+            # a vocabulary compiled in place by an older version
+            shutil.rmtree(self.path)
+        os.rename(link, self.path)
+        parent = os.path.dirname(self.path)
+        keep = (os.path.basename(revision_path),
+                os.path.basename(previous or ''))
+        for fname in os.listdir(parent):
+            if not fname.startswith(self.name + '.') or fname in keep:
+                continue
+            fname = os.path.join(parent, fname)
+            if os.path.islink(fname):
+                os.remove(fname)
+            else:
+                shutil.rmtree(fname, ignore_errors=True)
+
+    def compile_in_background(self, phrases, callback=None):
+        """
+        Compiles this vocabulary in a background thread. The previously
+        compiled revision stays in place until the new one is complete.
+
+        Arguments:
+            phrases -- a list of phrases that this vocabulary will contain
+            callback -- (optional) called with this vocabulary once the
+                        new revision is in place
+
+        Returns:
+            The started thread
+        """
+        self._background_phrases = phrases
+
+        def run():
+            with self._background_lock:
+                if self._background_phrases is not phrases:
+                    # superseded by a later call
+                    return
+                try:
+                    self.compile(phrases)
+                except Exception:
+                    self._logger.error("Background compilation of " +
+                                       "vocabulary '%s' failed, keeping " +
+                                       "revision '%s'", self.name,
+                                       self.compiled_revision)
+                    return
+            if callback is not None:
+                callback(self)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
     @abstractmethod
     def _compile_vocabulary(self, phrases):
         """
@@ -266,15 +333,33 @@ class PocketsphinxVocabulary(AbstractVocabulary):
         Arguments:
             phrases -- a list of phrases that this vocabulary will contain
         """
-        text = " ".join([("<s> %s </s>" % phrase) for phrase in phrases])
         self._logger.debug('Compiling languagemodel...')
-        vocabulary = self._compile_languagemodel(text, self.languagemodel_file)
+        vocabulary = self._compile_languagemodel(phrases,
+                                                 self.languagemodel_file)
         self._logger.debug('Starting dictionary...')
         self._compile_dictionary(vocabulary, self.dictionary_file)
 
-    def _compile_languagemodel(self, text, output_file):
+    def _compile_languagemodel(self, phrases, output_file):
         """
-        Compiles the languagemodel from a text.
+        Builds the languagemodel in-process.
+
+        Arguments:
+            phrases -- the phrases the languagemodel will be generated from
+            output_file -- the path of the file this languagemodel will
+                           be written to
+
+        Returns:
+            A list of all unique words this vocabulary contains.
+        """
+        languagemodel = arpa.LanguageModel(phrases)
+        self._logger.debug("Creating languagemodel file: '%s'", output_file)
+        languagemodel.write(output_file)
+        return languagemodel.words
+
+    def _compile_languagemodel_cmuclmtk(self, text, output_file):
+        """
+        Compiles the languagemodel from a text with the CMUCLMTK tools, the
+        way it used to be done.
 
         Arguments:
             text -- the text the languagemodel will be generated from
@@ -335,9 +420,58 @@ class PocketsphinxVocabulary(AbstractVocabulary):
 
 class JuliusVocabulary(AbstractVocabulary):
     class VoxForgeLexicon(object):
+        """
+        Looks up pronunciations in a VoxForge lexicon.
+
+        The lexicon is parsed only once, into a sorted binary index that
+        is cached next to it (or in the temp dir if that isn't writable).
+        Lookups are binary searches on the memory-mapped index, so
+        hardly any of it has to be read.
+
+        Index layout (little endian):
+            header  -- magic, size and mtime of the lexicon, word count
+            offsets -- one uint32 per word, in sorted word order
+            records -- "WORD\tphoneme\tphoneme...\n" per word
+        """
+
+        MAGIC = b'VFX1'
+        HEADER = struct.Struct('<4sQdI')
+        OFFSET = struct.Struct('<I')
+
         def __init__(self, fname, membername=None):
-            self._dict = {}
-            self.parse(fname, membername)
+            self._logger = logging.getLogger(__name__)
+            self._mmap = None
+            self._count = 0
+            stat = os.stat(fname)
+            self._source = (stat.st_size, stat.st_mtime)
+            self.index_file = self._find_index(fname, membername)
+            if self.index_file is None:
+                self.build_index(fname, membername)
+            self._open_index()
+
+        def _index_paths(self, fname, membername=None):
+            name = os.path.basename(fname)
+            if membername:
+                name += '.' + membername.replace('/', '_')
+            name += '.idx'
+            return [os.path.join(os.path.dirname(os.path.abspath(fname)),
+                                 name),
+                    os.path.join(dingdangpath.TEMP_PATH, name)]
+
+        def _is_current(self, index_file):
+            try:
+                with open(index_file, 'rb') as f:
+                    header = f.read(self.HEADER.size)
+                magic, size, mtime, count = self.HEADER.unpack(header)
+            except (IOError, OSError, struct.error):
+                return False
+            return magic == self.MAGIC and (size, mtime) == self._source
+
+        def _find_index(self, fname, membername=None):
+            for index_file in self._index_paths(fname, membername):
+                if self._is_current(index_file):
+                    return index_file
+            return None
 
         @contextlib.contextmanager
         def open_dict(self, fname, membername=None):
@@ -354,22 +488,92 @@ class JuliusVocabulary(AbstractVocabulary):
                     yield f
 
         def parse(self, fname, membername=None):
+            """
+            Returns:
+                A dict that maps every word of the lexicon to the list of
+                its phonemes
+            """
+            lexicon = {}
             pattern = re.compile(r'\[(.+)\]\W(.+)')
             with self.open_dict(fname, membername=membername) as f:
                 for line in f:
                     matchobj = pattern.search(line)
                     if matchobj:
                         word, phoneme = [x.strip() for x in matchobj.groups()]
-                        if word in self._dict:
-                            self._dict[word].append(phoneme)
+                        if word in lexicon:
+                            lexicon[word].append(phoneme)
                         else:
-                            self._dict[word] = [phoneme]
+                            lexicon[word] = [phoneme]
+            return lexicon
+
+        def build_index(self, fname, membername=None):
+            """
+            Parses the lexicon and writes its index. Tries the directory
+            of the lexicon first, then the temp dir.
+            """
+            self._logger.info("Building lexicon index for '%s'...", fname)
+            lexicon = self.parse(fname, membername)
+            offsets = []
+            records = []
+            position = 0
+            for word in sorted(lexicon):
+                record = '%s\t%s\n' % (word, '\t'.join(lexicon[word]))
+                offsets.append(position)
+                records.append(record)
+                position += len(record)
+            del lexicon
+
+            for index_file in self._index_paths(fname, membername):
+                tmp_file = '%s.%d.tmp' % (index_file, os.getpid())
+                try:
+                    with open(tmp_file, 'wb') as f:
+                        f.write(self.HEADER.pack(self.MAGIC, self._source[0],
+                                                 self._source[1],
+                                                 len(offsets)))
+                        for offset in offsets:
+                            f.write(self.OFFSET.pack(offset))
+                        f.writelines(records)
+                    os.rename(tmp_file, index_file)
+                except (IOError, OSError):
+                    self._logger.debug("Can't write lexicon index '%s'",
+                                       index_file, exc_info=True)
+                    try:
+                        os.remove(tmp_file)
+                    except OSError:
+                        pass
+                    continue
+                self.index_file = index_file
+                return
+            raise IOError("Couldn't write a lexicon index for '%s'" % fname)
+
+        def _open_index(self):
+            with open(self.index_file, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._count = self.HEADER.unpack_from(self._mmap, 0)[3]
+            self._records = self.HEADER.size + self._count * self.OFFSET.size
+
+        def _record(self, i):
+            start = self._records + \
+                self.OFFSET.unpack_from(self._mmap,
+                                        self.HEADER.size +
+                                        i * self.OFFSET.size)[0]
+            return self._mmap[start:self._mmap.find(b'\n', start)]
 
         def translate_word(self, word):
-            if word in self._dict:
-                return self._dict[word]
-            else:
-                return []
+            if isinstance(word, unicode):
+                word = word.encode('utf-8')
+            low, high = 0, self._count
+            while low < high:
+                middle = (low + high) // 2
+                record = self._record(middle)
+                key = record[:record.find(b'\t')]
+                if key == word:
+                    return record.split(b'\t')[1:]
+                elif key < word:
+                    low = middle + 1
+                else:
+                    high = middle
+            return []
 
     PATH_PREFIX = 'julius-vocabulary'
 
@@ -421,21 +625,12 @@ class JuliusVocabulary(AbstractVocabulary):
         prefix = 'dingdang'
         tmpdir = tempfile.mkdtemp()
 
-        lexicon_file = dingdangpath.data('julius-stt', 'VoxForge.tgz')
-        lexicon_archive_member = 'VoxForge/VoxForgeDict'
-        profile_path = dingdangpath.config('profile.yml')
-        if os.path.exists(profile_path):
-            with open(profile_path, 'r') as f:
-                profile = yaml.safe_load(f)
-                if 'julius' in profile:
-                    if 'lexicon' in profile['julius']:
-                        lexicon_file = profile['julius']['lexicon']
-                    if 'lexicon_archive_member' in profile['julius']:
-                        lexicon_archive_member = \
-                            profile['julius']['lexicon_archive_member']
-
-        lexicon = JuliusVocabulary.VoxForgeLexicon(lexicon_file,
-                                                   lexicon_archive_member)
+        profile = config.section(
+            'julius',
+            lexicon=dingdangpath.data('julius-stt', 'VoxForge.tgz'),
+            lexicon_archive_member='VoxForge/VoxForgeDict')
+        lexicon = JuliusVocabulary.VoxForgeLexicon(
+            profile['lexicon'], profile['lexicon_archive_member'])
 
         # Create grammar file
         tmp_grammar_file = os.path.join(tmpdir,
@@ -535,11 +730,33 @@ if __name__ == '__main__':
                              'compiled.')
     parser.add_argument('--debug', action='store_true',
                         help='show debug messages')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare the compile time of the languagemodels')
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
     base_dir = args.base_dir if args.base_dir else tempfile.mkdtemp()
 
+    if args.benchmark:
+        import timeit
+        vocab = PocketsphinxVocabulary(path=base_dir)
+        output_file = os.path.join(base_dir, 'languagemodel')
+        for name, phrases in [('keyword', get_keyword_phrases()),
+                              ('default', get_all_phrases()),
+                              ('music', get_all_phrases())]:
+            text = " ".join([("<s> %s </s>" % phrase) for phrase in phrases])
+            builders = [('in-process', lambda: vocab._compile_languagemodel(
+                phrases, output_file))]
+            if cmuclmtk is not None:
+                builders.insert(0, ('cmuclmtk', lambda: (
+                    vocab._compile_languagemodel_cmuclmtk(text, output_file))))
+            for builder, func in builders:
+                best = min(timeit.repeat(func, number=1, repeat=3))
+                print("%-8s %-10s %5d phrases %8.1f ms" %
+                      (name, builder, len(phrases), best * 1000))
+        shutil.rmtree(base_dir)
+        raise SystemExit(0)
+
     phrases = get_all_phrases()
     print("Plugin phrases:    %r" % phrases)
 
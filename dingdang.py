@@ -16,6 +16,8 @@ from client import WechatBot
 from client.conversation import Conversation
 from client import config
 from client import statistic
+from client import plugin_loader
+from client import prewarm
 
 # Add dingdangpath.LIB_PATH to sys.path
 sys.path.append(dingdangpath.LIB_PATH)
@@ -44,6 +46,24 @@ class Dingdang(object):
         self._logger = logging.getLogger(__name__)
         config.init()
 
+        tts_engine_class, stt_passive_engine_class, stt_engine_class = \
+            self.get_engine_classes()
+        self._engine_configs = self.get_engine_configs()
+
+        # Initialize Mic
+        self.mic = Mic(
+            tts_engine_class.get_instance(),
+            stt_passive_engine_class.get_passive_instance(),
+            stt_engine_class.get_active_instance())
+        config.subscribe(self.profile_changed)
+
+    @staticmethod
+    def get_engine_classes():
+        """
+        Returns:
+            The TTS, passive STT and active STT engine classes selected in
+            the profile
+        """
         stt_engine_slug = config.get('stt_engine', 'sphinx')
         stt_engine_class = stt.get_engine_by_slug(stt_engine_slug)
 
@@ -53,12 +73,38 @@ class Dingdang(object):
         tts_engine_slug = config.get('tts_engine',
                                      tts.get_default_engine_slug())
         tts_engine_class = tts.get_engine_by_slug(tts_engine_slug)
-
-        # Initialize Mic
-        self.mic = Mic(
-            tts_engine_class.get_instance(),
-            stt_passive_engine_class.get_passive_instance(),
-            stt_engine_class.get_active_instance())
+        return tts_engine_class, stt_passive_engine_class, stt_engine_class
+
+    def get_engine_configs(self):
+        return [(engine_class, dict(engine_class.get_config()))
+                for engine_class in self.get_engine_classes()]
+
+    def profile_changed(self, sections):
+        """
+        Recreates the engines whose class or configuration changed in
+        the profile.
+        """
+        configs = self.get_engine_configs()
+        old, self._engine_configs = self._engine_configs, configs
+        (tts_class, tts_conf), (passive_class, passive_conf), \
+            (active_class, active_conf) = configs
+        # don't swap an STT engine in the middle of listening
+        lock = getattr(self.mic, '_listen_lock', None) or threading.RLock()
+        if (tts_class, tts_conf) != old[0]:
+            self._logger.info("Switching to TTS engine '%s'", tts_class.SLUG)
+            self.mic.speaker = tts_class.get_instance()
+        if (passive_class, passive_conf) != old[1]:
+            self._logger.info("Switching to passive STT engine '%s'",
+                              passive_class.SLUG)
+            engine = passive_class.get_passive_instance()
+            with lock:
+                self.mic.passive_stt_engine = engine
+        if (active_class, active_conf) != old[2]:
+            self._logger.info("Switching to active STT engine '%s'",
+                              active_class.SLUG)
+            engine = active_class.get_active_instance()
+            with lock:
+                self.mic.active_stt_engine = engine
 
     def start_wxbot(self):
         print(u"请扫描如下二维码登录微信")
@@ -71,6 +117,11 @@ class Dingdang(object):
         persona = config.get("robot_name", 'DINGDANG')
         conversation = Conversation(persona, self.mic)
 
+        if config.get('plugin_reload', False):
+            plugin_loader.PluginWatcher(
+                conversation.brain.reload_plugins,
+                config.get('plugin_reload_interval', 2)).start()
+
         statistic.report(0)
 
         # create wechat robot
@@ -83,6 +134,12 @@ class Dingdang(object):
             t.start()
 
         self.mic.say(salutation, cache=True)
+
+        if config.get('tts_prewarm', True):
+            prewarm.Prewarmer(
+                self.mic, prewarm.get_phrases(),
+                config.get('tts_prewarm_delay', prewarm.DELAY)).start()
+
         conversation.handleForever()
 
 
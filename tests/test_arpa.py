@@ -0,0 +1,34 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+from client import arpa
+
+
+class TestLanguageModel():
+
+    def setUp(self):
+        self.lm = arpa.LanguageModel(['HELLO WORLD', 'HELLO THERE',
+                                      'WHAT TIME IS IT', 'TIME'])
+
+    def testNormalized(self):
+        """Do the probabilities after every history sum up to one?"""
+        vocabulary = self.lm.words + [arpa.SENTENCE_END]
+        for history in [(), ('<s>',), ('HELLO',), ('<s>', 'HELLO'),
+                        ('WHAT', 'TIME'), ('THERE', 'IS')]:
+            total = sum(self.lm.prob(word, history) for word in vocabulary)
+            assert_almost_equal(total, 1.0)
+
+    def testArpa(self):
+        """Does the ARPA file list every n-gram?"""
+        lines = self.lm.to_arpa().splitlines()
+        assert lines[:4] == ['\\data\\', 'ngram 1=9', 'ngram 2=12',
+                             'ngram 3=9']
+        assert '-99.0000 <s> 0.0134' in lines
+        assert lines[-1] == '\\end\\'
+
+    def testText(self):
+        """Does a CMUCLMTK style text give the same model as phrases?"""
+        text = ' '.join('<s> %s </s>' % phrase for phrase in
+                        ['HELLO WORLD', 'HELLO THERE', 'WHAT TIME IS IT',
+                         'TIME'])
+        assert arpa.LanguageModel(text).to_arpa() == self.lm.to_arpa()
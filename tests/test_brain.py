@@ -34,3 +34,22 @@ class TestBrain():
         with mock.patch.object(hn, 'handle') as mocked_handle:
             my_brain.query(["echo 你好吗"])
             assert mocked_handle.called
+
+    def testTriggers(self):
+        """Does Brain route texts by TRIGGERS like isValid does?"""
+        my_brain = TestBrain._emptyBrain()
+        for text in [u"现在几点", u"echo 你好吗", u"帮我拍照", u"你好"]:
+            expected = [plugin for plugin in my_brain.plugins
+                        if plugin.isValid(text)]
+            assert my_brain.candidates(text) == expected
+
+    def testReloadPlugins(self):
+        """Does Brain route to the plugins it has been reloaded with?"""
+        my_brain = TestBrain._emptyBrain()
+        echo = filter(lambda m: m.__name__ == 'Echo', my_brain.plugins)
+        with mock.patch('client.plugin_loader.get_plugins',
+                        return_value=echo):
+            my_brain.reload_plugins(set(['Time']))
+        assert my_brain.plugins == echo
+        assert my_brain.candidates(u"现在几点") == []
+        assert my_brain.candidates(u"echo 你好吗") == echo
@@ -0,0 +1,69 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import os
+import shutil
+import tempfile
+from client import config
+
+
+class TestConfig():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'profile.yml')
+        self._write('robot_name: DINGDANG\n' +
+                    'pocketsphinx:\n' +
+                    '    nbest: "3"\n' +
+                    'iflytek_yuyin:\n' +
+                    '    tts:\n' +
+                    '        voice_name: xiaoyan\n', 100)
+        config.load(self.fname)
+
+    def tearDown(self):
+        config._config = {}
+        config._config_file = None
+        config._values.clear()
+        config._sections.clear()
+        del config._subscribers[:]
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, text, mtime):
+        with open(self.fname, 'w') as f:
+            f.write(text)
+        os.utime(self.fname, (mtime, mtime))
+
+    def testPath(self):
+        """Are paths looked up like before, and cached?"""
+        assert config.get('/iflytek_yuyin/tts/voice_name') == 'xiaoyan'
+        assert config.get_path(['iflytek_yuyin', 'tts']) == \
+            {'voice_name': 'xiaoyan'}
+        assert config.get('/iflytek_yuyin/api_id', 'none') == 'none'
+        assert config.get('/iflytek_yuyin/api_id', 'other') == 'other'
+        assert ('iflytek_yuyin', 'tts', 'voice_name') in config._values
+        assert config.has_path('/iflytek_yuyin/tts')
+        assert not config.has_path('/robot_name/tts')
+
+    def testSection(self):
+        """Are sections merged into their defaults, with typed numbers?"""
+        section = config.section('pocketsphinx', nbest=1, fst_model='g2p')
+        assert section == {'nbest': 3, 'fst_model': 'g2p'}
+        section['nbest'] = 5
+        assert config.section('pocketsphinx', nbest=1,
+                              fst_model='g2p')['nbest'] == 3
+
+    def testReload(self):
+        """Is the profile reloaded when it changed, and only then?"""
+        changed = []
+        config.subscribe(changed.append)
+        config.get('/iflytek_yuyin/tts/voice_name')
+        assert config.reload_if_changed() == set()
+        self._write('robot_name: DINGDANG\n' +
+                    'iflytek_yuyin:\n' +
+                    '    tts:\n' +
+                    '        voice_name: xiaoyun\n', 200)
+        assert config.reload_if_changed() == set(['pocketsphinx',
+                                                  'iflytek_yuyin'])
+        assert changed == [set(['pocketsphinx', 'iflytek_yuyin'])]
+        assert config.get('/iflytek_yuyin/tts/voice_name') == 'xiaoyun'
+        assert config.section('pocketsphinx', nbest=1) == {'nbest': 1}
@@ -0,0 +1,61 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import os
+import audioop
+import mock
+from nose.tools import *
+from client import energy
+
+
+class TestEnergy():
+
+    def setUp(self):
+        self.chunks = [os.urandom(2048) for i in range(50)]
+
+    def testScores(self):
+        """Do batch scores match audioop chunk by chunk?"""
+        expected = [audioop.rms(data, 2) / 3 for data in self.chunks]
+        assert energy.scores(''.join(self.chunks), 2048) == expected
+
+    def testLevels(self):
+        """Do batch levels match the level of every chunk?"""
+        expected = [energy.level(data) for data in self.chunks]
+        levels = energy.levels(''.join(self.chunks), 2048)
+        assert len(levels) == len(expected)
+        for value, other in zip(levels, expected):
+            assert_almost_equal(value, other, places=6)
+        with mock.patch.object(energy, 'np', None):
+            assert energy.levels(''.join(self.chunks), 2048) == expected
+        assert energy.level('\x00\x00' * 1024) == energy.MIN_DB
+        assert_almost_equal(energy.level('\x00\x80' * 1024), 0.0)
+
+    def testWindow(self):
+        """Does the running window give the same average as the list?"""
+        lastN = list(range(30))
+        window = energy.EnergyWindow(range(30))
+        for data in self.chunks[:20]:
+            lastN.pop(0)
+            lastN.append(energy.score(data))
+            window.push(energy.score(data))
+            assert window.average == sum(lastN) / len(lastN)
+        window.push_many(energy.scores(''.join(self.chunks[20:]), 2048))
+        assert window.average == energy._legacy_threshold(self.chunks, 30)
+
+
+class TestNoiseFloorTracker():
+
+    def testQuietestSecond(self):
+        """Is the threshold based on the quietest recent second?"""
+        tracker = energy.NoiseFloorTracker(2)
+        assert tracker.threshold is None
+        quiet, loud = '\x10\x00' * 1024, '\x00\x10' * 1024
+        for data in [loud, loud, quiet, quiet, loud, loud]:
+            tracker.update(data)
+        assert tracker.floor == energy.score(quiet)
+        assert tracker.threshold == energy.score(quiet) * 2.5
+
+    def testPaused(self):
+        tracker = energy.NoiseFloorTracker(1)
+        tracker.paused = True
+        tracker.update('\x10\x00' * 1024)
+        assert tracker.floor is None
@@ -0,0 +1,65 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import threading
+from client import executor
+
+
+class Plugin(object):
+    __name__ = 'Plugin'
+    TIMEOUT = 5
+
+
+class TestPluginExecutor():
+
+    def setUp(self):
+        self.executor = executor.PluginExecutor(workers=1)
+
+    def testRun(self):
+        """Does a plugin run on a worker and get counted?"""
+        task = self.executor.submit(self.executor.run_plugin, Plugin,
+                                    lambda x: x * 2, 21)
+        assert task.wait(5)
+        assert task.result == 42
+        metrics = self.executor.metrics()
+        assert metrics['Plugin']['count'] == 1
+        assert metrics['queue']['count'] == 1
+
+    def testCancel(self):
+        """Does a cancelled plugin stop at its next check?"""
+        started = threading.Event()
+        resume = threading.Event()
+
+        def handle():
+            started.set()
+            resume.wait(5)
+            executor.check_cancelled()
+
+        task = self.executor.submit(self.executor.run_plugin, Plugin, handle)
+        started.wait(5)
+        self.executor.cancel_all()
+        resume.set()
+        assert task.wait(5)
+        assert isinstance(task.exception, executor.PluginCancelled)
+        assert self.executor.metrics()['Plugin']['cancelled'] == 1
+
+    def testDeadline(self):
+        """Does a plugin past its deadline time out?"""
+        plugin = Plugin()
+        plugin.TIMEOUT = -1
+        task = self.executor.submit(self.executor.run_plugin, plugin,
+                                    executor.check_cancelled)
+        assert task.wait(5)
+        assert task.timed_out
+        assert self.executor.metrics()['Plugin']['timeouts'] == 1
+
+    def testQueuedCancel(self):
+        """Is a task cancelled in the queue never run?"""
+        ran = []
+        block = threading.Event()
+        self.executor.submit(block.wait, 5)
+        task = self.executor.submit(ran.append, 1)
+        task.cancel()
+        block.set()
+        assert task.wait(5)
+        assert ran == []
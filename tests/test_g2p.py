@@ -0,0 +1,46 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+import shutil
+import tempfile
+import os
+from client import g2p
+
+
+class TestPhonemeCache():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fst_model = os.path.join(self.tempdir, 'model.fst')
+        with open(self.fst_model, 'w') as f:
+            f.write('fst')
+        self.g2p = object.__new__(g2p.PhonetisaurusG2P)
+        self.g2p.__init__(self.fst_model,
+                          cache=os.path.join(self.tempdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testOnlyMisses(self):
+        """Are only words missing from the cache sent to phonetisaurus?"""
+        with mock.patch.object(self.g2p, '_translate') as translate:
+            translate.return_value = {'HELLO': ['HH AH L OW']}
+            assert self.g2p.translate(['HELLO', 'XYZZY']) == \
+                {'HELLO': ['HH AH L OW']}
+            translate.assert_called_once_with(['HELLO', 'XYZZY'])
+
+            translate.reset_mock()
+            translate.return_value = {'WORLD': ['W ER L D']}
+            assert self.g2p.translate(['HELLO', 'XYZZY', 'WORLD']) == \
+                {'HELLO': ['HH AH L OW'], 'WORLD': ['W ER L D']}
+            translate.assert_called_once_with(['WORLD'])
+
+    def testNbest(self):
+        """Does a different nbest miss the cache?"""
+        with mock.patch.object(self.g2p, '_translate') as translate:
+            translate.return_value = {'HELLO': ['HH AH L OW']}
+            self.g2p.translate(['HELLO'])
+            self.g2p.nbest = 3
+            self.g2p.translate(['HELLO'])
+            assert translate.call_count == 2
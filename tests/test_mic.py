@@ -0,0 +1,133 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+from nose.plugins.skip import SkipTest
+import logging
+import mock
+import threading
+from client import executor
+try:
+    from client import mic
+except ImportError:
+    # needs pyaudio
+    mic = None
+
+
+class TestSay():
+
+    def setUp(self):
+        if mic is None:
+            raise SkipTest('pyaudio is not installed')
+        with mock.patch.object(mic.Mic, '__init__', return_value=None):
+            self.mic = mic.Mic()
+        self.mic._logger = logging.getLogger(__name__)
+        self.mic.robot_name = u'叮当'
+        self.mic.wxbot = None
+        self.mic.speaker = mock.Mock()
+        self.mic.noise_floor = mock.Mock(paused=False)
+        self.mic._recorder = mock.Mock()
+        self.mic._audio = mock.Mock()
+        self.mic.stop_passive = False
+
+    def testCancelled(self):
+        """Are the speaking flags reset when a reply is cancelled?"""
+        self.mic.speaker.say.side_effect = executor.PluginCancelled
+        self.mic.speaker.say.__code__ = mock.Mock(co_argcount=3)
+        with assert_raises(executor.PluginCancelled):
+            self.mic.say(u"你好")
+        assert not self.mic.noise_floor.paused
+        assert not self.mic.stop_passive
+
+
+class FakeReader(object):
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.position = 0
+
+    def read(self, timeout=None):
+        data = self.chunks[self.position]
+        self.position += 1
+        return data
+
+
+class FakeKeywordEngine(object):
+    # spots 'DINGDANG' in the audio fed since the stream started
+    KEYWORD_STREAMING = True
+
+    def __init__(self):
+        self.starts = 0
+        self.audio = None
+
+    def start_keyword_stream(self):
+        self.starts += 1
+        self.audio = ''
+
+    def process_keyword_chunk(self, data, voiced=True):
+        self.audio += data
+        return ['DINGDANG'] if 'DINGDANG' in self.audio else []
+
+    def end_keyword_stream(self):
+        self.audio = None
+
+
+class TestStreamingPassiveListen():
+
+    def setUp(self):
+        if mic is None:
+            raise SkipTest('pyaudio is not installed')
+        with mock.patch.object(mic.Mic, '__init__', return_value=None):
+            self.mic = mic.Mic()
+        self.mic._logger = logging.getLogger(__name__)
+        self.mic.noise_floor = mock.Mock()
+        self.mic._recorder = mock.Mock()
+        self.mic._audio = mock.Mock()
+        self.mic.stop_passive = False
+        self.mic._keyword_stream = None
+        self.mic._keyword_position = None
+        self.mic.passive_stt_engine = FakeKeywordEngine()
+        # a window of one second
+        self.window = mic.RATE / mic.CHUNK
+        chunks = ['....'] * (self.window - 1) + ['DING', 'DANG']
+        self.reader = FakeReader(chunks + ['....'] * self.window)
+
+    def listen(self):
+        return self.mic.streamingPassiveListen(
+            self.reader, 'DINGDANG', 100, 2.5, 1)
+
+    def testAcrossRestart(self):
+        """Is a keyword said across a restart spotted?"""
+        assert self.listen() == (None, None)
+        assert self.listen() == (100, 'DINGDANG')
+        engine = self.mic.passive_stt_engine
+        assert engine.starts == 1
+        assert engine.audio is None
+        assert self.mic._keyword_stream is None
+
+    def testSkipped(self):
+        """Is the stream restarted when audio has been skipped?"""
+        assert self.listen() == (None, None)
+        self.reader.position += 1
+        assert self.listen() == (None, None)
+        assert self.mic.passive_stt_engine.starts == 2
+
+    def testActiveListen(self):
+        """Is a stream left open by a passive window ended first?"""
+        assert self.listen() == (None, None)
+        engine = self.mic.passive_stt_engine
+        assert engine.audio is not None
+        self.mic._listen_lock = threading.RLock()
+        open_streams = []
+
+        def before_listen():
+            open_streams.append(engine.audio)
+            raise IOError('stop here')
+
+        self.mic.beforeListenEvent = before_listen
+        with assert_raises(IOError):
+            self.mic.activeListenToAllOptions()
+        assert open_streams == [None]
+        assert self.mic._keyword_stream is None
+        # the next passive window starts a new stream
+        self.listen()
+        assert engine.starts == 2
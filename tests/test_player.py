@@ -0,0 +1,49 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+from client import player
+
+
+class TestOutputStream():
+
+    def setUp(self):
+        self.audio = mock.Mock()
+        self.audio.open.side_effect = lambda **kwargs: mock.Mock()
+        # no reaper thread, closing is triggered by the tests
+        mock.patch.object(player, '_schedule_reaper').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        player.close_idle_streams(timeout=0)
+
+    def play(self):
+        with player.output_stream(self.audio, 8, 1, 16000) as stream:
+            stream.write('data')
+        return stream
+
+    def testReused(self):
+        """Is the stream kept open and drained after every sound?"""
+        stream = self.play()
+        assert self.play() is stream
+        assert self.audio.open.call_count == 1
+        assert stream.stop_stream.call_count == 2
+        assert not stream.close.called
+
+    def testIdle(self):
+        """Are only the streams idle for the timeout closed?"""
+        stream = self.play()
+        used = player._streams.values()[0].used
+        player.close_idle_streams(timeout=60)
+        assert not stream.close.called
+        with mock.patch.object(player.time, 'time', return_value=used + 60):
+            player.close_idle_streams(timeout=60)
+        assert stream.close.called
+        assert self.play() is not stream
+        assert self.audio.open.call_count == 2
+
+    def testBusy(self):
+        """Is a stream that is being written to kept open?"""
+        with player.output_stream(self.audio, 8, 1, 16000) as stream:
+            player.close_idle_streams(timeout=0)
+        assert not stream.close.called
@@ -0,0 +1,115 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import os
+import shutil
+import sys
+import tempfile
+from client import plugin_loader
+
+PLUGIN = """# -*- coding: utf-8-*-
+import sys
+sys.lazy_plugin_imports = getattr(sys, 'lazy_plugin_imports', 0) + 1
+WORDS = ["LAZY"]
+TRIGGERS = [u"懒"]
+SLUG = "lazy"
+PRIORITY = 3
+
+
+def handle(text, mic, profile, wxbot=None):
+    return text
+"""
+
+
+class TestPluginManifest():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'LazyTestPlugin.py')
+        with open(self.fname, 'w') as f:
+            f.write(PLUGIN)
+        self.manifest = os.path.join(self.tempdir, 'manifest.json')
+        sys.lazy_plugin_imports = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        sys.modules.pop('LazyTestPlugin', None)
+        del sys.lazy_plugin_imports
+        # let the other tests load the real plugins again
+        plugin_loader._has_init = False
+
+    def _init(self):
+        plugin_loader.init_plugins([self.tempdir], self.manifest)
+        return plugin_loader.get_plugins()
+
+    def testLazy(self):
+        """Are plugins in the manifest imported on first use only?"""
+        self._init()
+        assert sys.lazy_plugin_imports == 1
+        plugin = self._init()[0]
+        assert sys.lazy_plugin_imports == 1
+        assert isinstance(plugin, plugin_loader.LazyPlugin)
+        assert plugin.SLUG == 'lazy'
+        assert plugin.PRIORITY == 3
+        assert plugin.TRIGGERS == [u"懒"]
+        assert not hasattr(plugin, 'isValid')
+        assert not plugin.loaded
+        assert plugin.handle(u"懒", None, {}) == u"懒"
+        assert sys.lazy_plugin_imports == 2
+
+    def testChangedPlugin(self):
+        """Is a plugin whose file changed imported again?"""
+        self._init()
+        mtime = os.path.getmtime(self.fname)
+        os.utime(self.fname, (mtime + 10, mtime + 10))
+        plugin = self._init()[0]
+        assert not isinstance(plugin, plugin_loader.LazyPlugin)
+        assert sys.lazy_plugin_imports == 2
+
+    def testReload(self):
+        """Are only changed, added and removed plugins reloaded?"""
+        self._init()
+        assert plugin_loader.reload_plugins() == set()
+        other = os.path.join(self.tempdir, 'OtherTestPlugin.py')
+        with open(other, 'w') as f:
+            f.write(PLUGIN.replace('"lazy"', '"other"'))
+        try:
+            assert plugin_loader.reload_plugins() == set(['OtherTestPlugin'])
+            assert sys.lazy_plugin_imports == 2
+            assert [plugin.SLUG for plugin in plugin_loader.get_plugins()] \
+                == ['lazy', 'other']
+            os.remove(other)
+            assert plugin_loader.reload_plugins() == set(['OtherTestPlugin'])
+            assert [plugin.SLUG for plugin in plugin_loader.get_plugins()] \
+                == ['lazy']
+        finally:
+            sys.modules.pop('OtherTestPlugin', None)
+
+    def _edit(self, source):
+        mtime = os.path.getmtime(self.fname)
+        with open(self.fname, 'w') as f:
+            f.write(source)
+        os.utime(self.fname, (mtime + 10, mtime + 10))
+
+    def testReloadFresh(self):
+        """Is a changed plugin imported into a new module?"""
+        plugin_loader.init_plugins([self.tempdir], None)
+        old = plugin_loader.get_plugins()[0]
+        self._edit(PLUGIN.replace('PRIORITY = 3', 'PRIORITY = 4'))
+        assert plugin_loader.reload_plugins() == set(['LazyTestPlugin'])
+        new = plugin_loader.get_plugins()[0]
+        assert new is not old
+        assert (old.PRIORITY, new.PRIORITY) == (3, 4)
+        assert sys.modules['LazyTestPlugin'] is new
+
+    def testReloadBroken(self):
+        """Is the previous module kept if the changed file fails?"""
+        plugin_loader.init_plugins([self.tempdir], None)
+        old = plugin_loader.get_plugins()[0]
+        self._edit(PLUGIN + '\nraise ImportError("broken")\n')
+        plugin_loader.reload_plugins()
+        assert plugin_loader.get_plugins() == [old]
+        assert sys.modules['LazyTestPlugin'] is old
+        # not imported again until the file changes
+        assert plugin_loader.reload_plugins() == set()
+        assert sys.lazy_plugin_imports == 2
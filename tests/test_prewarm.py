@@ -0,0 +1,88 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+import shutil
+import tempfile
+from client import prewarm
+from client import tts_cache
+
+SOURCE = '''# -*- coding: utf-8-*-
+TTS_PHRASES = [u"再说一遍好吗？", "好的"]
+
+
+def handle(text, mic, profile, wxbot=None):
+    mic.say(u"请重新说", cache=True)
+    mic.say("抱歉, 我的大脑短路了 " +
+            "请稍后再试试.", cache=True)
+    mic.say(u"收到，%d秒后启动拍照" % 3, cache=True)
+    mic.say(u"不缓存")
+    mic.say(u"现在时间是 %s ", args=u"八点")
+'''
+
+
+class FakeSpeaker(object):
+
+    def __init__(self):
+        self.cached = set([u"好的"])
+        self.said = []
+
+    def prewarm(self, phrase):
+        if phrase in self.cached:
+            return False
+        self.cached.add(phrase)
+        self.said.append(phrase)
+        return True
+
+
+class TestPrewarm():
+
+    def testScan(self):
+        """Are cached literals, templates and TTS_PHRASES gathered?"""
+        assert prewarm.scan_source(SOURCE) == [
+            u"再说一遍好吗？", u"好的", u"请重新说",
+            u"抱歉, 我的大脑短路了 请稍后再试试.", u"现在时间是 "]
+
+    def testPhrases(self):
+        """Are the core modules and the plugins scanned?"""
+        phrases = prewarm.get_phrases()
+        assert u"什么?" in phrases
+        assert u"缓存目录已清空" in phrases
+        assert u"再说一遍好吗？" in phrases
+        assert len(phrases) == len(set(phrases))
+
+    def testPrewarmer(self):
+        """Are only the missing phrases synthesized?"""
+        tempdir = tempfile.mkdtemp()
+        try:
+            with mock.patch.object(tts_cache, 'get_cache',
+                                   return_value=tts_cache.TTSCache(tempdir)):
+                mic = mock.Mock(stop_passive=False, in_turn=False,
+                                speaker=FakeSpeaker())
+                prewarmer = prewarm.Prewarmer(
+                    mic, prewarm.scan_source(SOURCE), delay=0, pause=0)
+                prewarmer.run()
+        finally:
+            shutil.rmtree(tempdir)
+        assert prewarmer.synthesized == 4
+        assert u"好的" not in mic.speaker.said
+
+    def testBusy(self):
+        """Does the prewarmer wait for the end of the turn?"""
+        mic = mock.Mock(stop_passive=False, in_turn=True,
+                        speaker=FakeSpeaker())
+        prewarmer = prewarm.Prewarmer(mic, [u"你好"], delay=0, pause=0)
+        waits = []
+
+        def wait(timeout):
+            waits.append(mic.speaker.said[:])
+            # the turn ends while the prewarmer waits for it
+            mic.in_turn = len(waits) < 3
+            return False
+
+        with mock.patch.object(prewarmer, '_full', return_value=False), \
+                mock.patch.object(prewarmer._stopped, 'wait',
+                                  side_effect=wait):
+            prewarmer.run()
+        # the delay, twice the turn, then the pause after the phrase
+        assert waits == [[], [], [], [u"你好"]]
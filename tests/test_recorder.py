@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+from client import recorder
+
+
+class TestRingBuffer():
+
+    def setUp(self):
+        self.ring = recorder.RingBuffer(4, 3)
+
+    def testReadInOrder(self):
+        """Does a reader get every chunk in write order?"""
+        reader = self.ring.reader()
+        for chunk in ['aaaa', 'bbbb']:
+            self.ring.write(chunk)
+        assert reader.read(0) == 'aaaa'
+        assert reader.read(0) == 'bbbb'
+        assert reader.read(0) is None
+
+    def testOverrun(self):
+        """Does a slow reader skip to the oldest chunk still buffered?"""
+        reader = self.ring.reader()
+        for chunk in ['aaaa', 'bbbb', 'cccc', 'dddd']:
+            self.ring.write(chunk)
+        assert reader.read(0) == 'bbbb'
+
+    def testLookback(self):
+        """Does a reader start before the write position on request?"""
+        for chunk in ['aaaa', 'bbbb', 'cccc']:
+            self.ring.write(chunk)
+        reader = self.ring.reader(lookback=2)
+        assert reader.read(0) == 'bbbb'
+        reader.catch_up()
+        assert reader.lag == 0
+
+    def testClose(self):
+        """Does closing the buffer wake up a blocked reader?"""
+        reader = self.ring.reader()
+        self.ring.close()
+        assert reader.read() is None
+
+
+class FakeStream(object):
+
+    def __init__(self, reads):
+        self.reads = list(reads)
+        self.closed = False
+
+    def read(self, chunk, exception_on_overflow=True):
+        data = self.reads.pop(0) if self.reads else IOError('gone')
+        if isinstance(data, Exception):
+            raise data
+        return data
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class TestRecorder():
+
+    def setUp(self):
+        self.recorder = recorder.Recorder(None, rate=4, chunk=2,
+                                          buffer_time=10)
+        self.recorder.BACKOFF = 0
+        self.recorder.MAX_READ_ERRORS = 3
+
+    def run(self, *streams):
+        self.waits = []
+        with mock.patch.object(self.recorder, '_open',
+                               side_effect=streams), \
+                mock.patch.object(self.recorder._stop_event, 'wait',
+                                  side_effect=self.waits.append):
+            self.recorder.run()
+
+    def testReopen(self):
+        """Is the input device reopened after consecutive read errors?"""
+        error = IOError('overrun')
+        first = FakeStream(['aaaa', error, error, error])
+        second = FakeStream(['bbbb'])
+        self.run(first, second)
+        assert first.closed and second.closed
+        assert self.recorder.buffer.closed
+        # backs off before each reopen, then gives up on the second stream
+        assert len(self.waits) == 2 * 2
+        reader = self.recorder.reader(lookback=2)
+        assert reader.read(0) == 'aaaa'
+        assert reader.read(0) == 'bbbb'
+
+    def testReopenFails(self):
+        """Does the capture thread exit when the device can't be reopened?"""
+        first = FakeStream([])
+        self.run(first, IOError('no device'))
+        assert first.closed
+        assert self.recorder.buffer.closed
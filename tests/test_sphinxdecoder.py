@@ -0,0 +1,91 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+import os
+import tempfile
+from client import sphinxdecoder
+
+
+class Vocabulary(object):
+
+    def __init__(self, name, words):
+        self.name = name
+        self.path = name
+        self.compiled_revision = 'revision'
+        self.languagemodel_file = '%s.lm' % name
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            for word in words:
+                f.write('%s %s\n' % (word, ' '.join(word)))
+            self.dictionary_file = f.name
+        self.decoder_kwargs = {'lm': self.languagemodel_file,
+                               'dict': self.dictionary_file}
+
+
+class TestSharedDecoder():
+
+    def setUp(self):
+        self.ps = mock.Mock()
+        self.decoder = self.ps.Decoder.return_value
+        self.decoder.lookup_word.side_effect = \
+            lambda word: 'X' if word == 'HELLO' else None
+        self.keyword = Vocabulary('keyword', ['HELLO'])
+        self.default = Vocabulary('default', ['HELLO', 'WORLD'])
+
+    def tearDown(self):
+        sphinxdecoder._decoders.clear()
+        for vocabulary in (self.keyword, self.default):
+            os.remove(vocabulary.dictionary_file)
+
+    def testSharedModel(self):
+        """Do two vocabularies share one decoder through named searches?"""
+        keyword = sphinxdecoder.get_decoder(self.ps, 'hmm', self.keyword)
+        default = sphinxdecoder.get_decoder(self.ps, 'hmm', self.default)
+        assert self.ps.Decoder.call_count == 1
+        self.decoder.add_word.assert_called_once_with('WORLD', 'W O R L D',
+                                                      True)
+        default.start_utt()
+        self.decoder.set_search.assert_called_with('default')
+        keyword.start_utt()
+        self.decoder.set_search.assert_called_with('keyword')
+        assert keyword.logfile == default.logfile
+
+    def testOldAPI(self):
+        """Does each vocabulary get its own decoder without named searches?"""
+        del self.ps.Decoder.default_config
+        sphinxdecoder.get_decoder(self.ps, 'hmm', self.keyword)
+        sphinxdecoder.get_decoder(self.ps, 'hmm', self.default)
+        assert self.ps.Decoder.call_count == 2
+        self.ps.Decoder.assert_called_with(hmm='hmm', logfn=mock.ANY,
+                                           lm='default.lm',
+                                           dict=self.default.dictionary_file)
+
+    def testReload(self):
+        """Is a recompiled search swapped in when the next utterance starts?"""
+        default = sphinxdecoder.get_decoder(self.ps, 'hmm', self.default)
+        default.start_utt()
+        self.decoder.set_lm_file.reset_mock()
+        default.reload(self.default)
+        self.decoder.set_lm_file.assert_not_called()
+        default.start_utt()
+        self.decoder.set_lm_file.assert_called_once_with('default',
+                                                         'default.lm')
+        self.decoder.set_search.assert_called_with('default')
+
+    def testOpenUtterance(self):
+        """Is an utterance left open ended when another search starts?"""
+        keyword = sphinxdecoder.get_decoder(self.ps, 'hmm', self.keyword)
+        default = sphinxdecoder.get_decoder(self.ps, 'hmm', self.default)
+        keyword.start_utt()
+        keyword.process_raw('data', False, False)
+        default.start_utt()
+        assert self.decoder.end_utt.call_count == 1
+        self.decoder.set_search.assert_called_with('default')
+        with assert_raises(RuntimeError):
+            keyword.process_raw('data', False, False)
+        # the utterance of the default search is left alone
+        keyword.end_utt()
+        assert self.decoder.end_utt.call_count == 1
+        default.process_raw('data', False, True)
+        default.end_utt()
+        assert self.decoder.end_utt.call_count == 2
@@ -0,0 +1,43 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+import requests
+from client import statistic
+
+
+class TestReporter():
+
+    def setUp(self):
+        self.reporter = statistic.Reporter(max_pending=3)
+        # no background thread, the test flushes
+        self.reporter._thread = object()
+        self.post = mock.patch.object(self.reporter._session, 'post').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def testBatch(self):
+        """Are counted events sent one by one on flush?"""
+        self.reporter.add(1)
+        self.reporter.add(1)
+        self.reporter.add(0)
+        assert not self.post.called
+        assert self.reporter.flush() == 3
+        types = [call[1]['data']['type'] for call in self.post.call_args_list]
+        assert types == ['0', '1', '1']
+        assert all(call[1]['timeout'] == statistic.TIMEOUT
+                   for call in self.post.call_args_list)
+        assert self.reporter.pending == 0
+
+    def testBounded(self):
+        """Are unsent events kept, but no more than max_pending?"""
+        self.post.side_effect = requests.ConnectionError
+        for i in range(5):
+            self.reporter.add(1)
+        assert self.reporter.dropped == 2
+        assert self.reporter.flush() == 0
+        assert self.reporter.pending == 3
+        self.post.side_effect = None
+        assert self.reporter.flush() == 3
+        assert self.reporter.pending == 0
@@ -0,0 +1,208 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import audioop
+import inspect
+import mock
+import threading
+import wave
+from client import stt
+
+
+class RecordingSTT(stt.AbstractSTTEngine):
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def transcribe(self, fp):
+        wav_file = wave.open(fp, 'rb')
+        self.params = (wav_file.getframerate(), wav_file.getsampwidth(),
+                       wav_file.getnchannels())
+        return [wav_file.readframes(wav_file.getnframes())]
+
+
+class TestTranscribePCM():
+
+    def setUp(self):
+        self.engine = RecordingSTT()
+        self.audio = bytearray(b'\x01\x02' * 800)
+
+    def testWrapsIntoWav(self):
+        """Does the default transcribe_pcm() hand a WAV to transcribe()?"""
+        view = memoryview(self.audio)[2:10]
+        assert self.engine.transcribe_pcm(view, 8000, 2, 1) == \
+            [b'\x01\x02' * 4]
+        assert self.engine.params == (8000, 2, 1)
+
+    def testSignatures(self):
+        """Do the overrides keep the keywords of transcribe_pcm()?"""
+        expected = inspect.getargspec(stt.AbstractSTTEngine.transcribe_pcm)
+        for engine in stt.get_engines():
+            assert inspect.getargspec(engine.transcribe_pcm) == expected, \
+                engine.SLUG
+
+    def testAsMono16(self):
+        """Is PCM data converted to 16 bit mono at a supported rate?"""
+        stereo = audioop.tostereo(b'\x01\x02' * 80, 2, 1, 1)
+        assert stt._as_mono16(stereo, 16000, 2, 2) == \
+            (b'\x01\x02' * 80, 16000)
+        data, rate = stt._as_mono16(b'\x01\x02' * 80, 32000, 2, 1,
+                                    (16000, 8000))
+        assert rate == 16000 and len(data) == 80
+        assert len(stt._as_mono16(b'\x01' * 8, 16000, 1, 1)[0]) == 16
+        with assert_raises(ValueError):
+            stt._as_mono16(b'\x00' * 12, 16000, 2, 3)
+
+    def testAsBytes(self):
+        """Does _as_bytes() give the content of every buffer type?"""
+        view = memoryview(self.audio)[:4]
+        assert stt._as_bytes(view) == b'\x01\x02\x01\x02'
+        assert stt._as_bytes(self.audio[:2]) == b'\x01\x02'
+        assert stt._as_bytes(b'ab') == b'ab'
+
+
+class TestStreams():
+
+    def testBufferedStream(self):
+        """Does the default stream transcribe the pushed audio on finish?"""
+        engine = RecordingSTT()
+        stream = engine.begin_stream(8000)
+        stream.push(b'\x01\x02')
+        stream.push(memoryview(b'\x03\x04'))
+        assert stream.finish() == [b'\x01\x02\x03\x04']
+        assert engine.params == (8000, 2, 1)
+
+    def testChunkedUpload(self):
+        """Does a chunked upload get every chunk before finish returns?"""
+        received = []
+
+        def upload(chunks):
+            for chunk in chunks:
+                received.append(chunk)
+            return ['HELLO']
+
+        stream = stt.ChunkedUploadStream(upload)
+        stream.push(b'ab')
+        stream.push(bytearray(b'cd'))
+        assert stream.finish() == ['HELLO']
+        assert received == [b'ab', b'cd']
+
+    def testChunkedUploadStalled(self):
+        """Does finish give up on an upload that doesn't answer?"""
+        answered = threading.Event()
+
+        def upload(chunks):
+            list(chunks)
+            answered.wait(5)
+            return ['HELLO']
+
+        stream = stt.ChunkedUploadStream(upload)
+        stream.TIMEOUT = 0.05
+        stream.push(b'ab')
+        assert stream.finish() == []
+        answered.set()
+
+    def testChunkedUploadCancelled(self):
+        """Is the request body aborted when the upload is cancelled?"""
+        received = []
+
+        def upload(chunks):
+            for chunk in chunks:
+                received.append(chunk)
+            received.append('sent')
+            return ['HELLO']
+
+        stream = stt.ChunkedUploadStream(upload)
+        stream.push(b'ab')
+        stream.cancel()
+        stream._thread.join(5)
+        assert received == [b'ab']
+        assert stream._result == []
+
+    def testPostTimeout(self):
+        """Does a request to Google time out instead of hanging?"""
+        with mock.patch.object(stt.GoogleSTT, '__init__',
+                               return_value=None):
+            engine = stt.GoogleSTT()
+        engine._logger = mock.Mock()
+        engine._http = mock.Mock()
+        engine._http.post.side_effect = stt.requests.exceptions.Timeout
+        engine._request_url = 'https://example.com/'
+        assert engine._post(b'ab', 16000) == []
+        assert engine._http.post.call_args[1]['timeout'] == engine.TIMEOUT
+
+    def testPocketSphinxStream(self):
+        """Is every pushed chunk decoded before finish is called?"""
+        decoder = mock.Mock()
+        decoder.get_hyp.return_value = ('HELLO', 'utt', -1)
+        engine = mock.Mock(_decoder=decoder)
+        engine._end_utterance.return_value = ['HELLO']
+        stream = stt.PocketSphinxStream(engine)
+        stream.push(bytearray(b'ab'))
+        decoder.start_utt.assert_called_once_with()
+        decoder.process_raw.assert_called_once_with(b'ab', False, False)
+        assert stream.partial() == ['HELLO']
+        assert stream.finish() == ['HELLO']
+
+
+class FakeDecoder(object):
+    # spots 'KW' in the audio of the running utterance
+
+    def __init__(self):
+        self.audio = None
+        self.decoded = 0
+
+    def start_utt(self):
+        self.audio = b''
+
+    def process_raw(self, data, no_search, full_utt):
+        self.audio += data
+        self.decoded += 1
+
+    def get_hyp(self):
+        return ('DINGDANG' if b'KW' in self.audio else '', 'utt', -1)
+
+    def end_utt(self):
+        self.audio = None
+
+
+class TestKeywordStream():
+
+    def setUp(self):
+        with mock.patch.object(stt.PocketSphinxSTT, '__init__',
+                               return_value=None):
+            self.engine = stt.PocketSphinxSTT()
+        self.engine._logger = mock.Mock()
+        self.engine._decoder = FakeDecoder()
+        self.engine.start_keyword_stream()
+
+    def feed(self, chunks):
+        return [self.engine.process_keyword_chunk(data, voiced)
+                for data, voiced in chunks]
+
+    def testHit(self):
+        """Is the keyword spotted in the chunk it ends in?"""
+        results = self.feed([(b'..', False), (b'KW', True)])
+        assert results == [[], ['DINGDANG']]
+
+    def testMiss(self):
+        """Are unvoiced chunks not decoded, and the utterance ended?"""
+        self.engine.KEYWORD_HANGOVER = 2
+        results = self.feed([(b'..', False)] * 5 + [(b'ab', True)] +
+                            [(b'..', False)] * 2)
+        assert not any(results)
+        assert self.engine._decoder.audio is None
+        # the overlap before the voiced chunk is decoded with it
+        assert self.engine._decoder.decoded == 3 + 5
+
+    def testSplit(self):
+        """Is a keyword split across chunks and utterances spotted?"""
+        self.engine.KEYWORD_UTT_CHUNKS = 2
+        results = self.feed([(b'..', True), (b'.K', True), (b'W.', True)])
+        assert results == [[], [], ['DINGDANG']]
+        # the keyword started before its voiced chunk
+        self.engine.end_keyword_stream()
+        self.engine.start_keyword_stream()
+        results = self.feed([(b'.K', False), (b'W.', True)])
+        assert results == [[], ['DINGDANG']]
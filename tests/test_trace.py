@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+from client import trace
+
+
+class TestTrace():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'trace.jsonl')
+        trace.configure(True, self.fname)
+
+    def tearDown(self):
+        trace.configure(False)
+        shutil.rmtree(self.tempdir)
+
+    def _records(self):
+        with open(self.fname, 'r') as f:
+            return [json.loads(line) for line in f]
+
+    def testNesting(self):
+        """Do nested spans, also in other threads, share the trace id?"""
+        with trace.span('conversation') as root:
+            with trace.span('stt', engine='sphinx'):
+                pass
+
+            def worker():
+                with trace.attached(root):
+                    with trace.span('plugin', plugin='Echo'):
+                        pass
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        assert trace.current() is None
+        records = dict((record['stage'], record)
+                       for record in self._records())
+        assert records['stt']['engine'] == 'sphinx'
+        assert records['plugin']['plugin'] == 'Echo'
+        for stage in ('stt', 'plugin'):
+            assert records[stage]['parent'] == root.span_id
+            assert records[stage]['trace'] == root.span_id
+        assert records['conversation']['parent'] is None
+
+    def testError(self):
+        """Is the exception a span ended with recorded?"""
+        with assert_raises(ValueError):
+            with trace.span('tts'):
+                raise ValueError
+        assert self._records()[0]['error'] == 'ValueError'
+
+    def testPercentiles(self):
+        """Are the percentiles nearest-rank?"""
+        stats = trace.percentiles(range(1, 101))
+        assert stats['count'] == 100
+        assert (stats['p50'], stats['p95'], stats['p99']) == (50, 95, 99)
+        assert stats['max'] == 100
+        assert trace.percentiles([]) == {'count': 0}
+
+    def testDisabled(self):
+        """Are spans dropped while tracing is disabled?"""
+        trace.configure(False)
+        with trace.span('playback') as span:
+            span.set(ignored=True)
+        assert trace.current() is None
+        assert 'playback' not in trace.summarize_file(self.fname)
+
+    def testPerPlugin(self):
+        """Are plugin spans also summarized per plugin?"""
+        for plugin in ('Echo', 'Echo', 'Time'):
+            with trace.span('plugin', plugin=plugin):
+                pass
+        with trace.span('stt'):
+            pass
+        for stats in (trace.summary(), trace.summarize_file(self.fname)):
+            assert stats['plugin']['count'] >= 3
+            assert stats[('plugin', 'Echo')]['count'] >= 2
+            assert stats[('plugin', 'Time')]['count'] >= 1
+            assert ('stt', None) not in stats
+        lines = trace.format_summary(trace.summarize_file(self.fname))
+        lines = [line.split()[0] for line in lines.splitlines()]
+        assert lines == ['stage', 'plugin', 'Echo', 'Time', 'stt']
+
+    def testDefault(self):
+        """Are summaries kept without a trace section in the profile?"""
+        trace.configure(False)
+        trace._enabled = None
+        with mock.patch.object(trace.config, 'has', return_value=False):
+            with trace.span('default-stage'):
+                pass
+        assert trace.enabled()
+        assert trace._writer is None
+        assert trace.summary()['default-stage']['count'] == 1
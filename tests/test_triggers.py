@@ -0,0 +1,25 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+from client import triggers
+
+
+class TestTriggerAutomaton():
+
+    def setUp(self):
+        self.automaton = triggers.TriggerAutomaton()
+        for keyword, value in [(u'时间', 'time'), (u'几点', 'time'),
+                               (u'he', 'he'), (u'she', 'she'),
+                               (u'hers', 'hers'), (u'ECHO', 'echo')]:
+            self.automaton.add(keyword, value)
+        self.automaton.build()
+
+    def testOverlapping(self):
+        """Are overlapping keywords found in a single pass?"""
+        assert self.automaton.match('ushers') == set(['he', 'she', 'hers'])
+
+    def testCaseAndEncoding(self):
+        """Is matching case-insensitive for str and unicode texts?"""
+        assert self.automaton.match('现在几点了') == set(['time'])
+        assert self.automaton.match(u'echo 你好') == set(['echo'])
+        assert self.automaton.match(u'你好') == set()
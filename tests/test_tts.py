@@ -0,0 +1,231 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+import wave
+from client import executor
+from client import tts
+from client import tts_cache
+
+
+class PipelineTTS(tts.AbstractMp3TTSEngine):
+
+    def __init__(self):
+        super(PipelineTTS, self).__init__()
+        self.played = []
+        self.files = []
+        self.fetching = 0
+        self.max_fetching = 0
+        self._lock = threading.Lock()
+
+    def get_speech(self, phrase):
+        with self._lock:
+            self.fetching += 1
+            self.max_fetching = max(self.max_fetching, self.fetching)
+        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
+            f.write(phrase.encode('utf-8'))
+        self.files.append(f.name)
+        with self._lock:
+            self.fetching -= 1
+        return f.name
+
+    def play_mp3(self, filename, remove=False):
+        with open(filename, 'r') as f:
+            self.played.append(f.read().decode('utf-8'))
+
+    def play_wav(self, filename):
+        f = wave.open(filename, 'rb')
+        frames = f.readframes(f.getnframes())
+        self.played.append(frames.decode('utf-8').replace(u' ', u''))
+        f.close()
+
+
+class FakeMadFile(object):
+    # "decodes" the text PipelineTTS writes into its speech files, padded
+    # to whole 16 bit stereo frames
+
+    def __init__(self, filename):
+        with open(filename, 'r') as f:
+            text = f.read()
+        self.chunks = [text + ' ' * (-len(text) % 4)]
+
+    def samplerate(self):
+        return 16000
+
+    def mode(self):
+        return FAKE_MAD.MODE_STEREO
+
+    def read(self):
+        return self.chunks.pop() if self.chunks else None
+
+
+FAKE_MAD = mock.Mock(MadFile=FakeMadFile, MODE_SINGLE_CHANNEL=1,
+                     MODE_STEREO=3)
+
+
+class TestPipelinedSay():
+
+    def testSplitSentences(self):
+        """Are replies split at the end of sentences only?"""
+        engine = PipelineTTS()
+        assert engine.split_sentences(u"你好。今天3.5度！\n好的") == \
+            [u"你好", u"今天3.5度", u"好的"]
+        assert engine.split_sentences("Hi there. Bye") == \
+            [u"Hi there", u"Bye"]
+
+    def testOrder(self):
+        """Are the sentences played in order and their files removed?"""
+        engine = PipelineTTS()
+        engine.PIPELINE_DEPTH = 1
+        sentences = [u"第%d句" % i for i in range(8)]
+        engine.say(u"。".join(sentences))
+        assert engine.played == sentences
+        assert engine.max_fetching <= 2
+        assert not any(os.path.exists(fname) for fname in engine.files)
+
+    def testDisabled(self):
+        """Is the reply said at once without pipelining?"""
+        engine = PipelineTTS()
+        engine.PIPELINE_DEPTH = 0
+        engine.say(u"你好。再见")
+        assert engine.played == [u"你好。再见"]
+
+    def testCancelled(self):
+        """Does a cancelled plugin stop its reply between sentences?"""
+        engine = PipelineTTS()
+        engine.PIPELINE_DEPTH = 2
+        play_mp3 = engine.play_mp3
+
+        def play_and_cancel(filename, remove=False):
+            play_mp3(filename)
+            executor.current_task().cancel()
+        engine.play_mp3 = play_and_cancel
+
+        class Plugin(object):
+            __name__ = 'Plugin'
+            TIMEOUT = 5
+
+        pool = executor.PluginExecutor(workers=1)
+        sentences = [u"第%d句" % i for i in range(5)]
+        task = pool.submit(pool.run_plugin, Plugin, engine.say,
+                           u"。".join(sentences))
+        assert task.wait(5)
+        assert isinstance(task.exception, executor.PluginCancelled)
+        assert engine.played == sentences[:1]
+        # sentences still being fetched are discarded when they arrive
+        deadline = time.time() + 5
+        while engine.fetching and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        assert not any(os.path.exists(fname) for fname in engine.files)
+
+
+class TestCachedSay():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = tts_cache.TTSCache(self.tempdir)
+        mock.patch.object(tts_cache, 'get_cache',
+                          return_value=self.cache).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        # stops the timer that writes the index
+        self.cache.save()
+        shutil.rmtree(self.tempdir)
+
+    def testCache(self):
+        """Is a cached phrase synthesized once per engine parameters?"""
+        engine = PipelineTTS()
+        engine.say(u"你好", cache=True)
+        engine.say(u"你好", cache=True)
+        assert engine.played == [u"你好", u"你好"]
+        assert len(engine.files) == 1
+        engine.cache_params = lambda: {'per': 1}
+        engine.say(u"你好", cache=True)
+        assert len(engine.files) == 2
+        stats = self.cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 2)
+
+    def testRemoved(self):
+        """Is a phrase whose cached file is gone synthesized again?"""
+        engine = PipelineTTS()
+        engine.say(u"你好", cache=True)
+        key = self.cache.key(engine.SLUG, {}, u"你好")
+        os.remove(self.cache.get(key))
+        engine.play_speech = mock.Mock(side_effect=[IOError, None])
+        engine.say(u"你好", cache=True)
+        assert len(engine.files) == 2
+        assert os.path.exists(self.cache.get(key))
+
+
+class TestTemplateSay():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = tts_cache.TTSCache(self.tempdir)
+        mock.patch.object(tts_cache, 'get_cache',
+                          return_value=self.cache).start()
+        mock.patch.object(tts, 'mad', FAKE_MAD).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        # stops the timer that writes the index
+        self.cache.save()
+        shutil.rmtree(self.tempdir)
+
+    def testSplit(self):
+        """Are templates split into constant and formatted parts?"""
+        assert tts.split_template(u"现在时间是 %s ", u"八点") == \
+            [(u"现在时间是 ", True), (u"八点", False), (u" ", True)]
+        assert tts.split_template(u"%s%d%%的电量", (u"还有", 50)) == \
+            [(u"还有50", False), (u"%的电量", True)]
+        assert tts.template_constants(u"%s%d%%的电量") == [u"%的电量"]
+        with assert_raises(TypeError):
+            tts.split_template(u"%s和%s", u"一")
+
+    def testSegments(self):
+        """Are only the arguments synthesized after the first time?"""
+        engine = PipelineTTS()
+        engine.say_template(u"现在时间是%s。", u"八点")
+        engine.say_template(u"现在时间是%s。", u"九点")
+        assert engine.played == [u"现在时间是八点", u"现在时间是九点"]
+        assert len(engine.files) == 3
+        assert all(not os.path.exists(fname) for fname in engine.files)
+        assert self.cache.stats()['entries'] == 1
+        # the cached segment was decoded once
+        assert any(name.endswith('.wav') for name in os.listdir(self.tempdir))
+
+    def testRemovedSegment(self):
+        """Is a cached segment whose file is gone fetched again?"""
+        engine = PipelineTTS()
+        engine.say_template(u"现在时间是%s。", u"八点")
+        for name in os.listdir(self.tempdir):
+            if name.endswith('.wav'):
+                os.remove(os.path.join(self.tempdir, name))
+        engine.say_template(u"现在时间是%s。", u"九点")
+        assert engine.played == [u"现在时间是八点", u"现在时间是九点"]
+        assert len(engine.files) == 4
+        assert self.cache.stats()['entries'] == 1
+
+    def testCachedAsWav(self):
+        """Is cached speech stored and replayed as WAV?"""
+        engine = PipelineTTS()
+        engine.play_mp3 = mock.Mock()
+        engine.play_wav = mock.Mock()
+        engine.say(u"你好", cache=True)
+        engine.say(u"你好", cache=True)
+        assert engine.play_mp3.call_count == 1
+        assert engine.play_wav.call_args[0][0].endswith('.wav')
+
+    def testWithoutMad(self):
+        """Is the reply said at once without mad?"""
+        tts.mad = None
+        engine = PipelineTTS()
+        engine.say_template(u"现在时间是%s", u"八点")
+        assert engine.played == [u"现在时间是八点"]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import itertools
+import mock
+import os
+import shutil
+import tempfile
+from client import tts_cache
+
+
+class TestTTSCache():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'cache')
+        self.cache = tts_cache.TTSCache(self.path, max_bytes=250)
+        # a clock that ticks on every call, so accesses are ordered
+        clock = itertools.count(1).next
+        mock.patch.object(tts_cache.time, 'time', side_effect=clock).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        # stops the timer that writes the index
+        self.cache.save()
+        shutil.rmtree(self.tempdir)
+
+    def _speech(self, size=100):
+        fd, fname = tempfile.mkstemp(suffix='.mp3', dir=self.tempdir)
+        os.write(fd, 'x' * size)
+        os.close(fd)
+        return fname
+
+    def testKey(self):
+        """Do the engine and its parameters change the key?"""
+        key = self.cache.key('baidu-tts', {'per': 0}, u'你好')
+        assert key == self.cache.key('baidu-tts', {'per': 0}, '你好')
+        assert key != self.cache.key('baidu-tts', {'per': 1}, u'你好')
+        assert key != self.cache.key('ali-tts', {'per': 0}, u'你好')
+        assert key != self.cache.key('baidu-tts', {'per': 0}, u'您好')
+
+    def testHitAndMiss(self):
+        """Are hits and misses counted?"""
+        assert self.cache.get('a') is None
+        fname = self.cache.put('a', self._speech())
+        assert fname.endswith('.mp3') and os.path.exists(fname)
+        assert self.cache.get('a') == fname
+        stats = self.cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 1)
+        assert stats['hit_rate'] == 0.5
+        assert (stats['entries'], stats['bytes']) == (1, 100)
+
+    def testEviction(self):
+        """Are the least recently used entries evicted beyond the budget?"""
+        a = self.cache.put('a', self._speech())
+        b = self.cache.put('b', self._speech())
+        self.cache.get('a')
+        self.cache.put('c', self._speech())
+        assert self.cache.get('b') is None
+        assert not os.path.exists(b)
+        assert self.cache.get('a') == a
+        stats = self.cache.stats()
+        assert stats['evictions'] == 1
+        assert stats['bytes'] == 200
+
+    def testPersistence(self):
+        """Does a new cache pick up the index and the counters?"""
+        fname = self.cache.put('a', self._speech())
+        self.cache.get('a')
+        self.cache.save()
+        cache = tts_cache.TTSCache(self.path, max_bytes=250)
+        assert cache.get('a') == fname
+        assert cache.stats()['hits'] == 2
+        cache.save()
+
+    def testDeferredSave(self):
+        """Is the index written by the timer, not by lookups and puts?"""
+        self.cache.put('a', self._speech())
+        self.cache.get('a')
+        assert not os.path.exists(self.cache.index_file)
+        self.cache._timer.function()
+        assert os.path.exists(self.cache.index_file)
+        assert self.cache._timer is None
+
+    def testRemoved(self):
+        """Are entries whose file is gone dropped when it's opened?"""
+        fname = self.cache.put('a', self._speech())
+        os.remove(fname)
+        # lookups trust the index
+        assert self.cache.contains('a')
+        assert self.cache.get('a') == fname
+        self.cache.discard('a')
+        assert not self.cache.contains('a')
+        assert self.cache.get('a') is None
+        stats = self.cache.stats()
+        assert (stats['entries'], stats['hits'], stats['misses']) == (0, 0, 2)
+        self.cache.put('b', self._speech())
+        self.cache.clear()
+        assert self.cache.stats()['entries'] == 0
+        assert os.listdir(self.path) == [tts_cache.TTSCache.INDEX]
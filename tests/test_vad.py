@@ -0,0 +1,51 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import math
+import struct
+from nose.tools import *
+from client import vad
+
+
+def tone(seconds, amplitude, rate=16000):
+    count = int(seconds * rate)
+    return struct.pack('<%dh' % count, *[
+        int(amplitude * math.sin(2 * math.pi * 440 * i / rate))
+        for i in range(count)])
+
+
+def chunks(data, size=2048):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestEnergyEndpointer():
+
+    def setUp(self):
+        self.endpointer = vad.EnergyEndpointer(hangover=0.5)
+        self.endpointer.reset(1000)
+
+    def feed(self, data):
+        for chunk in chunks(data):
+            if self.endpointer.process(chunk):
+                return True
+        return False
+
+    def testSpeechSpan(self):
+        """Does the endpointer find the speech between two silences?"""
+        assert self.feed(tone(1, 0) + tone(1, 8000) + tone(2, 0))
+        assert abs(self.endpointer.speech_start - 1) < 0.05
+        assert abs(self.endpointer.speech_end - 2) < 0.05
+
+    def testNoSpeech(self):
+        """Does the endpointer give up if nobody speaks?"""
+        assert self.feed(tone(4, 0))
+        assert self.endpointer.speech_start is None
+
+    def testShortBurst(self):
+        """Are bursts shorter than min_speech ignored?"""
+        assert not self.feed(tone(0.5, 0) + tone(0.05, 8000) + tone(0.5, 0))
+        assert self.endpointer.speech_start is None
+
+
+def testGetEndpointer():
+    assert isinstance(vad.get_instance(), vad.EnergyEndpointer)
+    assert vad.get_endpointer_by_slug('legacy') is vad.LegacyEndpointer
@@ -0,0 +1,98 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+from nose.tools import *
+import mock
+import os
+import shutil
+import tempfile
+from client import vocabcompiler
+
+
+class TestVocabularyCompile():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.vocabulary = vocabcompiler.DummyVocabulary(path=self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testKeepsLastRevision(self):
+        """Does a failed compilation keep the last compiled revision?"""
+        revision = self.vocabulary.compile(['HELLO'])
+        with mock.patch.object(self.vocabulary, '_compile_vocabulary',
+                               side_effect=RuntimeError):
+            assert_raises(RuntimeError, self.vocabulary.compile, ['WORLD'])
+        assert self.vocabulary.compiled_revision == revision
+        assert not os.path.exists(self.vocabulary.path + '.new')
+        assert len(self._revisions()) == 1
+
+    def _revisions(self):
+        parent = os.path.dirname(self.vocabulary.path)
+        return sorted(fname for fname in os.listdir(parent)
+                      if fname.startswith('default.'))
+
+    def testSwap(self):
+        """Is the new revision swapped in and the one before kept?"""
+        self.vocabulary.compile(['HELLO'])
+        first = os.path.realpath(self.vocabulary.path)
+        self.vocabulary.compile(['WORLD'])
+        second = os.path.realpath(self.vocabulary.path)
+        assert os.path.islink(self.vocabulary.path)
+        assert self.vocabulary.matches_phrases(['WORLD'])
+        assert self._revisions() == sorted(
+            os.path.basename(path) for path in (first, second))
+        self.vocabulary.compile(['AGAIN'])
+        assert not os.path.exists(first)
+        assert len(self._revisions()) == 2
+
+    def testCompiledInPlace(self):
+        """Is a vocabulary compiled in place replaced by a link?"""
+        os.makedirs(self.vocabulary.path)
+        with open(self.vocabulary.revision_file, 'w') as f:
+            f.write('old')
+        self.vocabulary.compile(['HELLO'])
+        assert os.path.islink(self.vocabulary.path)
+        assert self.vocabulary.matches_phrases(['HELLO'])
+
+    def testBackground(self):
+        """Is the callback called once the new revision is in place?"""
+        done = []
+        thread = self.vocabulary.compile_in_background(['HELLO'],
+                                                       done.append)
+        thread.join()
+        assert done == [self.vocabulary]
+        assert self.vocabulary.matches_phrases(['HELLO'])
+
+
+class TestVoxForgeLexicon():
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tempdir, 'VoxForgeDict')
+        with open(self.fname, 'w') as f:
+            f.write('HELLO [HELLO] hh ah l ow\n' +
+                    'HELLO [HELLO] hh eh l ow\n' +
+                    'WORLD [WORLD] w er l d\n' +
+                    'ABOUT [ABOUT] ax b aw t\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testTranslateWord(self):
+        """Are words looked up in the index like in the lexicon?"""
+        lexicon = vocabcompiler.JuliusVocabulary.VoxForgeLexicon(self.fname)
+        assert lexicon.index_file == self.fname + '.idx'
+        assert lexicon.translate_word('HELLO') == ['hh ah l ow',
+                                                   'hh eh l ow']
+        assert lexicon.translate_word('ABOUT') == ['ax b aw t']
+        assert lexicon.translate_word('WORLD') == ['w er l d']
+        assert lexicon.translate_word('MISSING') == []
+
+    def testCachedIndex(self):
+        """Is the index reused as long as the lexicon doesn't change?"""
+        vocabcompiler.JuliusVocabulary.VoxForgeLexicon(self.fname)
+        with mock.patch.object(vocabcompiler.JuliusVocabulary.VoxForgeLexicon,
+                               'parse') as parse:
+            vocabcompiler.JuliusVocabulary.VoxForgeLexicon(self.fname)
+            assert not parse.called